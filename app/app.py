@@ -1,111 +1,143 @@
-from flask import Flask, redirect, url_for
+from flask import Flask, redirect, url_for, render_template, session
+from flask.json.provider import DefaultJSONProvider
 from config import Config
+from cache import cache
+from decimal import Decimal
+import importlib
 import logging
+import orjson
 import os
-
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+import time
+
+class _FormatterHoraCacheada(logging.Formatter):
+    """Formatter que formatea la fecha con strftime solo una vez por segundo"""
+
+    _cache = (None, '')
+
+    def formatTime(self, record, datefmt=None):
+        segundo = int(record.created)
+        cacheado, texto = self._cache
+        if cacheado != segundo:
+            texto = time.strftime('%Y-%m-%d %H:%M:%S', self.converter(segundo))
+            self._cache = (segundo, texto)
+        return f"{texto},{int(record.msecs):03d}"
+
+# Configurar logging (equivalente a basicConfig: no duplica handlers existentes)
+_root_logger = logging.getLogger()
+if not _root_logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(_FormatterHoraCacheada('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    _root_logger.addHandler(_handler)
+    _root_logger.setLevel(logging.INFO)
 logger = logging.getLogger(__name__)
 
-def create_app(config_class=Config):
-    """Factory para crear la aplicación Flask"""
+def _json_default(obj):
+    """Tipos que orjson no serializa por sí mismo"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    return DefaultJSONProvider.default(obj)
+
+class ORJSONProvider(DefaultJSONProvider):
+    """
+    Proveedor JSON basado en orjson
+
+    orjson serializa en C las fechas (ISO 8601), datetimes y números, así
+    que las rutas pueden devolver las filas de la BD sin convertirlas antes.
+    """
+
+    _OPCIONES = orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_json_default, option=self._OPCIONES).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+# Blueprints de la aplicación: (módulo de rutas, atributo, url_prefix)
+BLUEPRINTS = [
+    ('auth.routes', 'auth_bp', None),
+    ('ventas.routes', 'ventas_bp', '/ventas'),
+    ('reportes.routes', 'reportes_bp', '/reportes'),
+    ('contabilidad.routes', 'contabilidad_bp', '/contabilidad'),
+]
+
+# Vistas protegidas que solo renderizan una plantilla: (ruta, endpoint, plantilla)
+VISTAS_PRINCIPALES = [
+    ('/dashboard', 'dashboard', 'dashboard.html'),
+    ('/modulo/ventas', 'modulo_ventas', 'modulos/ventas.html'),
+    ('/modulo/contabilidad', 'modulo_contabilidad', 'modulos/contabilidad.html'),
+    ('/modulo/operativo', 'modulo_operativo', 'modulos/operativo.html'),
+    ('/modulo/operativo/tareas', 'modulo_operativo_tareas', 'modulos/tareas.html'),
+]
+
+def _vista_plantilla(template):
+    """Crear una vista que renderiza la plantilla con el usuario de la sesión"""
+    def vista():
+        return render_template(template, user=session.get('user'))
+    return vista
+
+def create_app(config_class=Config, blueprints=None):
+    """
+    Factory para crear la aplicación Flask
+
+    Args:
+        config_class: Clase de configuración
+        blueprints (list): Módulos de rutas a registrar (None registra todos los de BLUEPRINTS)
+    """
 
     app = Flask(__name__)
     app.config.from_object(config_class)
+    app.json = ORJSONProvider(app)
 
     # Inicializar configuración
     config_class.init_app(app)
+    cache.init_app(app)
 
-    # Importar y registrar Blueprints
-    from auth import auth_bp
-    from ventas import ventas_bp
-    from reportes import reportes_bp
-    from contabilidad import contabilidad_bp
-
-    app.register_blueprint(auth_bp)
-    app.register_blueprint(ventas_bp, url_prefix='/ventas')
-    app.register_blueprint(reportes_bp, url_prefix='/reportes')
-    app.register_blueprint(contabilidad_bp, url_prefix='/contabilidad')
-
-    # Ruta raíz
-    @app.route('/')
-    def index():
-        return redirect(url_for('auth.login'))
-
-    # Ruta de dashboard principal
-    @app.route('/dashboard')
-    def dashboard():
-        from flask import render_template, session
-        from auth import login_required
-
-        @login_required
-        def dashboard_view():
-            return render_template('dashboard.html', user=session.get('user'))
-
-        return dashboard_view()
+    # Sesiones del lado del servidor en Redis: la cookie solo lleva el ID de sesión
+    if app.config.get('CACHE_REDIS_URL'):
+        import redis
+        from flask_session import Session
 
-    # Rutas de módulos principales
-    @app.route('/modulo/ventas')
-    def modulo_ventas():
-        from flask import render_template, session
-        from auth import login_required
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis.from_url(app.config['CACHE_REDIS_URL'])
+        Session(app)
 
-        @login_required
-        def modulo_ventas_view():
-            return render_template('modulos/ventas.html', user=session.get('user'))
+    # Importar y registrar solo los Blueprints solicitados
+    from auth import login_required
 
-        return modulo_ventas_view()
+    for modulo, atributo, url_prefix in BLUEPRINTS:
+        if blueprints is not None and modulo not in blueprints:
+            continue
+        blueprint = getattr(importlib.import_module(modulo), atributo)
+        app.register_blueprint(blueprint, url_prefix=url_prefix)
 
-    @app.route('/modulo/contabilidad')
-    def modulo_contabilidad():
-        from flask import render_template, session
-        from auth import login_required
+    # Ruta raíz (la URL de login se resuelve una sola vez; la respuesta se crea
+    # en cada petición porque Flask le agrega la cookie de sesión)
+    login_url = None
 
-        @login_required
-        def modulo_contabilidad_view():
-            return render_template('modulos/contabilidad.html', user=session.get('user'))
-
-        return modulo_contabilidad_view()
-
-    @app.route('/modulo/operativo')
-    def modulo_operativo():
-        from flask import render_template, session
-        from auth import login_required
-
-        @login_required
-        def modulo_operativo_view():
-            return render_template('modulos/operativo.html', user=session.get('user'))
-
-        return modulo_operativo_view()
-
-    @app.route('/modulo/operativo/tareas')
-    def modulo_operativo_tareas():
-        from flask import render_template, session
-        from auth import login_required
-
-        @login_required
-        def modulo_operativo_tareas_view():
-            return render_template('modulos/tareas.html', user=session.get('user'))
+    @app.route('/')
+    def index():
+        nonlocal login_url
+        if login_url is None:
+            login_url = url_for('auth.login')
+        return redirect(login_url)
 
-        return modulo_operativo_tareas_view()
+    # Dashboard y rutas de módulos principales
+    for ruta, endpoint, template in VISTAS_PRINCIPALES:
+        app.add_url_rule(ruta, endpoint, login_required(_vista_plantilla(template)))
 
     # Manejador de errores 404
     @app.errorhandler(404)
     def not_found(error):
-        from flask import render_template
         return render_template('404.html'), 404
 
     # Manejador de errores 500
     @app.errorhandler(500)
     def internal_error(error):
-        from flask import render_template
         logger.error(f"Error 500: {str(error)}")
         return render_template('500.html'), 500
 
-    logger.info(f"Aplicación {Config.APP_NAME} v{Config.APP_VERSION} iniciada")
+    logger.info("Aplicación %s v%s iniciada", Config.APP_NAME, Config.APP_VERSION)
 
     return app
 
@@ -118,11 +150,11 @@ if __name__ == '__main__':
         init_database()
         logger.info("Base de datos inicializada")
     except Exception as e:
-        logger.warning(f"No se pudo inicializar la BD (puede que ya exista): {str(e)}")
+        logger.warning("No se pudo inicializar la BD (puede que ya exista): %s", e)
 
-    # Ejecutar aplicación
+    # Servidor de desarrollo; en producción usar `gunicorn wsgi:app` (ver gunicorn.conf.py)
     app.run(
         host='0.0.0.0',
         port=5000,
-        debug=True
+        debug=os.environ.get('FLASK_ENV') != 'production'
     )
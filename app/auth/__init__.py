@@ -2,5 +2,5 @@ from flask import Blueprint
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
-from . import routes
-from .routes import login_required
+# Las rutas se cargan desde create_app; el decorador no depende de ellas
+from .decorators import login_required
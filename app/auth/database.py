@@ -2,14 +2,22 @@
 Funciones de base de datos para el módulo de autenticación
 """
 import logging
-from database import execute_query
+from psycopg2 import sql
+from database import execute_query, execute_prepared, get_db_connection
+from cache import cache, cache_compartida
 
 logger = logging.getLogger(__name__)
 
+# Columnas que se pueden modificar con actualizar_usuario
+_CAMPOS_PERMITIDOS = frozenset(('nombre', 'apellido', 'email', 'rol', 'activo'))
+
+# Queries UPDATE ya compuestas, por tupla de columnas
+_UPDATE_QUERIES = {}
+
 
 def obtener_usuario_por_email(email):
     """
-    Buscar usuario por email
+    Buscar usuario por email (sin caché: la fila incluye el hash de la contraseña)
 
     Args:
         email (str): Email del usuario
@@ -21,14 +29,14 @@ def obtener_usuario_por_email(email):
         query = """
             SELECT id, nombre, apellido, email, password, rol, activo, fecha_creacion
             FROM usuarios
-            WHERE email = %s
+            WHERE email = $1
             LIMIT 1
         """
 
-        results = execute_query(query, (email,))
+        results = execute_prepared('usuario_por_email', query, (email,))
 
         if results:
-            return dict(results[0])
+            return results[0]
 
         return None
 
@@ -37,28 +45,59 @@ def obtener_usuario_por_email(email):
         raise
 
 
+def existe_email(email):
+    """
+    Verificar si ya existe un usuario con el email dado
+
+    Args:
+        email (str): Email a verificar
+
+    Returns:
+        bool: True si el email ya está registrado
+    """
+    try:
+        query = "SELECT 1 FROM usuarios WHERE email = %s LIMIT 1"
+        return bool(execute_query(query, (email,)))
+
+    except Exception as e:
+        logger.error(f"Error verificando email: {str(e)}")
+        raise
+
+
 def obtener_usuario_por_id(user_id):
     """
     Buscar usuario por ID
 
+    Solo se cachea entre peticiones con Redis (se invalida al actualizar en
+    todos los workers); con una caché por worker un usuario desactivado o
+    editado seguiría vigente en los demás, así que se consulta cada vez y
+    solo se reutiliza dentro de la petición (g.current_user).
+
     Args:
         user_id (int): ID del usuario
 
     Returns:
         dict: Datos del usuario o None si no existe
     """
+    if cache_compartida():
+        return _usuario_por_id_cacheado(user_id)
+    return _consultar_usuario_por_id(user_id)
+
+
+def _consultar_usuario_por_id(user_id):
+    """Consultar el usuario por ID en la base de datos"""
     try:
         query = """
             SELECT id, nombre, apellido, email, rol, activo, fecha_creacion
             FROM usuarios
-            WHERE id = %s
+            WHERE id = $1
             LIMIT 1
         """
 
-        results = execute_query(query, (user_id,))
+        results = execute_prepared('usuario_por_id', query, (user_id,))
 
         if results:
-            return dict(results[0])
+            return results[0]
 
         return None
 
@@ -67,6 +106,9 @@ def obtener_usuario_por_id(user_id):
         raise
 
 
+_usuario_por_id_cacheado = cache.memoize(timeout=300)(_consultar_usuario_por_id)
+
+
 def crear_usuario(nombre, apellido, email, password_hash, rol='usuario'):
     """
     Crear nuevo usuario
@@ -89,19 +131,15 @@ def crear_usuario(nombre, apellido, email, password_hash, rol='usuario'):
             RETURNING id
         """
 
-        import psycopg2
-        from database import get_db_connection
-
-        connection = get_db_connection()
-        cursor = connection.cursor()
+        with get_db_connection() as connection:
+            cursor = connection.cursor()
 
-        cursor.execute(query, (nombre, apellido, email, password_hash, rol, True))
-        user_id = cursor.fetchone()['id']
+            cursor.execute(query, (nombre, apellido, email, password_hash, rol, True))
+            user_id = cursor.fetchone()['id']
 
-        connection.commit()
-        connection.close()
+        cache.delete_memoized(listar_usuarios)
 
-        logger.info(f"Usuario creado exitosamente: {email} (ID: {user_id})")
+        logger.info("Usuario creado exitosamente: %s (ID: %s)", email, user_id)
         return user_id
 
     except Exception as e:
@@ -122,34 +160,59 @@ def actualizar_usuario(user_id, datos):
     """
     try:
         # Construir query dinámica según los campos a actualizar
-        set_clauses = []
-        params = []
-
-        campos_permitidos = ['nombre', 'apellido', 'email', 'rol', 'activo']
-
-        for campo, valor in datos.items():
-            if campo in campos_permitidos:
-                set_clauses.append(f"{campo} = %s")
-                params.append(valor)
+        campos = tuple(campo for campo in datos if campo in _CAMPOS_PERMITIDOS)
 
-        if not set_clauses:
+        if not campos:
             logger.warning("No hay campos válidos para actualizar")
             return False
 
+        params = [datos[campo] for campo in campos]
         params.append(user_id)
 
-        query = f"""
+        query = _UPDATE_QUERIES.get(campos)
+        if query is None:
+            query = sql.SQL("UPDATE usuarios SET {} WHERE id = %s").format(
+                sql.SQL(', ').join(
+                    sql.SQL("{} = %s").format(sql.Identifier(campo)) for campo in campos
+                )
+            )
+            _UPDATE_QUERIES[campos] = query
+
+        execute_query(query, tuple(params))
+        cache.delete_memoized(_usuario_por_id_cacheado, user_id)
+        cache.delete_memoized(listar_usuarios)
+        logger.info("Usuario %s actualizado exitosamente", user_id)
+        return True
+
+    except Exception as e:
+        logger.error(f"Error actualizando usuario: {str(e)}")
+        raise
+
+
+def actualizar_password(user_id, password_hash):
+    """
+    Reemplazar el hash de contraseña de un usuario (p. ej. al migrar a Argon2)
+
+    Args:
+        user_id (int): ID del usuario
+        password_hash (str): Nuevo hash de la contraseña
+
+    Returns:
+        bool: True si fue exitoso
+    """
+    try:
+        query = """
             UPDATE usuarios
-            SET {', '.join(set_clauses)}
+            SET password = %s
             WHERE id = %s
         """
 
-        execute_query(query, tuple(params))
-        logger.info(f"Usuario {user_id} actualizado exitosamente")
+        execute_query(query, (password_hash, user_id))
+        logger.info("Contraseña del usuario %s actualizada", user_id)
         return True
 
     except Exception as e:
-        logger.error(f"Error actualizando usuario: {str(e)}")
+        logger.error(f"Error actualizando contraseña: {str(e)}")
         raise
 
 
@@ -166,9 +229,10 @@ def desactivar_usuario(user_id):
     return actualizar_usuario(user_id, {'activo': False})
 
 
+@cache.memoize(timeout=60)
 def listar_usuarios(activos_solo=True):
     """
-    Listar todos los usuarios
+    Listar todos los usuarios (cacheado, se invalida al crear/actualizar usuarios)
 
     Args:
         activos_solo (bool): Si True, solo retorna usuarios activos
@@ -187,10 +251,7 @@ def listar_usuarios(activos_solo=True):
 
         query += " ORDER BY fecha_creacion DESC"
 
-        results = execute_query(query)
-
-        usuarios = [dict(row) for row in results]
-        return usuarios
+        return execute_query(query)
 
     except Exception as e:
         logger.error(f"Error listando usuarios: {str(e)}")
@@ -0,0 +1,24 @@
+from flask import redirect, url_for, flash, session, g, request, jsonify
+from functools import wraps
+
+def prefiere_json():
+    """True si el cliente (Ajax/API) prefiere JSON sobre HTML; se calcula una vez por petición"""
+    if '_prefiere_json' not in g:
+        mejor = request.accept_mimetypes.best_match(['text/html', 'application/json'])
+        g._prefiere_json = mejor == 'application/json'
+    return g._prefiere_json
+
+def login_required(f):
+    """Decorador para requerir autenticación"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            # Clientes JSON: 401 directo, sin flash ni redirección a la plantilla de login
+            if prefiere_json():
+                return jsonify({'success': False, 'error': 'auth_required'}), 401
+            flash('Por favor inicia sesión para continuar', 'warning')
+            if '_login_url' not in g:
+                g._login_url = url_for('auth.login')
+            return redirect(g._login_url)
+        return f(*args, **kwargs)
+    return decorated_function
@@ -1,22 +1,69 @@
-from flask import render_template, request, redirect, url_for, flash, session
-from werkzeug.security import generate_password_hash, check_password_hash
-from functools import wraps
+from flask import render_template, request, redirect, url_for, flash, session, g, jsonify
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
 import logging
+import re
 
 from . import auth_bp
-from .database import crear_usuario, obtener_usuario_por_email, obtener_usuario_por_id
+from .decorators import login_required, prefiere_json
+from .database import crear_usuario, existe_email, obtener_usuario_por_email, obtener_usuario_por_id, actualizar_password
 
 logger = logging.getLogger(__name__)
 
-def login_required(f):
-    """Decorador para requerir autenticación"""
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            flash('Por favor inicia sesión para continuar', 'warning')
-            return redirect(url_for('auth.login'))
-        return f(*args, **kwargs)
-    return decorated_function
+# Normalización y validación de emails
+_ESPACIOS_EMAIL = str.maketrans('', '', ' \t\r\n')
+_EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+def normalizar_email(email):
+    """Quitar espacios y pasar a minúsculas el email capturado en un formulario"""
+    return email.translate(_ESPACIOS_EMAIL).lower() if email else ''
+
+def email_valido(email):
+    """Validación rápida de formato antes de consultar la base de datos"""
+    return _EMAIL_RE.match(email) is not None
+
+# Hasher compartido (Argon2id)
+password_hasher = PasswordHasher(time_cost=2, memory_cost=65536)
+
+# Hash ficticio para que un email inexistente tarde lo mismo que una
+# contraseña incorrecta (se calcula en el primer login, no al importar)
+_dummy_hash = None
+
+def _obtener_dummy_hash():
+    """Hash Argon2 ficticio, calculado una sola vez por proceso"""
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = password_hasher.hash('leal-cafe')
+    return _dummy_hash
+
+def verificar_password(password_hash, password):
+    """
+    Verificar una contraseña contra su hash
+
+    Acepta hashes Argon2 y los hashes heredados de werkzeug (pbkdf2/scrypt).
+    """
+    if password_hash.startswith('$argon2'):
+        try:
+            return password_hasher.verify(password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+
+    # Hashes heredados: werkzeug solo se importa si todavía quedan usuarios sin migrar
+    from werkzeug.security import check_password_hash
+    return check_password_hash(password_hash, password)
+
+def requiere_rehash(password_hash):
+    """True si el hash es heredado o usa parámetros de Argon2 distintos a los actuales"""
+    if not password_hash.startswith('$argon2'):
+        return True
+    return password_hasher.check_needs_rehash(password_hash)
+
+def usuario_actual():
+    """Usuario autenticado de la petición actual (se consulta una sola vez por petición)"""
+    if 'current_user' not in g:
+        user_id = session.get('user_id')
+        g.current_user = obtener_usuario_por_id(user_id) if user_id else None
+    return g.current_user
 
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -27,7 +74,7 @@ def login():
         return redirect(url_for('dashboard'))
 
     if request.method == 'POST':
-        email = request.form.get('email', '').strip().lower()
+        email = normalizar_email(request.form.get('email'))
         password = request.form.get('password', '')
 
         # Validación básica
@@ -35,16 +82,34 @@ def login():
             flash('Por favor completa todos los campos', 'danger')
             return render_template('auth/login.html')
 
+        # Un email mal formado no puede existir: evitar la consulta
+        if not email_valido(email):
+            if prefiere_json():
+                return jsonify({'success': False, 'error': 'Credenciales incorrectas'}), 401
+            flash('Credenciales incorrectas', 'danger')
+            return render_template('auth/login.html')
+
         try:
             # Buscar usuario
             user = obtener_usuario_por_email(email)
 
-            if user and check_password_hash(user['password'], password):
+            # Siempre verificar contra algún hash (tiempo constante exista o no el usuario)
+            stored_hash = user['password'] if user else _obtener_dummy_hash()
+            password_ok = verificar_password(stored_hash, password)
+
+            if user and password_ok:
                 # Verificar que esté activo
                 if not user['activo']:
                     flash('Tu cuenta está desactivada. Contacta al administrador', 'danger')
                     return render_template('auth/login.html')
 
+                # Migrar hashes heredados a Argon2 de forma transparente
+                if requiere_rehash(stored_hash):
+                    try:
+                        actualizar_password(user['id'], password_hasher.hash(password))
+                    except Exception as e:
+                        logger.warning("No se pudo migrar el hash del usuario %s: %s", user['id'], e)
+
                 # Guardar en sesión
                 session['user_id'] = user['id']
                 session['user'] = {
@@ -56,7 +121,7 @@ def login():
                 }
                 session.permanent = True
 
-                logger.info(f"Usuario {email} inició sesión exitosamente")
+                logger.info("Usuario %s inició sesión exitosamente", email)
                 flash(f'¡Bienvenido, {user["nombre"]}!', 'success')
 
                 # Redirigir según rol
@@ -66,8 +131,10 @@ def login():
                 return redirect(url_for('dashboard'))
 
             else:
+                logger.warning("Intento de login fallido para: %s", email)
+                if prefiere_json():
+                    return jsonify({'success': False, 'error': 'Credenciales incorrectas'}), 401
                 flash('Credenciales incorrectas', 'danger')
-                logger.warning(f"Intento de login fallido para: {email}")
 
         except Exception as e:
             logger.error(f"Error en login: {str(e)}")
@@ -83,7 +150,7 @@ def registro():
         # Obtener datos del formulario
         nombre = request.form.get('nombre', '').strip()
         apellido = request.form.get('apellido', '').strip()
-        email = request.form.get('email', '').strip().lower()
+        email = normalizar_email(request.form.get('email'))
         password = request.form.get('password', '')
         confirm_password = request.form.get('confirm_password', '')
         rol = request.form.get('rol', 'usuario')
@@ -93,6 +160,10 @@ def registro():
             flash('Por favor completa todos los campos', 'danger')
             return render_template('auth/registro.html')
 
+        if not email_valido(email):
+            flash('El email no tiene un formato válido', 'danger')
+            return render_template('auth/registro.html')
+
         if password != confirm_password:
             flash('Las contraseñas no coinciden', 'danger')
             return render_template('auth/registro.html')
@@ -103,16 +174,16 @@ def registro():
 
         try:
             # Verificar si el email ya existe
-            if obtener_usuario_por_email(email):
+            if existe_email(email):
                 flash('Este email ya está registrado', 'danger')
                 return render_template('auth/registro.html')
 
             # Crear usuario
-            password_hash = generate_password_hash(password)
+            password_hash = password_hasher.hash(password)
             user_id = crear_usuario(nombre, apellido, email, password_hash, rol)
 
             if user_id:
-                logger.info(f"Usuario registrado: {email}")
+                logger.info("Usuario registrado: %s", email)
                 flash('Registro exitoso. Por favor inicia sesión', 'success')
                 return redirect(url_for('auth.login'))
             else:
@@ -129,8 +200,11 @@ def registro():
 def logout():
     """Cerrar sesión"""
     user_email = session.get('user', {}).get('email', 'Usuario')
-    session.clear()
-    logger.info(f"Usuario {user_email} cerró sesión")
+    # La sesión solo guarda estas dos claves (ver login)
+    session.pop('user_id', None)
+    session.pop('user', None)
+    session.permanent = False
+    logger.info("Usuario %s cerró sesión", user_email)
     flash('Sesión cerrada exitosamente', 'info')
     return redirect(url_for('auth.login'))
 
@@ -138,8 +212,7 @@ def logout():
 @login_required
 def perfil():
     """Página de perfil de usuario"""
-    user_id = session.get('user_id')
-    user = obtener_usuario_por_id(user_id)
+    user = usuario_actual()
 
     if not user:
         flash('Usuario no encontrado', 'danger')
@@ -0,0 +1,93 @@
+"""
+Caché compartida de la aplicación (Flask-Caching)
+"""
+import functools
+import inspect
+from datetime import date
+from flask import current_app, request
+from flask_caching import Cache
+
+cache = Cache()
+
+# Vigencia del caché de reportes mensuales (segundos)
+TTL_MES_ABIERTO = 60
+TTL_MES_CERRADO = 24 * 60 * 60
+
+
+def mes_cerrado(mes, anio):
+    """
+    True si el mes ya terminó
+
+    Sus datos todavía pueden cambiar (gastos con fecha pasada, cargas
+    mensuales de ventas), pero con mucha menos frecuencia que el mes en curso.
+    """
+    hoy = date.today()
+    return (anio, mes) < (hoy.year, hoy.month)
+
+
+def cache_compartida():
+    """
+    True si la caché es Redis (compartida por todos los workers)
+
+    Con SimpleCache cada worker tiene su propia copia y una invalidación solo
+    limpia la del worker que atendió la escritura.
+    """
+    return bool(current_app.config.get('CACHE_REDIS_URL'))
+
+
+def memoize_mensual(func):
+    """
+    Cachear una consulta mensual (recibe argumentos mes y anio)
+
+    El mes en curso todavía recibe datos, así que se cachea poco tiempo;
+    los meses cerrados se conservan mucho más, pero solo con Redis: ahí
+    func.invalidar() limpia la caché de todos los workers. Con una caché por
+    worker las invalidaciones no llegan a los demás, así que todos los meses
+    usan el TTL corto. Cada variante es una función memoizada distinta para
+    que sus TTL no se mezclen.
+    """
+    firma = inspect.signature(func)
+    variantes = {}
+    for cerrado, ttl in ((False, TTL_MES_ABIERTO), (True, TTL_MES_CERRADO)):
+        @functools.wraps(func)
+        def variante(*args, **kwargs):
+            return func(*args, **kwargs)
+        variante.__qualname__ = f"{func.__qualname__}_{'cerrado' if cerrado else 'abierto'}"
+        variantes[cerrado] = cache.memoize(timeout=ttl)(variante)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        argumentos = firma.bind(*args, **kwargs)
+        argumentos.apply_defaults()
+        cerrado = (cache_compartida()
+                   and mes_cerrado(argumentos.arguments['mes'], argumentos.arguments['anio']))
+        return variantes[cerrado](*args, **kwargs)
+
+    def invalidar():
+        for variante in variantes.values():
+            cache.delete_memoized(variante)
+
+    wrapper.invalidar = invalidar
+    return wrapper
+
+
+def no_modificado_304(etag, weak=False):
+    """
+    Respuesta 304 si el cliente ya tiene la versión etag (If-None-Match)
+
+    Returns:
+        Response o None si hay que generar la respuesta completa
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag, weak=weak)
+        return response
+    return None
+
+
+def con_etag(response, etag, weak=False):
+    """Agregar ETag; el navegador debe revalidar siempre antes de reutilizarla"""
+    response.set_etag(etag, weak=weak)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
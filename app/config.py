@@ -6,6 +6,38 @@ from dotenv import load_dotenv
 # Cargar variables de entorno desde .env
 load_dotenv()
 
+def _parse_database_url(database_url):
+    """Convertir una URL postgres:// en argumentos para psycopg2.connect"""
+    url = urlparse(database_url)
+    return {
+        'host': url.hostname,
+        'port': url.port or 5432,
+        'user': url.username,
+        'password': url.password,
+        'database': url.path[1:]  # Remover el '/' inicial
+    }
+
+def _postgres_settings():
+    """
+    Leer los datos de conexión a PostgreSQL una sola vez al importar
+
+    Si existe DATABASE_URL (Render), se usa; si no, las variables individuales.
+    """
+    database_url = os.environ.get('DATABASE_URL')
+
+    if database_url:
+        return _parse_database_url(database_url)
+
+    return {
+        'host': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'port': int(os.environ.get('POSTGRES_PORT', 5432)),
+        'user': os.environ.get('POSTGRES_USER', 'postgres'),
+        'password': os.environ.get('POSTGRES_PASSWORD', ''),
+        'database': os.environ.get('POSTGRES_DATABASE', 'leal_cafe')
+    }
+
+_POSTGRES = _postgres_settings()
+
 class Config:
     """Configuración base de la aplicación Leal Café"""
 
@@ -18,30 +50,37 @@ class Config:
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = 'Lax'
 
-    # Configuración de PostgreSQL
-    # Si existe DATABASE_URL (Render), úsala; si no, usa las variables individuales
+    # Configuración de PostgreSQL (ya parseada)
     DATABASE_URL = os.environ.get('DATABASE_URL')
+    POSTGRES_HOST = _POSTGRES['host']
+    POSTGRES_PORT = _POSTGRES['port']
+    POSTGRES_USER = _POSTGRES['user']
+    POSTGRES_PASSWORD = _POSTGRES['password']
+    POSTGRES_DATABASE = _POSTGRES['database']
+
+    # Argumentos listos para psycopg2.connect / el pool
+    DB_CONNECT_KWARGS = dict(_POSTGRES)
+
+    # Réplica de solo lectura opcional para reportes de meses cerrados
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+    DB_REPLICA_CONNECT_KWARGS = _parse_database_url(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL else None
 
-    if DATABASE_URL:
-        # Parse DATABASE_URL para extraer componentes
-        url = urlparse(DATABASE_URL)
-        POSTGRES_HOST = url.hostname
-        POSTGRES_PORT = url.port or 5432
-        POSTGRES_USER = url.username
-        POSTGRES_PASSWORD = url.password
-        POSTGRES_DATABASE = url.path[1:]  # Remover el '/' inicial
-    else:
-        # Usar variables individuales
-        POSTGRES_HOST = os.environ.get('POSTGRES_HOST', 'localhost')
-        POSTGRES_PORT = int(os.environ.get('POSTGRES_PORT', 5432))
-        POSTGRES_USER = os.environ.get('POSTGRES_USER', 'postgres')
-        POSTGRES_PASSWORD = os.environ.get('POSTGRES_PASSWORD', '')
-        POSTGRES_DATABASE = os.environ.get('POSTGRES_DATABASE', 'leal_cafe')
+    # Pool de conexiones (por worker)
+    DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+    DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 20))
+
+    # Configuración de caché (Redis si está disponible, memoria del proceso si no)
+    CACHE_REDIS_URL = os.environ.get('REDIS_URL')
+    CACHE_TYPE = 'RedisCache' if CACHE_REDIS_URL else 'SimpleCache'
+    CACHE_DEFAULT_TIMEOUT = 300
 
     # Configuración de archivos
     MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
     ALLOWED_EXTENSIONS = {'xlsx', 'xls', 'csv'}
-    UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
+
+    # Los archivos se leen completos en memoria: Flask rechaza (413) cualquier
+    # petición más grande que el archivo máximo más un margen para el formulario
+    MAX_CONTENT_LENGTH = MAX_FILE_SIZE + 1024 * 1024
 
     # Configuración de la aplicación
     APP_NAME = 'Leal Café'
@@ -53,5 +92,4 @@ class Config:
     @staticmethod
     def init_app(app):
         """Inicializar configuraciones adicionales"""
-        # Crear carpeta de uploads si no existe
-        os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
+        pass
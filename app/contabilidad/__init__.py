@@ -2,4 +2,4 @@ from flask import Blueprint
 
 contabilidad_bp = Blueprint('contabilidad', __name__, url_prefix='/contabilidad')
 
-from . import routes
+# Las rutas se cargan desde create_app (app.BLUEPRINTS)
@@ -2,12 +2,182 @@
 Funciones de base de datos para contabilidad - PostgreSQL
 """
 import logging
+import math
 from decimal import Decimal
-from database import execute_query, get_db_connection, decimal_to_float
+from psycopg2.extras import execute_values
+from database import execute_prepared, execute_prepared_on, get_db_connection, month_range, stream_query
+from cache import memoize_mensual, mes_cerrado
 
 logger = logging.getLogger(__name__)
 
+# Queries SQL (parámetros posicionales $n para sentencias preparadas)
+
+# Gastos del mes: porcentaje y totales del mes se calculan en PostgreSQL;
+# fecha sale como 'YYYY-MM-DD' y fecha_registro como 'YYYY-MM-DD HH:MM:SS'
+_Q_GASTOS_MES_BASE = """
+    SELECT
+        id,
+        fecha::date AS fecha,
+        sucursal,
+        tipo_gasto,
+        categoria,
+        descripcion,
+        forma_pago,
+        monto::float8 AS monto,
+        facturado,
+        comentarios,
+        usuario_id,
+        to_char(fecha_registro, 'YYYY-MM-DD HH24:MI:SS') AS fecha_registro,
+        COALESCE(ROUND(monto * 100.0 / NULLIF(SUM(monto) OVER (), 0), 2), 0)::float8 AS porcentaje,
+        COALESCE(SUM(monto) OVER (), 0)::float8 AS total_mes,
+        COALESCE(SUM(monto) FILTER (WHERE facturado) OVER (), 0)::float8 AS total_facturado
+    FROM "LealSilver".gastos
+    WHERE fecha >= $1
+    AND fecha < $2
+"""
+_Q_GASTOS_MES = _Q_GASTOS_MES_BASE + " ORDER BY gastos.fecha DESC, id DESC"
+_Q_GASTOS_MES_SUCURSAL = _Q_GASTOS_MES_BASE + " AND sucursal = $3 ORDER BY gastos.fecha DESC, id DESC"
+
+# Gastos del mes para exportar: se leen con un cursor del servidor (parámetros
+# %s); el porcentaje necesita el total, así que sigue calculándose aquí, y la
+# fecha ya sale con el formato de la hoja
+_Q_GASTOS_EXPORTAR = """
+    SELECT
+        to_char(fecha, 'DD/MM/YYYY') AS fecha_texto,
+        sucursal,
+        tipo_gasto,
+        categoria,
+        descripcion,
+        forma_pago,
+        monto::float8 AS monto,
+        facturado,
+        comentarios,
+        COALESCE(ROUND(monto * 100.0 / NULLIF(SUM(monto) OVER (), 0), 2), 0)::float8 AS porcentaje
+    FROM "LealSilver".gastos
+    WHERE fecha >= %s
+    AND fecha < %s
+    ORDER BY fecha DESC, id DESC
+"""
+
+_Q_INSERTAR_GASTO = """
+    INSERT INTO "LealSilver".gastos
+    (fecha, sucursal, tipo_gasto, categoria, descripcion,
+     forma_pago, monto, facturado, comentarios, usuario_id)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+    RETURNING id
+"""
+
+_Q_INSERTAR_GASTOS_BATCH = """
+    INSERT INTO "LealSilver".gastos
+    (fecha, sucursal, tipo_gasto, categoria, descripcion,
+     forma_pago, monto, facturado, comentarios, usuario_id)
+    VALUES %s
+    RETURNING id
+"""
+
+_Q_ACTUALIZAR_GASTO = """
+    UPDATE "LealSilver".gastos
+    SET fecha = $1,
+        sucursal = $2,
+        tipo_gasto = $3,
+        categoria = $4,
+        descripcion = $5,
+        forma_pago = $6,
+        monto = $7,
+        facturado = $8,
+        comentarios = $9
+    WHERE id = $10
+"""
+
+_Q_ELIMINAR_GASTO = 'DELETE FROM "LealSilver".gastos WHERE id = $1'
+
+_Q_GASTO_POR_ID = """
+    SELECT
+        id, fecha::date AS fecha, sucursal, tipo_gasto, categoria, descripcion,
+        forma_pago, monto::float8 AS monto, facturado, comentarios, usuario_id,
+        to_char(fecha_registro, 'YYYY-MM-DD HH24:MI:SS') AS fecha_registro
+    FROM "LealSilver".gastos
+    WHERE id = $1
+"""
+
+# Huella de los gastos del mes para ETag: xmin cambia con cada INSERT/UPDATE
+# de la fila y el conteo con cada DELETE
+_Q_VERSION_GASTOS_BASE = """
+    SELECT COUNT(*) AS n, COALESCE(MAX(xmin::text::bigint), 0) AS v
+    FROM "LealSilver".gastos
+    WHERE fecha >= $1
+    AND fecha < $2
+"""
+_Q_VERSION_GASTOS = _Q_VERSION_GASTOS_BASE
+_Q_VERSION_GASTOS_SUCURSAL = _Q_VERSION_GASTOS_BASE + " AND sucursal = $3"
+
+# Las tres agrupaciones de métricas en un solo recorrido del mes
+_Q_METRICAS_GASTOS = """
+    SELECT
+        GROUPING(sucursal) AS sin_sucursal,
+        GROUPING(tipo_gasto) AS sin_tipo,
+        sucursal,
+        tipo_gasto,
+        categoria,
+        COALESCE(SUM(monto), 0)::float8 as total,
+        COUNT(*) as cantidad
+    FROM "LealSilver".gastos
+    WHERE fecha >= $1
+    AND fecha < $2
+    GROUP BY GROUPING SETS ((sucursal), (tipo_gasto), (categoria))
+    ORDER BY total DESC
+"""
+
+# Ingresos (vista de ventas) y gastos del mes en una sola consulta:
+# cada fila lleva un grupo IN (ingresos), CV (insumos = costo de venta),
+# GV (otros gastos variables) o GF (gastos fijos)
+_Q_ESTADO_RESULTADOS = """
+    WITH gastos_mes AS (
+        SELECT
+            CASE
+                WHEN tipo_gasto = 'Variable' AND UPPER(categoria) = 'INSUMOS' THEN 'CV'
+                WHEN tipo_gasto = 'Variable' THEN 'GV'
+                ELSE 'GF'
+            END AS grupo,
+            categoria,
+            COALESCE(SUM(monto), 0)::float8 as monto
+        FROM "LealSilver".gastos
+        WHERE fecha >= $1
+        AND fecha < $2
+        AND tipo_gasto IN ('Variable', 'Fijo')
+        GROUP BY 1, categoria
+    )
+    SELECT 'IN' AS grupo, NULL::text AS categoria, COALESCE(SUM(venta), 0)::float8 as monto
+    FROM "LealSilver".vw_ventas_diarias_por_platillo
+    WHERE anio = $3 AND mes = $4
+    UNION ALL
+    SELECT grupo, categoria, monto FROM gastos_mes
+    ORDER BY monto DESC
+"""
+
+
+def _money(monto):
+    """
+    Convertir un monto a Decimal sin pasos innecesarios
+
+    Un Decimal se usa tal cual (sin perder precisión); los floats pasan por
+    su representación corta para no arrastrar errores binarios.
+    """
+    if isinstance(monto, Decimal):
+        return monto
+    if isinstance(monto, int):
+        return Decimal(monto)
+    return Decimal(str(monto))
+
 
+def _invalidar_cache_gastos():
+    """Descartar los agregados mensuales cacheados tras modificar gastos"""
+    for consulta in (obtener_gastos_mes, obtener_metricas_gastos, obtener_estado_resultados,
+                     obtener_version_gastos):
+        consulta.invalidar()
+
+
+@memoize_mensual
 def obtener_gastos_mes(mes, anio, sucursal=None):
     """
     Obtener todos los gastos de un mes específico con cálculo de porcentaje
@@ -26,53 +196,27 @@ def obtener_gastos_mes(mes, anio, sucursal=None):
         }
     """
     try:
-        # Query base
-        query = """
-            SELECT
-                id,
-                fecha,
-                sucursal,
-                tipo_gasto,
-                categoria,
-                descripcion,
-                forma_pago,
-                monto,
-                facturado,
-                comentarios,
-                usuario_id,
-                fecha_registro
-            FROM "LealSilver".gastos
-            WHERE EXTRACT(MONTH FROM fecha) = %s
-            AND EXTRACT(YEAR FROM fecha) = %s
-        """
-
-        params = [mes, anio]
+        inicio, fin = month_range(mes, anio)
 
-        # Filtro opcional por sucursal
+        # Filtro opcional por sucursal (una sentencia preparada por variante).
+        # Lo cacheado se lee siempre del primario: tras invalidar, una réplica
+        # atrasada volvería a cachear los gastos anteriores a la escritura
         if sucursal:
-            query += " AND sucursal = %s"
-            params.append(sucursal)
-
-        query += " ORDER BY fecha DESC, id DESC"
-
-        # Ejecutar query
-        results = execute_query(query, tuple(params))
-        gastos = [dict(row) for row in results]
+            gastos = execute_prepared('gastos_mes_sucursal', _Q_GASTOS_MES_SUCURSAL, (inicio, fin, sucursal))
+        else:
+            gastos = execute_prepared('gastos_mes', _Q_GASTOS_MES, (inicio, fin))
 
-        # Calcular total del mes
-        total_mes = sum(decimal_to_float(g['monto']) for g in gastos)
+        # Los totales vienen repetidos en cada fila: tomarlos de la primera
+        if gastos:
+            total_mes = gastos[0]['total_mes']
+            total_facturado = gastos[0]['total_facturado']
+        else:
+            total_mes = total_facturado = 0.0
 
-        # Calcular porcentaje para cada gasto
         for gasto in gastos:
-            gasto['monto'] = decimal_to_float(gasto['monto'])
-            if total_mes > 0:
-                gasto['porcentaje'] = round((gasto['monto'] / total_mes) * 100, 2)
-            else:
-                gasto['porcentaje'] = 0
+            del gasto['total_mes'], gasto['total_facturado']
 
-        # Calcular totales
-        total_facturado = sum(g['monto'] for g in gastos if g['facturado'])
-        total_no_facturado = sum(g['monto'] for g in gastos if not g['facturado'])
+        total_no_facturado = total_mes - total_facturado
 
         return {
             'gastos': gastos,
@@ -87,6 +231,22 @@ def obtener_gastos_mes(mes, anio, sucursal=None):
         raise
 
 
+def iter_gastos_mes(mes, anio):
+    """
+    Recorrer los gastos de un mes sin cargarlos todos en memoria
+
+    Args:
+        mes (int): Mes (1-12)
+        anio (int): Año
+
+    Yields:
+        dict: Cada gasto del mes (con su porcentaje y fecha_texto 'DD/MM/YYYY'),
+        del más reciente al más antiguo
+    """
+    inicio, fin = month_range(mes, anio)
+    yield from stream_query(_Q_GASTOS_EXPORTAR, (inicio, fin), readonly=mes_cerrado(mes, anio))
+
+
 def insertar_gasto(fecha, sucursal, tipo_gasto, categoria, descripcion,
                    forma_pago, monto, facturado, comentarios, usuario_id):
     """
@@ -107,50 +267,79 @@ def insertar_gasto(fecha, sucursal, tipo_gasto, categoria, descripcion,
     Returns:
         int: ID del gasto insertado
     """
-    connection = None
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-
-        query = """
-            INSERT INTO "LealSilver".gastos
-            (fecha, sucursal, tipo_gasto, categoria, descripcion,
-             forma_pago, monto, facturado, comentarios, usuario_id)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
-        """
-
-        cursor.execute(query, (
-            fecha,
-            sucursal,
-            tipo_gasto,
-            categoria,
-            descripcion or '',
-            forma_pago,
-            Decimal(str(monto)),
-            facturado,
-            comentarios or '',
-            usuario_id
-        ))
+        with get_db_connection() as connection, connection.cursor() as cursor:
+            execute_prepared_on(cursor, 'insertar_gasto', _Q_INSERTAR_GASTO, (
+                fecha,
+                sucursal,
+                tipo_gasto,
+                categoria,
+                descripcion or '',
+                forma_pago,
+                _money(monto),
+                facturado,
+                comentarios or '',
+                usuario_id
+            ))
 
-        result = cursor.fetchone()
-        # RealDictCursor retorna un diccionario, no una tupla
-        gasto_id = result['id'] if isinstance(result, dict) else result[0]
+            # Las conexiones del pool usan RealDictCursor
+            gasto_id = cursor.fetchone()['id']
 
-        connection.commit()
-        connection.close()
+        _invalidar_cache_gastos()
 
         facturado_texto = 'Sí' if facturado else 'No'
         logger.info(f"Gasto insertado con ID {gasto_id}: {descripcion} - ${monto} - Facturado: {facturado_texto}")
         return gasto_id
 
+    except Exception:
+        logger.exception("Error insertando gasto")
+        raise
+
+
+def insertar_gastos_batch(gastos, usuario_id):
+    """
+    Insertar varios gastos en un solo INSERT multi-fila (importaciones masivas)
+
+    Args:
+        gastos (list): Lista de dicts con las mismas llaves que los argumentos
+            de insertar_gasto (fecha, sucursal, tipo_gasto, categoria, descripcion,
+            forma_pago, monto, facturado, comentarios)
+        usuario_id (int): ID del usuario que registra los gastos
+
+    Returns:
+        list: IDs de los gastos insertados, en el mismo orden
+    """
+    if not gastos:
+        return []
+
+    try:
+        valores = [
+            (
+                g['fecha'],
+                g['sucursal'],
+                g['tipo_gasto'],
+                g['categoria'],
+                g.get('descripcion') or '',
+                g['forma_pago'],
+                _money(g['monto']),
+                g['facturado'],
+                g.get('comentarios') or '',
+                usuario_id
+            )
+            for g in gastos
+        ]
+
+        with get_db_connection() as connection, connection.cursor() as cursor:
+            results = execute_values(cursor, _Q_INSERTAR_GASTOS_BATCH, valores, page_size=500, fetch=True)
+            gasto_ids = [row['id'] for row in results]
+
+        _invalidar_cache_gastos()
+
+        logger.info(f"{len(gasto_ids)} gastos insertados en lote")
+        return gasto_ids
+
     except Exception as e:
-        logger.error(f"Error insertando gasto: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        if connection:
-            connection.rollback()
-            connection.close()
+        logger.error(f"Error insertando gastos en lote: {str(e)}")
         raise
 
 
@@ -166,52 +355,29 @@ def actualizar_gasto(gasto_id, fecha, sucursal, tipo_gasto, categoria, descripci
     Returns:
         bool: True si se actualizó correctamente
     """
-    connection = None
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-
-        query = """
-            UPDATE "LealSilver".gastos
-            SET fecha = %s,
-                sucursal = %s,
-                tipo_gasto = %s,
-                categoria = %s,
-                descripcion = %s,
-                forma_pago = %s,
-                monto = %s,
-                facturado = %s,
-                comentarios = %s
-            WHERE id = %s
-        """
-
-        cursor.execute(query, (
-            fecha,
-            sucursal,
-            tipo_gasto,
-            categoria,
-            descripcion or '',
-            forma_pago,
-            Decimal(str(monto)),
-            facturado,
-            comentarios or '',
-            gasto_id
-        ))
-
-        connection.commit()
-        rows_affected = cursor.rowcount
-        connection.close()
+        with get_db_connection() as connection, connection.cursor() as cursor:
+            execute_prepared_on(cursor, 'actualizar_gasto', _Q_ACTUALIZAR_GASTO, (
+                fecha,
+                sucursal,
+                tipo_gasto,
+                categoria,
+                descripcion or '',
+                forma_pago,
+                _money(monto),
+                facturado,
+                comentarios or '',
+                gasto_id
+            ))
 
+            rows_affected = cursor.rowcount
+
+        _invalidar_cache_gastos()
         logger.info(f"Gasto {gasto_id} actualizado exitosamente")
         return rows_affected > 0
 
-    except Exception as e:
-        logger.error(f"Error actualizando gasto {gasto_id}: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        if connection:
-            connection.rollback()
-            connection.close()
+    except Exception:
+        logger.exception(f"Error actualizando gasto {gasto_id}")
         raise
 
 
@@ -225,28 +391,17 @@ def eliminar_gasto(gasto_id):
     Returns:
         bool: True si se eliminó correctamente
     """
-    connection = None
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-
-        query = 'DELETE FROM "LealSilver".gastos WHERE id = %s'
-        cursor.execute(query, (gasto_id,))
-
-        connection.commit()
-        rows_affected = cursor.rowcount
-        connection.close()
+        with get_db_connection() as connection, connection.cursor() as cursor:
+            execute_prepared_on(cursor, 'eliminar_gasto', _Q_ELIMINAR_GASTO, (gasto_id,))
+            rows_affected = cursor.rowcount
 
+        _invalidar_cache_gastos()
         logger.info(f"Gasto {gasto_id} eliminado exitosamente")
         return rows_affected > 0
 
-    except Exception as e:
-        logger.error(f"Error eliminando gasto {gasto_id}: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        if connection:
-            connection.rollback()
-            connection.close()
+    except Exception:
+        logger.exception(f"Error eliminando gasto {gasto_id}")
         raise
 
 
@@ -261,20 +416,10 @@ def obtener_gasto_por_id(gasto_id):
         dict: Datos del gasto
     """
     try:
-        query = """
-            SELECT
-                id, fecha, sucursal, tipo_gasto, categoria, descripcion,
-                forma_pago, monto, facturado, comentarios, usuario_id, fecha_registro
-            FROM "LealSilver".gastos
-            WHERE id = %s
-        """
-
-        results = execute_query(query, (gasto_id,))
+        results = execute_prepared('gasto_por_id', _Q_GASTO_POR_ID, (gasto_id,))
 
         if results:
-            gasto = dict(results[0])
-            gasto['monto'] = decimal_to_float(gasto['monto'])
-            return gasto
+            return results[0]
 
         return None
 
@@ -283,6 +428,39 @@ def obtener_gasto_por_id(gasto_id):
         raise
 
 
+@memoize_mensual
+def obtener_version_gastos(mes, anio, sucursal=None):
+    """
+    Obtener una huella de los gastos de un mes, para usarla como ETag
+
+    Se cachea e invalida junto con los reportes mensuales, así que coincide
+    con la versión de los datos que se servirían.
+
+    Args:
+        mes (int): Mes (1-12)
+        anio (int): Año
+        sucursal (str, optional): Filtrar por sucursal
+
+    Returns:
+        str: Huella (cambia al insertar, modificar o eliminar gastos del mes)
+    """
+    try:
+        inicio, fin = month_range(mes, anio)
+
+        if sucursal:
+            version = execute_prepared('version_gastos_sucursal', _Q_VERSION_GASTOS_SUCURSAL,
+                                       (inicio, fin, sucursal))[0]
+        else:
+            version = execute_prepared('version_gastos', _Q_VERSION_GASTOS, (inicio, fin))[0]
+
+        return f"{anio}-{mes}-{version['n']}-{version['v']}"
+
+    except Exception as e:
+        logger.error(f"Error obteniendo versión de gastos del mes {mes}/{anio}: {str(e)}")
+        raise
+
+
+@memoize_mensual
 def obtener_metricas_gastos(mes, anio):
     """
     Obtener métricas generales de gastos para un mes
@@ -295,55 +473,25 @@ def obtener_metricas_gastos(mes, anio):
         dict: Métricas por sucursal, tipo, categoría
     """
     try:
-        # Por sucursal
-        query_sucursal = """
-            SELECT
-                sucursal,
-                SUM(monto) as total,
-                COUNT(*) as cantidad
-            FROM "LealSilver".gastos
-            WHERE EXTRACT(MONTH FROM fecha) = %s
-            AND EXTRACT(YEAR FROM fecha) = %s
-            GROUP BY sucursal
-            ORDER BY total DESC
-        """
-
-        # Por tipo
-        query_tipo = """
-            SELECT
-                tipo_gasto,
-                SUM(monto) as total,
-                COUNT(*) as cantidad
-            FROM "LealSilver".gastos
-            WHERE EXTRACT(MONTH FROM fecha) = %s
-            AND EXTRACT(YEAR FROM fecha) = %s
-            GROUP BY tipo_gasto
-            ORDER BY total DESC
-        """
-
-        # Por categoría
-        query_categoria = """
-            SELECT
-                categoria,
-                SUM(monto) as total,
-                COUNT(*) as cantidad
-            FROM "LealSilver".gastos
-            WHERE EXTRACT(MONTH FROM fecha) = %s
-            AND EXTRACT(YEAR FROM fecha) = %s
-            GROUP BY categoria
-            ORDER BY total DESC
-        """
-
-        params = (mes, anio)
-
-        por_sucursal = execute_query(query_sucursal, params)
-        por_tipo = execute_query(query_tipo, params)
-        por_categoria = execute_query(query_categoria, params)
+        results = execute_prepared('metricas_gastos', _Q_METRICAS_GASTOS, month_range(mes, anio))
+
+        por_sucursal = []
+        por_tipo = []
+        por_categoria = []
+
+        # GROUPING() = 0 indica la columna por la que se agrupó la fila
+        for row in results:
+            if row['sin_sucursal'] == 0:
+                por_sucursal.append({'sucursal': row['sucursal'], 'total': row['total'], 'cantidad': row['cantidad']})
+            elif row['sin_tipo'] == 0:
+                por_tipo.append({'tipo_gasto': row['tipo_gasto'], 'total': row['total'], 'cantidad': row['cantidad']})
+            else:
+                por_categoria.append({'categoria': row['categoria'], 'total': row['total'], 'cantidad': row['cantidad']})
 
         return {
-            'por_sucursal': [dict(row) for row in por_sucursal],
-            'por_tipo': [dict(row) for row in por_tipo],
-            'por_categoria': [dict(row) for row in por_categoria]
+            'por_sucursal': por_sucursal,
+            'por_tipo': por_tipo,
+            'por_categoria': por_categoria
         }
 
     except Exception as e:
@@ -351,6 +499,7 @@ def obtener_metricas_gastos(mes, anio):
         raise
 
 
+@memoize_mensual
 def obtener_estado_resultados(mes, anio):
     """
     Obtener datos completos para Estado de Resultados
@@ -377,75 +526,39 @@ def obtener_estado_resultados(mes, anio):
         }
     """
     try:
-        # 1. Obtener solo ingresos (ventas totales) desde la vista
-        query_ventas = """
-            SELECT COALESCE(SUM(venta), 0) as ingresos
-            FROM "LealSilver".vw_ventas_diarias_por_platillo
-            WHERE anio = %s AND mes = %s
-        """
-
-        result_ventas = execute_query(query_ventas, (anio, mes))
-        if result_ventas:
-            ingresos = float(decimal_to_float(result_ventas[0]['ingresos']))
-        else:
-            ingresos = 0.0
-
-        # 2. Obtener solo INSUMOS como Costo de Venta
-        query_costo_venta = """
-            SELECT SUM(monto) as monto
-            FROM "LealSilver".gastos
-            WHERE EXTRACT(MONTH FROM fecha) = %s
-            AND EXTRACT(YEAR FROM fecha) = %s
-            AND tipo_gasto = 'Variable'
-            AND UPPER(categoria) = 'INSUMOS'
-        """
-
-        costo_venta_result = execute_query(query_costo_venta, (mes, anio))
-        costo_ventas = float(decimal_to_float(costo_venta_result[0]['monto'])) if costo_venta_result and costo_venta_result[0]['monto'] else 0.0
-
-        # 3. Calcular utilidad bruta
-        utilidad_bruta = ingresos - costo_ventas
-
-        # 4. Obtener otros gastos variables (NO insumos)
-        query_gastos_variables = """
-            SELECT
-                categoria,
-                SUM(monto) as monto
-            FROM "LealSilver".gastos
-            WHERE EXTRACT(MONTH FROM fecha) = %s
-            AND EXTRACT(YEAR FROM fecha) = %s
-            AND tipo_gasto = 'Variable'
-            AND UPPER(categoria) != 'INSUMOS'
-            GROUP BY categoria
-            ORDER BY monto DESC
-        """
-
-        gastos_variables_result = execute_query(query_gastos_variables, (mes, anio))
-        gastos_variables_desglose = [
-            {'categoria': row['categoria'], 'monto': decimal_to_float(row['monto'])}
-            for row in gastos_variables_result
-        ]
-        total_gastos_variables = sum(item['monto'] for item in gastos_variables_desglose)
+        inicio, fin = month_range(mes, anio)
+
+        results = execute_prepared('estado_resultados', _Q_ESTADO_RESULTADOS, (inicio, fin, anio, mes))
+
+        # La fila IN siempre existe (agregado sin GROUP BY, con COALESCE)
+        ingresos = 0.0
+        montos_costo_venta = []
+        montos_variables = []
+        montos_fijos = []
+        gastos_variables_desglose = []
+        gastos_fijos_desglose = []
+
+        # Una sola pasada: repartir por grupo y juntar los montos de cada total.
+        # Sin la llave 'grupo' cada fila ya es {categoria, monto}: se usa tal cual
+        for row in results:
+            grupo = row.pop('grupo')
+            monto = row['monto']
+            if grupo == 'IN':
+                ingresos = monto
+            elif grupo == 'CV':
+                montos_costo_venta.append(monto)
+            elif grupo == 'GV':
+                montos_variables.append(monto)
+                gastos_variables_desglose.append(row)
+            else:
+                montos_fijos.append(monto)
+                gastos_fijos_desglose.append(row)
 
-        # 6. Obtener gastos fijos agrupados por categoría
-        query_gastos_fijos = """
-            SELECT
-                categoria,
-                SUM(monto) as monto
-            FROM "LealSilver".gastos
-            WHERE EXTRACT(MONTH FROM fecha) = %s
-            AND EXTRACT(YEAR FROM fecha) = %s
-            AND tipo_gasto = 'Fijo'
-            GROUP BY categoria
-            ORDER BY monto DESC
-        """
-
-        gastos_fijos_result = execute_query(query_gastos_fijos, (mes, anio))
-        gastos_fijos_desglose = [
-            {'categoria': row['categoria'], 'monto': decimal_to_float(row['monto'])}
-            for row in gastos_fijos_result
-        ]
-        total_gastos_fijos = sum(item['monto'] for item in gastos_fijos_desglose)
+        # Utilidad bruta y totales por tipo de gasto (fsum: suma exacta de floats)
+        costo_ventas = math.fsum(montos_costo_venta)
+        utilidad_bruta = ingresos - costo_ventas
+        total_gastos_variables = math.fsum(montos_variables)
+        total_gastos_fijos = math.fsum(montos_fijos)
 
         # 7. Calcular utilidad neta
         utilidad_neta = utilidad_bruta - total_gastos_fijos - total_gastos_variables
@@ -0,0 +1,26 @@
+from flask import request, jsonify
+from functools import wraps
+
+def month_year_required(f):
+    """
+    Decorador para vistas que reciben mes y anio por query string
+
+    Valida los parámetros antes de entrar a la vista y los inyecta ya
+    convertidos a int como argumentos mes y anio; si faltan o están fuera
+    de rango responde 400 sin tocar la base de datos.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        try:
+            mes = int(request.args['mes'])
+            anio = int(request.args['anio'])
+        except KeyError:
+            return jsonify({'success': False, 'error': 'Se requieren parámetros mes y anio'}), 400
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Parámetros mes y anio inválidos'}), 400
+
+        if not (1 <= mes <= 12 and 2000 <= anio <= 2100):
+            return jsonify({'success': False, 'error': 'Parámetros mes y anio inválidos'}), 400
+
+        return f(*args, mes=mes, anio=anio, **kwargs)
+    return decorated_function
@@ -1,24 +1,83 @@
 from flask import render_template, request, jsonify, session, send_file
 import logging
-from datetime import datetime, date
-from io import BytesIO
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from datetime import datetime
+from tempfile import SpooledTemporaryFile
+import xlsxwriter
+from pydantic import ValidationError
 
 from . import contabilidad_bp
 from auth import login_required
+from cache import con_etag, no_modificado_304
+from .decorators import month_year_required
+from .schemas import GastoNuevo, GastoActualizar, mensaje_error
 from .database import (
     obtener_gastos_mes,
+    iter_gastos_mes,
     insertar_gasto,
     actualizar_gasto,
     eliminar_gasto,
     obtener_gasto_por_id,
+    obtener_version_gastos,
     obtener_metricas_gastos,
     obtener_estado_resultados
 )
 
 logger = logging.getLogger(__name__)
 
+# Nombres de meses para filtros y nombres de archivo
+_MESES_NOMBRES = {
+    1: 'Enero', 2: 'Febrero', 3: 'Marzo', 4: 'Abril',
+    5: 'Mayo', 6: 'Junio', 7: 'Julio', 8: 'Agosto',
+    9: 'Septiembre', 10: 'Octubre', 11: 'Noviembre', 12: 'Diciembre'
+}
+
+# Estado de resultados vacío para mostrar el resumen cuando falla la consulta
+_ESTADO_RESULTADOS_VACIO = {
+    'ingresos': 0,
+    'costo_ventas': 0,
+    'utilidad_bruta': 0,
+    'gastos_fijos': {'total': 0, 'desglose': []},
+    'gastos_variables': {'total': 0, 'desglose': []},
+    'utilidad_neta': 0,
+    'margen_neto': 0,
+    'margen_bruto': 0
+}
+
+# Exportación a Excel: los formatos de xlsxwriter pertenecen a cada libro,
+# así que aquí solo se definen una vez sus propiedades
+_FORMATOS_EXCEL = {
+    'header': {
+        'bold': True, 'font_color': 'white', 'font_size': 11, 'bg_color': '#8B6914',
+        'align': 'center', 'valign': 'vcenter', 'border': 1
+    },
+    'cell': {'border': 1},
+    'money': {'num_format': '$#,##0.00', 'border': 1},
+    'pct': {'num_format': '0.0%', 'border': 1},
+    'total_label': {'bold': True, 'align': 'right'},
+    'total_money': {'bold': True, 'num_format': '$#,##0.00', 'bg_color': '#F3F4F6'},
+    'total_pct': {'bold': True, 'num_format': '0.0%', 'bg_color': '#F3F4F6'}
+}
+
+_ANCHOS_EXCEL = (
+    ('A:B', 12),  # Fecha, Sucursal
+    ('C:C', 14),  # Tipo
+    ('D:D', 16),  # Categoría
+    ('E:E', 30),  # Descripción
+    ('F:F', 14),  # Forma de Pago
+    ('G:G', 12),  # Monto
+    ('H:H', 8),   # %
+    ('I:I', 12),  # Facturado
+    ('J:J', 30)   # Comentarios
+)
+
+# Tamaño del .xlsx (bytes) a partir del cual se escribe a disco en lugar de memoria
+_MAX_EXCEL_EN_MEMORIA = 8 * 1024 * 1024
+
+_ENCABEZADOS_EXCEL = (
+    'Fecha', 'Sucursal', 'Tipo de Gasto', 'Categoría', 'Descripción',
+    'Forma de Pago', 'Monto', '%', '¿Facturado?', 'Comentarios'
+)
+
 
 @contabilidad_bp.route('/')
 @login_required
@@ -39,45 +98,23 @@ def resumen():
         # Obtener datos del estado de resultados
         datos = obtener_estado_resultados(mes, anio)
 
-        # Nombres de meses para el filtro
-        meses_nombres = {
-            1: 'Enero', 2: 'Febrero', 3: 'Marzo', 4: 'Abril',
-            5: 'Mayo', 6: 'Junio', 7: 'Julio', 8: 'Agosto',
-            9: 'Septiembre', 10: 'Octubre', 11: 'Noviembre', 12: 'Diciembre'
-        }
-
         return render_template(
             'contabilidad/resumen.html',
             datos=datos,
             mes=mes,
             anio=anio,
-            meses_nombres=meses_nombres
+            meses_nombres=_MESES_NOMBRES
         )
 
-    except Exception as e:
-        logger.error(f"Error en resumen financiero: {str(e)}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception("Error en resumen financiero")
         # Retornar con datos vacíos en caso de error
         return render_template(
             'contabilidad/resumen.html',
-            datos={
-                'ingresos': 0,
-                'costo_ventas': 0,
-                'utilidad_bruta': 0,
-                'gastos_fijos': {'total': 0, 'desglose': []},
-                'gastos_variables': {'total': 0, 'desglose': []},
-                'utilidad_neta': 0,
-                'margen_neto': 0,
-                'margen_bruto': 0
-            },
+            datos=_ESTADO_RESULTADOS_VACIO,
             mes=datetime.now().month,
             anio=datetime.now().year,
-            meses_nombres={
-                1: 'Enero', 2: 'Febrero', 3: 'Marzo', 4: 'Abril',
-                5: 'Mayo', 6: 'Junio', 7: 'Julio', 8: 'Agosto',
-                9: 'Septiembre', 10: 'Octubre', 11: 'Noviembre', 12: 'Diciembre'
-            }
+            meses_nombres=_MESES_NOMBRES
         )
 
 
@@ -85,40 +122,31 @@ def resumen():
 
 @contabilidad_bp.route('/api/gastos', methods=['GET'])
 @login_required
-def api_obtener_gastos():
+@month_year_required
+def api_obtener_gastos(mes, anio):
     """
     API: Obtener gastos de un mes
     Query params: mes, anio, sucursal (opcional)
     """
     try:
-        mes = request.args.get('mes', type=int)
-        anio = request.args.get('anio', type=int)
         sucursal = request.args.get('sucursal', None)
 
-        if not mes or not anio:
-            return jsonify({
-                'success': False,
-                'error': 'Se requieren parámetros mes y anio'
-            }), 400
+        # Si el cliente ya tiene esta versión del mes no se vuelve a serializar
+        etag = obtener_version_gastos(mes, anio, sucursal)
+        no_modificado = no_modificado_304(etag)
+        if no_modificado:
+            return no_modificado
 
         datos = obtener_gastos_mes(mes, anio, sucursal)
 
-        # Convertir fechas a string para JSON
-        for gasto in datos['gastos']:
-            if isinstance(gasto['fecha'], date):
-                gasto['fecha'] = gasto['fecha'].strftime('%Y-%m-%d')
-            if gasto.get('fecha_registro'):
-                gasto['fecha_registro'] = gasto['fecha_registro'].strftime('%Y-%m-%d %H:%M:%S')
-
-        return jsonify({
+        # Las fechas ya vienen con el formato de la página desde la consulta
+        return con_etag(jsonify({
             'success': True,
             'data': datos
-        })
+        }), etag)
 
     except Exception as e:
-        logger.error(f"Error en API obtener gastos: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error en API obtener gastos")
         return jsonify({
             'success': False,
             'error': str(e)
@@ -146,18 +174,13 @@ def api_crear_gasto():
                 'error': 'No se recibieron datos'
             }), 400
 
-        # Validar campos requeridos
-        campos_requeridos = ['fecha', 'sucursal', 'tipo_gasto', 'categoria', 'forma_pago', 'monto', 'descripcion']
-        campos_faltantes = []
-
-        for campo in campos_requeridos:
-            if campo not in data or data[campo] == '' or data[campo] is None:
-                campos_faltantes.append(campo)
-
-        if campos_faltantes:
+        # Validar y convertir campos (fecha, monto > 0, facturado 'Sí'/'No')
+        try:
+            gasto = GastoNuevo.model_validate(data)
+        except ValidationError as e:
             return jsonify({
                 'success': False,
-                'error': f'Campos requeridos faltantes o vacíos: {", ".join(campos_faltantes)}'
+                'error': mensaje_error(e)
             }), 400
 
         # Obtener usuario de sesión
@@ -168,41 +191,10 @@ def api_crear_gasto():
                 'error': 'Usuario no autenticado'
             }), 401
 
-        # Convertir facturado a boolean
-        facturado_str = data.get('facturado', 'No')
-        facturado = facturado_str == 'Sí'
-
-        logger.info(f"Facturado recibido: '{facturado_str}' -> convertido a boolean: {facturado}")
-
-        # Validar y convertir monto
-        try:
-            monto = float(data['monto'])
-            if monto <= 0:
-                return jsonify({
-                    'success': False,
-                    'error': 'El monto debe ser mayor a 0'
-                }), 400
-        except (ValueError, TypeError):
-            return jsonify({
-                'success': False,
-                'error': 'El monto debe ser un número válido'
-            }), 400
-
         # Insertar gasto
-        gasto_id = insertar_gasto(
-            fecha=data['fecha'],
-            sucursal=data['sucursal'],
-            tipo_gasto=data['tipo_gasto'],
-            categoria=data['categoria'],
-            descripcion=data.get('descripcion', ''),
-            forma_pago=data['forma_pago'],
-            monto=monto,
-            facturado=facturado,
-            comentarios=data.get('comentarios', ''),
-            usuario_id=usuario_id
-        )
+        gasto_id = insertar_gasto(**gasto.model_dump(), usuario_id=usuario_id)
 
-        facturado_texto = 'Sí' if facturado else 'No'
+        facturado_texto = 'Sí' if gasto.facturado else 'No'
         logger.info(f"Gasto creado exitosamente con ID: {gasto_id} (Facturado: {facturado_texto})")
 
         return jsonify({
@@ -212,9 +204,7 @@ def api_crear_gasto():
         })
 
     except Exception as e:
-        logger.error(f"Error en API crear gasto: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error en API crear gasto")
         return jsonify({
             'success': False,
             'error': f'Error interno del servidor: {str(e)}'
@@ -232,31 +222,23 @@ def api_actualizar_gasto(gasto_id):
     try:
         data = request.get_json()
 
-        # Validar campos requeridos
-        campos_requeridos = ['fecha', 'sucursal', 'tipo_gasto', 'categoria', 'forma_pago', 'monto']
-        for campo in campos_requeridos:
-            if campo not in data or data[campo] == '':
-                return jsonify({
-                    'success': False,
-                    'error': f'El campo {campo} es requerido'
-                }), 400
+        if not data:
+            return jsonify({
+                'success': False,
+                'error': 'No se recibieron datos'
+            }), 400
 
-        # Convertir facturado a boolean
-        facturado = data.get('facturado', 'No') == 'Sí'
+        # Validar y convertir campos (fecha, monto > 0, facturado 'Sí'/'No')
+        try:
+            gasto = GastoActualizar.model_validate(data)
+        except ValidationError as e:
+            return jsonify({
+                'success': False,
+                'error': mensaje_error(e)
+            }), 400
 
         # Actualizar gasto
-        success = actualizar_gasto(
-            gasto_id=gasto_id,
-            fecha=data['fecha'],
-            sucursal=data['sucursal'],
-            tipo_gasto=data['tipo_gasto'],
-            categoria=data['categoria'],
-            descripcion=data.get('descripcion', ''),
-            forma_pago=data['forma_pago'],
-            monto=float(data['monto']),
-            facturado=facturado,
-            comentarios=data.get('comentarios', '')
-        )
+        success = actualizar_gasto(gasto_id=gasto_id, **gasto.model_dump())
 
         if success:
             return jsonify({
@@ -270,9 +252,7 @@ def api_actualizar_gasto(gasto_id):
             }), 404
 
     except Exception as e:
-        logger.error(f"Error en API actualizar gasto {gasto_id}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error en API actualizar gasto {gasto_id}")
         return jsonify({
             'success': False,
             'error': str(e)
@@ -317,12 +297,6 @@ def api_obtener_gasto(gasto_id):
         gasto = obtener_gasto_por_id(gasto_id)
 
         if gasto:
-            # Convertir fechas a string
-            if isinstance(gasto['fecha'], date):
-                gasto['fecha'] = gasto['fecha'].strftime('%Y-%m-%d')
-            if gasto.get('fecha_registro'):
-                gasto['fecha_registro'] = gasto['fecha_registro'].strftime('%Y-%m-%d %H:%M:%S')
-
             return jsonify({
                 'success': True,
                 'data': gasto
@@ -343,27 +317,24 @@ def api_obtener_gasto(gasto_id):
 
 @contabilidad_bp.route('/api/metricas', methods=['GET'])
 @login_required
-def api_obtener_metricas():
+@month_year_required
+def api_obtener_metricas(mes, anio):
     """
     API: Obtener métricas de gastos
     Query params: mes, anio
     """
     try:
-        mes = request.args.get('mes', type=int)
-        anio = request.args.get('anio', type=int)
-
-        if not mes or not anio:
-            return jsonify({
-                'success': False,
-                'error': 'Se requieren parámetros mes y anio'
-            }), 400
+        etag = obtener_version_gastos(mes, anio)
+        no_modificado = no_modificado_304(etag)
+        if no_modificado:
+            return no_modificado
 
         metricas = obtener_metricas_gastos(mes, anio)
 
-        return jsonify({
+        return con_etag(jsonify({
             'success': True,
             'data': metricas
-        })
+        }), etag)
 
     except Exception as e:
         logger.error(f"Error en API métricas: {str(e)}")
@@ -384,117 +355,73 @@ def exportar_excel():
         mes = request.args.get('mes', type=int, default=1)
         anio = request.args.get('anio', type=int, default=2026)
 
-        # Obtener datos
-        datos = obtener_gastos_mes(mes, anio)
-        gastos = datos['gastos']
-
-        # Crear archivo Excel
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = f"Gastos {mes}-{anio}"
-
-        # Estilos
-        header_fill = PatternFill(start_color="8B6914", end_color="8B6914", fill_type="solid")
-        header_font = Font(bold=True, color="FFFFFF", size=11)
-        border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
+        # El .xlsx no es idéntico byte a byte entre generaciones (fecha de
+        # creación), por eso el ETag es débil
+        etag = obtener_version_gastos(mes, anio)
+        no_modificado = no_modificado_304(etag, weak=True)
+        if no_modificado:
+            return no_modificado
+
+        # Crear archivo Excel con xlsxwriter en modo constant_memory: cada fila
+        # se vuelca a un archivo temporal al terminar de escribirla, por lo que
+        # deben escribirse en orden. El .xlsx final queda en memoria si es
+        # pequeño y pasa a disco si crece más de _MAX_EXCEL_EN_MEMORIA
+        output = SpooledTemporaryFile(max_size=_MAX_EXCEL_EN_MEMORIA, mode='w+b')
+        wb = xlsxwriter.Workbook(output, {'constant_memory': True})
+        ws = wb.add_worksheet(f"Gastos {mes}-{anio}")
+
+        # Formatos (uno por estilo, compartidos por todas las celdas)
+        fmt = {nombre: wb.add_format(spec) for nombre, spec in _FORMATOS_EXCEL.items()}
+
+        # Anchos de columna
+        for columnas, ancho in _ANCHOS_EXCEL:
+            ws.set_column(columnas, ancho)
 
         # Encabezados
-        headers = [
-            'Fecha', 'Sucursal', 'Tipo de Gasto', 'Categoría', 'Descripción',
-            'Forma de Pago', 'Monto', '%', '¿Facturado?', 'Comentarios'
-        ]
-
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col)
-            cell.value = header
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-            cell.border = border
-
-        # Datos
-        meses_nombres = {
-            1: 'Enero', 2: 'Febrero', 3: 'Marzo', 4: 'Abril', 5: 'Mayo', 6: 'Junio',
-            7: 'Julio', 8: 'Agosto', 9: 'Septiembre', 10: 'Octubre', 11: 'Noviembre', 12: 'Diciembre'
-        }
-
-        for row, gasto in enumerate(gastos, 2):
-            # Convertir fecha
-            if isinstance(gasto['fecha'], str):
-                fecha_str = datetime.strptime(gasto['fecha'], '%Y-%m-%d').strftime('%d/%m/%Y')
-            else:
-                fecha_str = gasto['fecha'].strftime('%d/%m/%Y')
-
-            ws.cell(row=row, column=1).value = fecha_str
-            ws.cell(row=row, column=2).value = gasto['sucursal']
-            ws.cell(row=row, column=3).value = gasto['tipo_gasto']
-            ws.cell(row=row, column=4).value = gasto['categoria']
-            ws.cell(row=row, column=5).value = gasto['descripcion'] or ''
-            ws.cell(row=row, column=6).value = gasto['forma_pago']
-            ws.cell(row=row, column=7).value = float(gasto['monto'])
-            ws.cell(row=row, column=7).number_format = '$#,##0.00'
-            ws.cell(row=row, column=8).value = float(gasto['porcentaje']) / 100
-            ws.cell(row=row, column=8).number_format = '0.0%'
-            ws.cell(row=row, column=9).value = 'Sí' if gasto['facturado'] else 'No'
-            ws.cell(row=row, column=10).value = gasto['comentarios'] or ''
-
-            # Aplicar bordes
-            for col in range(1, 11):
-                ws.cell(row=row, column=col).border = border
+        ws.write_row(0, 0, _ENCABEZADOS_EXCEL, fmt['header'])
+
+        # Datos: los gastos llegan en streaming desde la base de datos; el total se
+        # acumula mientras se escriben las filas
+        row = 1
+        total_mes = 0.0
+        for gasto in iter_gastos_mes(mes, anio):
+            ws.write_row(row, 0, (
+                gasto['fecha_texto'],
+                gasto['sucursal'],
+                gasto['tipo_gasto'],
+                gasto['categoria'],
+                gasto['descripcion'] or '',
+                gasto['forma_pago']
+            ), fmt['cell'])
+            total_mes += gasto['monto']
+            ws.write_number(row, 6, gasto['monto'], fmt['money'])
+            ws.write_number(row, 7, gasto['porcentaje'] / 100, fmt['pct'])
+            ws.write_string(row, 8, 'Sí' if gasto['facturado'] else 'No', fmt['cell'])
+            ws.write_string(row, 9, gasto['comentarios'] or '', fmt['cell'])
+            row += 1
 
         # Fila de totales
-        total_row = len(gastos) + 2
-        ws.cell(row=total_row, column=6).value = 'TOTAL:'
-        ws.cell(row=total_row, column=6).font = Font(bold=True)
-        ws.cell(row=total_row, column=6).alignment = Alignment(horizontal='right')
-
-        ws.cell(row=total_row, column=7).value = float(datos['total_mes'])
-        ws.cell(row=total_row, column=7).number_format = '$#,##0.00'
-        ws.cell(row=total_row, column=7).font = Font(bold=True)
-        ws.cell(row=total_row, column=7).fill = PatternFill(start_color="F3F4F6", end_color="F3F4F6", fill_type="solid")
-
-        ws.cell(row=total_row, column=8).value = 1.0
-        ws.cell(row=total_row, column=8).number_format = '0.0%'
-        ws.cell(row=total_row, column=8).font = Font(bold=True)
-        ws.cell(row=total_row, column=8).fill = PatternFill(start_color="F3F4F6", end_color="F3F4F6", fill_type="solid")
-
-        # Ajustar anchos de columna
-        ws.column_dimensions['A'].width = 12  # Fecha
-        ws.column_dimensions['B'].width = 12  # Sucursal
-        ws.column_dimensions['C'].width = 14  # Tipo
-        ws.column_dimensions['D'].width = 16  # Categoría
-        ws.column_dimensions['E'].width = 30  # Descripción
-        ws.column_dimensions['F'].width = 14  # Forma de Pago
-        ws.column_dimensions['G'].width = 12  # Monto
-        ws.column_dimensions['H'].width = 8   # %
-        ws.column_dimensions['I'].width = 12  # Facturado
-        ws.column_dimensions['J'].width = 30  # Comentarios
-
-        # Guardar en memoria
-        output = BytesIO()
-        wb.save(output)
+        ws.write_string(row, 5, 'TOTAL:', fmt['total_label'])
+        ws.write_number(row, 6, round(total_mes, 2), fmt['total_money'])
+        ws.write_number(row, 7, 1.0, fmt['total_pct'])
+
+        # Cerrar el libro para terminar de escribir el .xlsx
+        wb.close()
         output.seek(0)
 
         # Nombre del archivo
-        nombre_mes = meses_nombres.get(mes, mes)
+        nombre_mes = _MESES_NOMBRES.get(mes, mes)
         filename = f"Gastos_{nombre_mes}_{anio}.xlsx"
 
-        return send_file(
+        return con_etag(send_file(
             output,
             mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
             as_attachment=True,
             download_name=filename
-        )
+        ), etag, weak=True)
 
     except Exception as e:
-        logger.error(f"Error exportando a Excel: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error exportando a Excel")
         return jsonify({
             'success': False,
             'error': str(e)
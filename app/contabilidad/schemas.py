@@ -0,0 +1,71 @@
+"""
+Validación del body JSON de los gastos (pydantic)
+"""
+from datetime import date
+from pydantic import BaseModel, Field, PositiveFloat, field_validator
+
+# Errores de pydantic que equivalen a un campo requerido faltante o vacío
+_ERRORES_FALTANTE = frozenset(('missing', 'string_too_short'))
+
+
+class GastoActualizar(BaseModel):
+    """Gasto recibido al actualizar (descripción opcional)"""
+
+    fecha: date
+    sucursal: str = Field(min_length=1)
+    tipo_gasto: str = Field(min_length=1)
+    categoria: str = Field(min_length=1)
+    descripcion: str = ''
+    forma_pago: str = Field(min_length=1)
+    monto: PositiveFloat
+    facturado: bool = False
+    comentarios: str = ''
+
+    @field_validator('facturado', mode='before')
+    @classmethod
+    def _facturado(cls, valor):
+        """El formulario envía 'Sí' / 'No'"""
+        return valor is True or valor == 'Sí'
+
+    @field_validator('descripcion', 'comentarios', mode='before')
+    @classmethod
+    def _texto_opcional(cls, valor):
+        return '' if valor is None else valor
+
+
+class GastoNuevo(GastoActualizar):
+    """Gasto recibido al crear (la descripción es obligatoria)"""
+
+    descripcion: str = Field(min_length=1)
+
+
+def mensaje_error(error):
+    """
+    Convertir un ValidationError en el mensaje que muestra el formulario
+
+    Args:
+        error (ValidationError): Error de pydantic
+
+    Returns:
+        str: Mensaje de error
+    """
+    faltantes = []
+    otros = []
+
+    for detalle in error.errors():
+        campo = detalle['loc'][0] if detalle['loc'] else 'body'
+
+        if detalle['type'] in _ERRORES_FALTANTE or detalle.get('input', '') is None:
+            faltantes.append(str(campo))
+        elif campo == 'monto':
+            if detalle['type'] == 'greater_than':
+                otros.append('El monto debe ser mayor a 0')
+            else:
+                otros.append('El monto debe ser un número válido')
+        else:
+            otros.append(f'El campo {campo} no es válido')
+
+    if faltantes:
+        return f'Campos requeridos faltantes o vacíos: {", ".join(faltantes)}'
+
+    return '; '.join(otros)
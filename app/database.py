@@ -1,182 +1,331 @@
+import atexit
+import threading
+from contextlib import contextmanager
+
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.extensions
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extras import RealDictCursor, execute_values
 from config import Config
+from datetime import date
 from decimal import Decimal
 import logging
 
 logger = logging.getLogger(__name__)
 
-def get_db_connection():
-    """Crear conexión a PostgreSQL"""
+class _Connection(psycopg2.extensions.connection):
+    """Conexión que recuerda las sentencias preparadas (PREPARE) de su sesión"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+# Pools de conexiones (se crean en el primer uso para que cada worker tenga los suyos):
+# 'primary' para todo y 'replica' para lecturas readonly si hay réplica configurada
+_pools = {}
+_pool_lock = threading.Lock()
+
+def _get_pool(readonly=False):
+    """Crear el pool de conexiones a PostgreSQL si aún no existe"""
+    nombre = 'replica' if readonly and Config.DB_REPLICA_CONNECT_KWARGS else 'primary'
+    pool = _pools.get(nombre)
+    if pool is None:
+        with _pool_lock:
+            pool = _pools.get(nombre)
+            if pool is None:
+                if nombre == 'replica':
+                    # La réplica rechaza cualquier escritura por sesión
+                    connect_kwargs = dict(Config.DB_REPLICA_CONNECT_KWARGS,
+                                          options='-c default_transaction_read_only=on')
+                else:
+                    connect_kwargs = Config.DB_CONNECT_KWARGS
+                try:
+                    pool = ThreadedConnectionPool(
+                        Config.DB_POOL_MIN,
+                        Config.DB_POOL_MAX,
+                        **connect_kwargs,
+                        connection_factory=_Connection,
+                        cursor_factory=RealDictCursor
+                    )
+                except Exception as e:
+                    logger.error(f"Error conectando a PostgreSQL ({nombre}): {str(e)}")
+                    raise
+                atexit.register(pool.closeall)
+                _pools[nombre] = pool
+    return pool
+
+@contextmanager
+def get_db_connection(autocommit=False, readonly=False):
+    """
+    Obtener una conexión del pool de PostgreSQL
+
+    Hace commit al salir del bloque, rollback si ocurre un error y
+    siempre devuelve la conexión al pool. Las conexiones rotas se cierran
+    al devolverlas para que el pool no las vuelva a entregar.
+
+    Con autocommit=True no se abre transacción: psycopg2 no envía BEGIN
+    ni COMMIT, así que una sola sentencia cuesta un solo viaje al servidor.
+    Usarlo solo para bloques de una sentencia.
+
+    Con readonly=True la conexión sale de la réplica de lectura (si
+    DATABASE_REPLICA_URL está configurada; si no, del pool principal).
+
+    Uso:
+        with get_db_connection() as connection:
+            cursor = connection.cursor()
+            ...
+    """
+    pool = _get_pool(readonly)
+    connection = pool.getconn()
+    roto = False
     try:
-        connection = psycopg2.connect(
-            host=Config.POSTGRES_HOST,
-            port=Config.POSTGRES_PORT,
-            user=Config.POSTGRES_USER,
-            password=Config.POSTGRES_PASSWORD,
-            database=Config.POSTGRES_DATABASE,
-            cursor_factory=RealDictCursor
-        )
-        return connection
-    except Exception as e:
-        logger.error(f"Error conectando a PostgreSQL: {str(e)}")
+        connection.autocommit = autocommit
+        yield connection
+        connection.commit()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        # La conexión se cayó (reinicio del servidor, timeout de red...):
+        # no intentar rollback y descartarla en lugar de devolverla al pool
+        roto = True
         raise
+    except Exception:
+        if not connection.closed:
+            connection.rollback()
+        raise
+    finally:
+        pool.putconn(connection, close=roto or bool(connection.closed))
 
-def execute_query(query, params=None):
+def execute_query(query, params=None, readonly=False):
     """
     Ejecutar query y retornar resultados
 
     Args:
         query (str): Query SQL a ejecutar
         params (dict o tuple): Parámetros para query parametrizada
+        readonly (bool): Ejecutar en la réplica de lectura si existe
 
     Returns:
         list: Resultados de la query
     """
-    connection = None
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
+        with get_db_connection(autocommit=True, readonly=readonly) as connection:
+            cursor = connection.cursor()
 
-        if params:
-            cursor.execute(query, params)
-        else:
-            cursor.execute(query)
+            if params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
 
-        try:
-            results = cursor.fetchall()
-            return results
-        except psycopg2.ProgrammingError:
-            # Query no retorna resultados (INSERT, UPDATE, etc)
-            return []
+            try:
+                results = cursor.fetchall()
+                return results
+            except psycopg2.ProgrammingError:
+                # Query no retorna resultados (INSERT, UPDATE, etc)
+                return []
 
     except Exception as e:
         logger.error(f"Error ejecutando query: {str(e)}")
         raise
 
-    finally:
-        if connection:
-            connection.close()
+def execute_prepared_on(cursor, name, query, params):
+    """
+    Ejecutar una sentencia preparada con un cursor ya abierto
+
+    La sentencia se prepara una sola vez por conexión del pool y luego se
+    ejecuta con EXECUTE, evitando que PostgreSQL vuelva a analizarla y
+    planearla. Útil cuando se necesita el cursor (RETURNING, rowcount).
+
+    Args:
+        cursor: Cursor de una conexión obtenida con get_db_connection
+        name (str): Nombre de la sentencia preparada
+        query (str): Query SQL con parámetros posicionales ($1, $2, ...)
+        params (tuple): Parámetros de la query
+    """
+    connection = cursor.connection
+
+    if name not in connection.prepared:
+        cursor.execute(f"PREPARE {name} AS {query}")
+        connection.prepared.add(name)
+
+    placeholders = ', '.join(['%s'] * len(params))
+    cursor.execute(f"EXECUTE {name} ({placeholders})", params)
+
+def execute_prepared(name, query, params, readonly=False):
+    """
+    Ejecutar una sentencia preparada del lado del servidor y retornar resultados
+
+    Args:
+        name (str): Nombre de la sentencia preparada
+        query (str): Query SQL con parámetros posicionales ($1, $2, ...)
+        params (tuple): Parámetros de la query
+        readonly (bool): Ejecutar en la réplica de lectura si existe
+
+    Returns:
+        list: Resultados de la query
+    """
+    try:
+        with get_db_connection(autocommit=True, readonly=readonly) as connection:
+            cursor = connection.cursor()
+            execute_prepared_on(cursor, name, query, params)
+            return cursor.fetchall()
+
+    except Exception as e:
+        logger.error(f"Error ejecutando sentencia preparada {name}: {str(e)}")
+        raise
 
-def execute_insert(query, data):
+def stream_query(query, params=None, itersize=1000, readonly=False):
+    """
+    Ejecutar query con un cursor del lado del servidor y entregar las filas una a una
+
+    El cursor con nombre trae las filas en lotes de itersize, así que en
+    memoria solo queda un lote a la vez (útil para exportaciones grandes).
+    La conexión se devuelve al pool al agotar o descartar el generador.
+
+    Args:
+        query (str): Query SQL a ejecutar (parámetros %s)
+        params (dict o tuple): Parámetros para query parametrizada
+        itersize (int): Filas por viaje al servidor
+        readonly (bool): Ejecutar en la réplica de lectura si existe
+
+    Yields:
+        dict: Cada fila del resultado
+    """
+    try:
+        # Los cursores con nombre requieren transacción (sin autocommit)
+        with get_db_connection(readonly=readonly) as connection:
+            with connection.cursor(name='stream_cursor') as cursor:
+                cursor.itersize = itersize
+                cursor.execute(query, params)
+                yield from cursor
+
+    except Exception as e:
+        logger.error(f"Error ejecutando query en streaming: {str(e)}")
+        raise
+
+def execute_insert(query, data, page_size=1000):
     """
     Ejecutar INSERT múltiple
 
+    Las filas se envían con execute_values: un solo INSERT ... VALUES (...), (...)
+    por cada página de page_size filas, en lugar de un INSERT por fila.
+
     Args:
-        query (str): Query INSERT base (sin VALUES)
+        query (str): Query INSERT con un único marcador VALUES %s
+                     (p. ej. "INSERT INTO tabla (a, b) VALUES %s")
         data (list): Lista de tuplas con datos a insertar
+        page_size (int): Filas por sentencia
 
     Returns:
         bool: True si fue exitoso
     """
-    connection = None
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-
-        # Para PostgreSQL, usar executemany con placeholder %s
-        cursor.executemany(query, data)
-        connection.commit()
+        with get_db_connection() as connection, connection.cursor() as cursor:
+            execute_values(cursor, query, data, page_size=page_size)
         return True
 
     except Exception as e:
         logger.error(f"Error en INSERT: {str(e)}")
-        if connection:
-            connection.rollback()
         raise
 
-    finally:
-        if connection:
-            connection.close()
-
 def init_database():
     """
     Inicializar base de datos con tablas necesarias
     """
-    connection = None
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-
-        # Tabla de usuarios
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS usuarios (
-                id SERIAL PRIMARY KEY,
-                nombre VARCHAR(100) NOT NULL,
-                apellido VARCHAR(100) NOT NULL,
-                email VARCHAR(255) UNIQUE NOT NULL,
-                password VARCHAR(255) NOT NULL,
-                rol VARCHAR(20) DEFAULT 'usuario' CHECK (rol IN ('admin', 'usuario')),
-                fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                activo BOOLEAN DEFAULT TRUE
-            )
-        """)
-
-        # Tabla de ventas
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS ventas (
-                id SERIAL PRIMARY KEY,
-                fecha TIMESTAMP NOT NULL,
-                producto VARCHAR(255) NOT NULL,
-                cantidad DECIMAL(10, 2) NOT NULL,
-                precio_unitario DECIMAL(10, 2) NOT NULL,
-                total DECIMAL(10, 2) NOT NULL,
-                usuario_id INTEGER REFERENCES usuarios(id),
-                fecha_carga TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        # Índice para mejorar búsquedas por fecha
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_ventas_fecha ON ventas(fecha DESC)
-        """)
-
-        # Tabla de productos (catálogo)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS productos (
-                id SERIAL PRIMARY KEY,
-                nombre VARCHAR(255) NOT NULL,
-                categoria VARCHAR(100),
-                precio DECIMAL(10, 2),
-                activo BOOLEAN DEFAULT TRUE,
-                fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        # Tabla de gastos (contabilidad)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS gastos (
-                id SERIAL PRIMARY KEY,
-                fecha TIMESTAMP NOT NULL,
-                concepto VARCHAR(255) NOT NULL,
-                categoria VARCHAR(100) NOT NULL,
-                monto DECIMAL(10, 2) NOT NULL,
-                comprobante VARCHAR(100),
-                usuario_id INTEGER REFERENCES usuarios(id),
-                fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        # Índice para mejorar búsquedas por fecha en gastos
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_gastos_fecha ON gastos(fecha DESC)
-        """)
+        with get_db_connection() as connection:
+            cursor = connection.cursor()
+
+            # Tabla de usuarios
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS usuarios (
+                    id SERIAL PRIMARY KEY,
+                    nombre VARCHAR(100) NOT NULL,
+                    apellido VARCHAR(100) NOT NULL,
+                    email VARCHAR(255) UNIQUE NOT NULL,
+                    password VARCHAR(255) NOT NULL,
+                    rol VARCHAR(20) DEFAULT 'usuario' CHECK (rol IN ('admin', 'usuario')),
+                    fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    activo BOOLEAN DEFAULT TRUE
+                )
+            """)
+
+            # Tabla de ventas
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS ventas (
+                    id SERIAL PRIMARY KEY,
+                    fecha TIMESTAMP NOT NULL,
+                    producto VARCHAR(255) NOT NULL,
+                    cantidad DECIMAL(10, 2) NOT NULL,
+                    precio_unitario DECIMAL(10, 2) NOT NULL,
+                    total DECIMAL(10, 2) NOT NULL,
+                    usuario_id INTEGER REFERENCES usuarios(id),
+                    fecha_carga TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # Índice para mejorar búsquedas por fecha
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_ventas_fecha ON ventas(fecha DESC)
+            """)
+
+            # Índice para paginar por (fecha, id) sin OFFSET
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_ventas_fecha_id ON ventas(fecha DESC, id DESC)
+            """)
+
+            # Tabla de productos (catálogo)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS productos (
+                    id SERIAL PRIMARY KEY,
+                    nombre VARCHAR(255) NOT NULL,
+                    categoria VARCHAR(100),
+                    precio DECIMAL(10, 2),
+                    activo BOOLEAN DEFAULT TRUE,
+                    fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # Tabla de gastos (contabilidad)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS gastos (
+                    id SERIAL PRIMARY KEY,
+                    fecha TIMESTAMP NOT NULL,
+                    concepto VARCHAR(255) NOT NULL,
+                    categoria VARCHAR(100) NOT NULL,
+                    monto DECIMAL(10, 2) NOT NULL,
+                    comprobante VARCHAR(100),
+                    usuario_id INTEGER REFERENCES usuarios(id),
+                    fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # Índice para mejorar búsquedas por fecha en gastos
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_gastos_fecha ON gastos(fecha DESC)
+            """)
 
-        connection.commit()
         logger.info("Base de datos PostgreSQL inicializada correctamente")
 
     except Exception as e:
         logger.error(f"Error inicializando base de datos: {str(e)}")
-        if connection:
-            connection.rollback()
         raise
 
-    finally:
-        if connection:
-            connection.close()
-
 def decimal_to_float(value):
     """Convertir Decimal a float para JSON"""
     if isinstance(value, Decimal):
         return float(value)
     return value
+
+def month_range(mes, anio):
+    """
+    Rango [inicio, fin) de un mes, para filtrar por fecha usando el índice
+
+    Args:
+        mes (int): Mes (1-12)
+        anio (int): Año
+
+    Returns:
+        tuple: (primer día del mes, primer día del mes siguiente)
+    """
+    inicio = date(anio, mes, 1)
+    fin = date(anio + 1, 1, 1) if mes == 12 else date(anio, mes + 1, 1)
+    return inicio, fin
@@ -2,4 +2,4 @@ from flask import Blueprint
 
 reportes_bp = Blueprint('reportes', __name__, url_prefix='/reportes')
 
-from . import routes
+# Las rutas se cargan desde create_app (app.BLUEPRINTS)
@@ -2,10 +2,104 @@
 Funciones de base de datos para reportes - PostgreSQL
 """
 import logging
-from database import execute_query, decimal_to_float
+from database import execute_query, execute_prepared, month_range
+from cache import cache, memoize_mensual
 
 logger = logging.getLogger(__name__)
 
+# Filas insertadas, modificadas o borradas en las tablas de origen de
+# mv_recetas_costo; si cambia desde el último refresco la vista está vieja
+_Q_ESCRITURAS_RECETAS = """
+    SELECT COALESCE(SUM(n_tup_ins + n_tup_upd + n_tup_del), 0)::bigint AS escrituras
+    FROM pg_stat_user_tables
+    WHERE schemaname = 'LealSilver'
+    AND relname IN ('recetas', 'costo_producto')
+"""
+_CLAVE_ESCRITURAS_RECETAS = 'mv_recetas_costo:escrituras'
+
+# Dashboard: total del mes, por sucursal y por platillo en un solo recorrido
+# de la vista materializada (GROUPING() = 1 marca la columna no agrupada).
+# Se ejecutan como sentencias preparadas: $1 anio, $2 mes, $3 top de
+# productos y $4 sucursal (solo en _Q_DASHBOARD_SUCURSAL)
+_Q_DASHBOARD_AGREGADO = """
+    SELECT
+        GROUPING(sucursal) AS sin_sucursal,
+        GROUPING(clave_platillo) AS sin_platillo,
+        sucursal,
+        clave_platillo,
+        nombre_platillo,
+        grupo,
+        COALESCE(SUM(cantidad), 0)::float8 AS cantidad_total,
+        COALESCE(SUM(venta), 0)::float8 AS ventas_totales,
+        COALESCE(SUM(costo_venta), 0)::float8 AS costo_venta_total,
+        COALESCE(SUM(ingreso_real), 0)::float8 AS ingreso_real
+    FROM "LealSilver".mv_ventas_mensuales
+    WHERE anio = $1 AND mes = $2
+"""
+
+# Solo se muestran las sucursales esperadas; las que no vendieron en el mes
+# se agregan en ceros. De los platillos solo salen los primeros _TOP_PRODUCTOS
+# por ventas. Todo sale ordenado por ventas de mayor a menor.
+_Q_DASHBOARD_COMPLETAR = """
+    SELECT * FROM (
+        SELECT *, ROW_NUMBER() OVER (
+            PARTITION BY sin_platillo ORDER BY ventas_totales DESC, nombre_platillo
+        ) AS posicion
+        FROM agregado
+    ) a
+    WHERE CASE
+        WHEN sin_platillo = 0 THEN posicion <= $3
+        ELSE sin_sucursal = 1 OR sucursal IN (SELECT sucursal FROM esperadas)
+    END
+    UNION ALL
+    SELECT 0, 1, e.sucursal, NULL, NULL, NULL, 0, 0, 0, 0, NULL
+    FROM esperadas e
+    WHERE NOT EXISTS (
+        SELECT 1 FROM agregado a
+        WHERE a.sin_platillo = 1 AND a.sin_sucursal = 0 AND a.sucursal = e.sucursal
+    )
+    ORDER BY ventas_totales DESC, sucursal
+"""
+
+_Q_DASHBOARD_ESPERADAS = """
+    WITH esperadas(sucursal) AS (VALUES ('Centro'), ('LM'), ('Auditorio'), ('Ahumada')),
+    agregado AS (
+"""
+
+_Q_DASHBOARD = _Q_DASHBOARD_ESPERADAS + _Q_DASHBOARD_AGREGADO + """
+        GROUP BY GROUPING SETS ((), (sucursal), (clave_platillo, nombre_platillo, grupo))
+    )
+""" + _Q_DASHBOARD_COMPLETAR
+
+# Con filtro de sucursal: el desglose por sucursal sigue mostrando todas, así
+# que el total general es la fila de la sucursal elegida y los platillos se
+# agrupan por sucursal y se quedan solo los de esa sucursal
+_Q_DASHBOARD_SUCURSAL = _Q_DASHBOARD_ESPERADAS + _Q_DASHBOARD_AGREGADO + """
+        GROUP BY GROUPING SETS ((sucursal), (sucursal, clave_platillo, nombre_platillo, grupo))
+        HAVING GROUPING(clave_platillo) = 1 OR sucursal = $4
+    )
+""" + _Q_DASHBOARD_COMPLETAR
+
+_CAMPOS_GENERAL = ('ventas_totales', 'costo_venta_total', 'ingreso_real')
+
+# Métricas en ceros para meses sin ventas o cuando el dashboard falla
+# (solo lectura: quien necesite modificarlas debe copiarlas)
+DASHBOARD_GENERAL_VACIO = {
+    'ventas_totales': 0,
+    'costo_venta_total': 0,
+    'ingreso_real': 0,
+    'porcentaje_costo': 0,
+    'porcentaje_ingreso': 0,
+    'roi': 0
+}
+
+DASHBOARD_SUCURSALES_VACIAS = tuple(
+    {'sucursal': sucursal, **DASHBOARD_GENERAL_VACIO}
+    for sucursal in ('Centro', 'LM', 'Auditorio', 'Ahumada')
+)
+
+_TOP_PRODUCTOS = 20
+
 
 def obtener_reporte_ventas_mes(mes=None, anio=None):
     """Obtener reporte de ventas agrupado por día"""
@@ -23,18 +117,16 @@ def obtener_reporte_ventas_mes(mes=None, anio=None):
         params = []
 
         if mes and anio:
-            conditions.append("EXTRACT(MONTH FROM fecha) = %s")
-            conditions.append("EXTRACT(YEAR FROM fecha) = %s")
-            params.extend([int(mes), int(anio)])
+            # Rango de fechas en lugar de EXTRACT para poder usar idx_ventas_fecha
+            conditions.append("fecha >= %s AND fecha < %s")
+            params.extend(month_range(int(mes), int(anio)))
 
         if conditions:
             query += " WHERE " + " AND ".join(conditions)
 
         query += " GROUP BY DATE(fecha) ORDER BY dia DESC"
 
-        results = execute_query(query, tuple(params) if params else None)
-
-        return [dict(row) for row in results]
+        return execute_query(query, tuple(params) if params else None)
 
     except Exception as e:
         logger.error(f"Error obteniendo reporte ventas mes: {str(e)}")
@@ -57,8 +149,7 @@ def obtener_productos_mas_vendidos(limit=20):
             LIMIT %s
         """
 
-        results = execute_query(query, (limit,))
-        return [dict(row) for row in results]
+        return execute_query(query, (limit,))
 
     except Exception as e:
         logger.error(f"Error obteniendo productos más vendidos: {str(e)}")
@@ -66,22 +157,27 @@ def obtener_productos_mas_vendidos(limit=20):
 
 
 def obtener_catalogo_recetas():
-    """Obtener catálogo de recetas con costo total calculado"""
+    """
+    Obtener catálogo de recetas con costo total calculado (desde mv_recetas_costo)
+
+    Los montos se convierten a float8 en la consulta, así psycopg2 ya los
+    entrega como float sin pasar por Decimal.
+    """
     try:
+        _vigilar_recetas_costo()
+
         query = """
             SELECT
-                r.codigo_platillo,
-                r.platillo,
+                codigo_platillo,
+                platillo,
                 COUNT(*) AS num_ingredientes,
-                ROUND(SUM(r.cantidad * COALESCE(cp.costo_presupuestado, 0)), 2) AS costo_total
-            FROM "LealSilver".recetas r
-            LEFT JOIN "LealSilver".costo_producto cp ON r.producto = cp.nombre
-            GROUP BY r.codigo_platillo, r.platillo
+                ROUND(SUM(costo_ingrediente), 2)::float8 AS costo_total
+            FROM "LealSilver".mv_recetas_costo
+            GROUP BY codigo_platillo, platillo
             ORDER BY costo_total DESC
         """
 
-        results = execute_query(query)
-        return [decimal_to_float(dict(row)) for row in results]
+        return execute_query(query)
 
     except Exception as e:
         logger.error(f"Error obteniendo catálogo de recetas: {str(e)}")
@@ -89,35 +185,105 @@ def obtener_catalogo_recetas():
 
 
 def obtener_componentes_receta(codigo_platillo):
-    """Obtener componentes/ingredientes de una receta específica con sus costos"""
+    """
+    Obtener componentes/ingredientes de una receta específica con sus costos
+
+    Cada fila trae además costo_total_platillo (suma de todos los
+    ingredientes, calculada en la misma consulta).
+    """
     try:
+        _vigilar_recetas_costo()
+
         query = """
             SELECT
-                r.producto,
-                r.cantidad,
-                r.unidad_medida,
-                COALESCE(cp.costo_presupuestado, 0) as costo_unitario,
-                COALESCE(cp.departamento, 'Sin clasificar') as departamento,
-                ROUND(r.cantidad * COALESCE(cp.costo_presupuestado, 0), 4) as costo_ingrediente
-            FROM "LealSilver".recetas r
-            LEFT JOIN "LealSilver".costo_producto cp ON r.producto = cp.nombre
-            WHERE r.codigo_platillo = %s
-            ORDER BY
-                CASE WHEN cp.costo_presupuestado IS NULL THEN 1 ELSE 0 END,
-                costo_ingrediente DESC
+                producto,
+                cantidad::float8 AS cantidad,
+                unidad_medida,
+                costo_unitario::float8 AS costo_unitario,
+                departamento,
+                costo_ingrediente::float8 AS costo_ingrediente,
+                ROUND(SUM(costo_ingrediente) OVER (), 2)::float8 as costo_total_platillo
+            FROM "LealSilver".mv_recetas_costo
+            WHERE codigo_platillo = %s
+            ORDER BY sin_costo, costo_ingrediente DESC
         """
 
-        results = execute_query(query, (codigo_platillo,))
-        return [decimal_to_float(dict(row)) for row in results]
+        return execute_query(query, (codigo_platillo,))
 
     except Exception as e:
         logger.error(f"Error obteniendo componentes de receta {codigo_platillo}: {str(e)}")
         raise
 
 
+def refrescar_recetas_costo():
+    """
+    Refrescar la vista materializada de costo de recetas
+
+    Sin CONCURRENTLY (la vista no tiene índice único): el catálogo espera
+    los pocos milisegundos que tarda en recalcularse.
+    """
+    try:
+        execute_query('REFRESH MATERIALIZED VIEW "LealSilver".mv_recetas_costo')
+        logger.info("Vista mv_recetas_costo refrescada")
+
+    except Exception as e:
+        logger.error(f"Error refrescando mv_recetas_costo: {str(e)}")
+        raise
+
+
+def _vigilar_recetas_costo():
+    """
+    Refrescar mv_recetas_costo si recetas o costo_producto cambiaron
+
+    Las cargas de recetas y costos se hacen fuera de la aplicación, así que
+    se compara el contador de filas escritas de ambas tablas (estadísticas de
+    PostgreSQL) con el del último refresco. Las estadísticas pueden tardar
+    unos segundos en reflejar una carga.
+    """
+    escrituras = execute_query(_Q_ESCRITURAS_RECETAS)[0]['escrituras']
+    if cache.get(_CLAVE_ESCRITURAS_RECETAS) != escrituras:
+        refrescar_recetas_costo()
+        cache.set(_CLAVE_ESCRITURAS_RECETAS, escrituras, timeout=0)
+
+
+def refrescar_ventas_mensuales():
+    """
+    Refrescar la vista materializada del dashboard después de cargar ventas
+
+    CONCURRENTLY permite que el dashboard siga leyendo la versión anterior
+    mientras se recalcula.
+    """
+    try:
+        execute_query('REFRESH MATERIALIZED VIEW CONCURRENTLY "LealSilver".mv_ventas_mensuales')
+        obtener_metricas_dashboard.invalidar()
+        logger.info("Vista mv_ventas_mensuales refrescada")
+
+    except Exception as e:
+        logger.error(f"Error refrescando mv_ventas_mensuales: {str(e)}")
+        raise
+
+
+def _agregar_ratios(fila):
+    """Calcular porcentajes y ROI de una fila a partir de sus sumas ya agregadas"""
+    venta = fila['ventas_totales']
+    costo = fila['costo_venta_total']
+    ingreso = fila['ingreso_real']
+    fila['porcentaje_costo'] = round(costo / venta * 100, 2) if venta else 0
+    fila['porcentaje_ingreso'] = round(ingreso / venta * 100, 2) if venta else 0
+    fila['roi'] = round(ingreso / costo * 100, 2) if costo else 0
+    return fila
+
+
+@memoize_mensual
 def obtener_metricas_dashboard(anio=2026, mes=1, sucursal=None):
     """
-    Obtener métricas financieras del negocio desde la vista vw_ventas_diarias_por_platillo
+    Obtener métricas financieras del negocio desde la vista materializada
+    mv_ventas_mensuales (vw_ventas_diarias_por_platillo agregada por mes)
+
+    Las tres agregaciones (general, por sucursal y por producto) salen de una
+    sola consulta con GROUPING SETS; los porcentajes se calculan en Python
+    sobre las sumas. Cacheado por (anio, mes, sucursal); se invalida al
+    refrescar la vista materializada.
 
     Args:
         anio: Año a filtrar (default: 2026)
@@ -128,104 +294,40 @@ def obtener_metricas_dashboard(anio=2026, mes=1, sucursal=None):
         dict: Métricas generales, por sucursal y por producto
     """
     try:
-        # Construir filtro de sucursal si aplica
-        filtro_sucursal = ""
-        params_general = (anio, mes)
         if sucursal:
-            filtro_sucursal = "AND sucursal = %s"
-            params_general = (anio, mes, sucursal)
-
-        # 1. MÉTRICAS GENERALES (todas las sucursales o una específica)
-        query_general = f"""
-            SELECT
-                SUM(venta) as ventas_totales,
-                SUM(costo_venta) as costo_venta_total,
-                SUM(ingreso_real) as ingreso_real,
-                ROUND(SUM(costo_venta) / NULLIF(SUM(venta), 0) * 100, 2) as porcentaje_costo,
-                ROUND(SUM(ingreso_real) / NULLIF(SUM(venta), 0) * 100, 2) as porcentaje_ingreso,
-                ROUND(SUM(ingreso_real) / NULLIF(SUM(costo_venta), 0) * 100, 2) as roi
-            FROM "LealSilver".vw_ventas_diarias_por_platillo
-            WHERE anio = %s AND mes = %s {filtro_sucursal}
-        """
-
-        result_general = execute_query(query_general, params_general)
-        general = decimal_to_float(dict(result_general[0])) if result_general else {
-            'ventas_totales': 0,
-            'costo_venta_total': 0,
-            'ingreso_real': 0,
-            'porcentaje_costo': 0,
-            'porcentaje_ingreso': 0,
-            'roi': 0
-        }
-
-        # 2. DESGLOSE POR SUCURSAL
-        query_sucursal = """
-            SELECT
-                sucursal,
-                SUM(venta) as ventas_totales,
-                SUM(costo_venta) as costo_venta_total,
-                SUM(ingreso_real) as ingreso_real,
-                ROUND(SUM(costo_venta) / NULLIF(SUM(venta), 0) * 100, 2) as porcentaje_costo,
-                ROUND(SUM(ingreso_real) / NULLIF(SUM(venta), 0) * 100, 2) as porcentaje_ingreso,
-                ROUND(SUM(ingreso_real) / NULLIF(SUM(costo_venta), 0) * 100, 2) as roi
-            FROM "LealSilver".vw_ventas_diarias_por_platillo
-            WHERE anio = %s AND mes = %s
-            GROUP BY sucursal
-            ORDER BY ventas_totales DESC
-        """
-
-        results_sucursal = execute_query(query_sucursal, (anio, mes))
-        sucursales = [decimal_to_float(dict(row)) for row in results_sucursal]
-
-        # Asegurar que todas las sucursales esperadas estén presentes
-        sucursales_esperadas = ['Centro', 'LM', 'Auditorio', 'Ahumada']
-        sucursales_dict = {s['sucursal']: s for s in sucursales}
+            results = execute_prepared('dashboard_sucursal', _Q_DASHBOARD_SUCURSAL,
+                                       (anio, mes, _TOP_PRODUCTOS, sucursal))
+        else:
+            results = execute_prepared('dashboard', _Q_DASHBOARD, (anio, mes, _TOP_PRODUCTOS))
 
+        # Separar las filas según su agrupación (ya vienen ordenadas por ventas)
+        general = None
         sucursales_completas = []
-        for suc_nombre in sucursales_esperadas:
-            if suc_nombre in sucursales_dict:
-                sucursales_completas.append(sucursales_dict[suc_nombre])
+        productos = []
+        for row in results:
+            sin_sucursal = row.pop('sin_sucursal')
+            sin_platillo = row.pop('sin_platillo')
+            del row['posicion']
+            if not sin_platillo:
+                # 3. DESGLOSE POR PRODUCTO (top 20, ya limitado en SQL)
+                del row['sucursal']
+                productos.append(_agregar_ratios(row))
+            elif sin_sucursal:
+                general = row
             else:
-                sucursales_completas.append({
-                    'sucursal': suc_nombre,
-                    'ventas_totales': 0,
-                    'costo_venta_total': 0,
-                    'ingreso_real': 0,
-                    'porcentaje_costo': 0,
-                    'porcentaje_ingreso': 0,
-                    'roi': 0
-                })
-
-        # Ordenar por ventas_totales de mayor a menor
-        sucursales_completas.sort(key=lambda x: x['ventas_totales'], reverse=True)
-
-        # 3. DESGLOSE POR PRODUCTO (top 20)
-        params_producto = (anio, mes)
-        filtro_sucursal_producto = filtro_sucursal if sucursal else ""
-        if sucursal:
-            params_producto = (anio, mes, sucursal)
+                # 2. DESGLOSE POR SUCURSAL
+                for campo in ('clave_platillo', 'nombre_platillo', 'grupo', 'cantidad_total'):
+                    del row[campo]
+                sucursales_completas.append(_agregar_ratios(row))
 
-        query_producto = f"""
-            SELECT
-                clave_platillo,
-                nombre_platillo,
-                grupo,
-                SUM(cantidad) as cantidad_total,
-                SUM(venta) as ventas_totales,
-                SUM(costo_venta) as costo_venta_total,
-                SUM(ingreso_real) as ingreso_real,
-                ROUND(SUM(costo_venta) / NULLIF(SUM(venta), 0) * 100, 2) as porcentaje_costo,
-                ROUND(SUM(ingreso_real) / NULLIF(SUM(venta), 0) * 100, 2) as porcentaje_ingreso,
-                ROUND(SUM(ingreso_real) / NULLIF(SUM(costo_venta), 0) * 100, 2) as roi
-            FROM "LealSilver".vw_ventas_diarias_por_platillo
-            WHERE anio = %s AND mes = %s {filtro_sucursal_producto}
-            GROUP BY clave_platillo, nombre_platillo, grupo
-            ORDER BY ventas_totales DESC
-            LIMIT 20
-        """
-
-        results_producto = execute_query(query_producto, params_producto)
-        productos = [decimal_to_float(dict(row)) for row in results_producto]
+        # 1. MÉTRICAS GENERALES (todas las sucursales o una específica)
+        if sucursal:
+            general = next((s for s in sucursales_completas if s['sucursal'] == sucursal), None)
+        if general:
+            general = {campo: general[campo] for campo in _CAMPOS_GENERAL}
+            _agregar_ratios(general)
+        else:
+            general = dict(DASHBOARD_GENERAL_VACIO)
 
         return {
             'general': general,
@@ -235,21 +337,5 @@ def obtener_metricas_dashboard(anio=2026, mes=1, sucursal=None):
 
     except Exception as e:
         logger.error(f"Error obteniendo métricas dashboard: {str(e)}")
-        # Retornar datos vacíos en caso de error
-        return {
-            'general': {
-                'ventas_totales': 0,
-                'costo_venta_total': 0,
-                'ingreso_real': 0,
-                'porcentaje_costo': 0,
-                'porcentaje_ingreso': 0,
-                'roi': 0
-            },
-            'sucursales': [
-                {'sucursal': 'Centro', 'ventas_totales': 0, 'costo_venta_total': 0, 'ingreso_real': 0, 'porcentaje_costo': 0, 'porcentaje_ingreso': 0, 'roi': 0},
-                {'sucursal': 'LM', 'ventas_totales': 0, 'costo_venta_total': 0, 'ingreso_real': 0, 'porcentaje_costo': 0, 'porcentaje_ingreso': 0, 'roi': 0},
-                {'sucursal': 'Auditorio', 'ventas_totales': 0, 'costo_venta_total': 0, 'ingreso_real': 0, 'porcentaje_costo': 0, 'porcentaje_ingreso': 0, 'roi': 0},
-                {'sucursal': 'Ahumada', 'ventas_totales': 0, 'costo_venta_total': 0, 'ingreso_real': 0, 'porcentaje_costo': 0, 'porcentaje_ingreso': 0, 'roi': 0}
-            ],
-            'productos': []
-        }
+        # El error no se cachea: la ruta muestra el dashboard vacío
+        raise
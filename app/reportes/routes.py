@@ -1,19 +1,32 @@
-from flask import render_template, request, jsonify
+from flask import render_template, request, jsonify, session, current_app, make_response
+import hashlib
 import logging
 
 from . import reportes_bp
 from auth import login_required
+from cache import con_etag, no_modificado_304
 from .database import (
     obtener_reporte_ventas_mes,
     obtener_productos_mas_vendidos,
     obtener_catalogo_recetas,
     obtener_componentes_receta,
-    obtener_metricas_dashboard
+    obtener_metricas_dashboard,
+    DASHBOARD_GENERAL_VACIO,
+    DASHBOARD_SUCURSALES_VACIAS
 )
 
 logger = logging.getLogger(__name__)
 
 
+def _etag_pagina(*datos):
+    """
+    ETag de una página: hash de los datos que muestra, del usuario en sesión
+    y de los mensajes flash pendientes (ambos aparecen en el encabezado)
+    """
+    contenido = current_app.json.dumps([session.get('user_id'), session.get('_flashes'), *datos])
+    return hashlib.sha1(contenido.encode('utf-8')).hexdigest()
+
+
 @reportes_bp.route('/')
 @login_required
 def index():
@@ -27,33 +40,27 @@ def index():
         # Obtener métricas con filtros
         metricas = obtener_metricas_dashboard(anio=anio, mes=mes, sucursal=sucursal)
 
-        return render_template('reportes/index.html',
+        # Si el navegador ya tiene esta versión no se vuelve a renderizar
+        etag = _etag_pagina(anio, mes, sucursal, metricas)
+        no_modificado = no_modificado_304(etag)
+        if no_modificado:
+            return no_modificado
+
+        return con_etag(make_response(render_template('reportes/index.html',
                              general=metricas['general'],
                              sucursales=metricas['sucursales'],
                              productos=metricas['productos'],
                              anio_seleccionado=anio,
                              mes_seleccionado=mes,
-                             sucursal_seleccionada=sucursal)
+                             sucursal_seleccionada=sucursal)), etag)
     except Exception as e:
         logger.error(f"Error obteniendo métricas dashboard: {str(e)}")
         import traceback
         traceback.print_exc()
         # Retornar template con datos vacíos en caso de error
         return render_template('reportes/index.html',
-                             general={
-                                 'ventas_totales': 0,
-                                 'costo_venta_total': 0,
-                                 'ingreso_real': 0,
-                                 'porcentaje_costo': 0,
-                                 'porcentaje_ingreso': 0,
-                                 'roi': 0
-                             },
-                             sucursales=[
-                                 {'sucursal': 'Centro', 'ventas_totales': 0, 'costo_venta_total': 0, 'ingreso_real': 0, 'porcentaje_costo': 0, 'porcentaje_ingreso': 0, 'roi': 0},
-                                 {'sucursal': 'LM', 'ventas_totales': 0, 'costo_venta_total': 0, 'ingreso_real': 0, 'porcentaje_costo': 0, 'porcentaje_ingreso': 0, 'roi': 0},
-                                 {'sucursal': 'Auditorio', 'ventas_totales': 0, 'costo_venta_total': 0, 'ingreso_real': 0, 'porcentaje_costo': 0, 'porcentaje_ingreso': 0, 'roi': 0},
-                                 {'sucursal': 'Ahumada', 'ventas_totales': 0, 'costo_venta_total': 0, 'ingreso_real': 0, 'porcentaje_costo': 0, 'porcentaje_ingreso': 0, 'roi': 0}
-                             ],
+                             general=DASHBOARD_GENERAL_VACIO,
+                             sucursales=DASHBOARD_SUCURSALES_VACIAS,
                              productos=[],
                              anio_seleccionado=2026,
                              mes_seleccionado=1,
@@ -67,7 +74,13 @@ def productos():
     """Reporte de productos más vendidos"""
     try:
         productos = obtener_productos_mas_vendidos(limit=50)
-        return render_template('reportes/productos.html', productos=productos)
+
+        etag = _etag_pagina(productos)
+        no_modificado = no_modificado_304(etag)
+        if no_modificado:
+            return no_modificado
+
+        return con_etag(make_response(render_template('reportes/productos.html', productos=productos)), etag)
 
     except Exception as e:
         logger.error(f"Error en reportes productos: {str(e)}")
@@ -103,7 +116,13 @@ def catalogo_recetas():
     """Catálogo de recetas con costos"""
     try:
         recetas = obtener_catalogo_recetas()
-        return render_template('reportes/catalogo_recetas.html', recetas=recetas)
+
+        etag = _etag_pagina(recetas)
+        no_modificado = no_modificado_304(etag)
+        if no_modificado:
+            return no_modificado
+
+        return con_etag(make_response(render_template('reportes/catalogo_recetas.html', recetas=recetas)), etag)
 
     except Exception as e:
         logger.error(f"Error en catálogo de recetas: {str(e)}")
@@ -117,13 +136,13 @@ def api_componentes_receta(codigo_platillo):
     try:
         componentes = obtener_componentes_receta(codigo_platillo)
 
-        # Calcular costo total
-        costo_total = sum(c.get('costo_ingrediente', 0) or 0 for c in componentes)
+        # El costo total ya viene sumado en cada fila
+        costo_total = componentes[0]['costo_total_platillo'] if componentes else 0
 
         return jsonify({
             'success': True,
             'componentes': componentes,
-            'costo_total': round(costo_total, 2)
+            'costo_total': costo_total
         })
 
     except Exception as e:
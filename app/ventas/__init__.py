@@ -2,4 +2,4 @@ from flask import Blueprint
 
 ventas_bp = Blueprint('ventas', __name__, url_prefix='/ventas')
 
-from . import routes
+# Las rutas se cargan desde create_app (app.BLUEPRINTS)
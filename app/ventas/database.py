@@ -1,14 +1,17 @@
 """
 Funciones de base de datos para el módulo de ventas - PostgreSQL
 """
+import functools
+import io
+import itertools
 import logging
 import pandas as pd
 from decimal import Decimal
-from datetime import datetime
+from datetime import date
 from database import execute_query, get_db_connection, decimal_to_float
 import psycopg2
-from config import Config
-from io import StringIO
+import psycopg2.errors
+from psycopg2.extras import execute_values
 
 logger = logging.getLogger(__name__)
 
@@ -49,6 +52,57 @@ def distribuir_cantidad_entre_dias(cantidad_total, dia_actual, total_dias):
         return cantidad_base
 
 
+# COPY en formato texto: la diagonal invertida es carácter de escape y el
+# tabulador / saltos de línea separan campos y filas
+_COPY_ESCAPE = str.maketrans({'\\': '\\\\', '\t': ' ', '\n': ' ', '\r': ' '})
+
+
+# Tipos cuyo texto nunca lleva caracteres especiales de COPY
+_TIPOS_NUMERO = frozenset((int, float, Decimal))
+
+
+def _copy_valor(val):
+    """Texto de un valor para COPY: \\N si es NULL, el texto escapado si no es número"""
+    if val is None:
+        return '\\N'
+    if type(val) in _TIPOS_NUMERO:
+        return str(val)
+    return str(val).translate(_COPY_ESCAPE)
+
+
+class _LectorCopy(io.RawIOBase):
+    """
+    Archivo de solo lectura que entrega las líneas de COPY conforme se piden
+
+    copy_expert lee en bloques; cada bloque se arma con las siguientes líneas
+    ya codificadas, así en memoria solo vive un bloque y no todo el contenido.
+    """
+
+    def __init__(self, lineas):
+        self._lineas = lineas
+        self._resto = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        tam = len(buffer)
+        partes = [self._resto]
+        leido = len(self._resto)
+
+        while leido < tam:
+            linea = next(self._lineas, None)
+            if linea is None:
+                break
+            partes.append(linea)
+            leido += len(linea)
+
+        datos = b''.join(partes)
+        bloque, self._resto = datos[:tam], datos[tam:]
+        buffer[:len(bloque)] = bloque
+        return len(bloque)
+
+
 def bulk_insert_copy(cursor, table, columns, registros):
     """
     Inserción masiva usando PostgreSQL COPY (10-100x más rápido que INSERT)
@@ -57,28 +111,20 @@ def bulk_insert_copy(cursor, table, columns, registros):
         cursor: Cursor de psycopg2
         table: Nombre de la tabla con schema (ej: LealSilver.ventas_por_hora)
         columns: Lista de nombres de columnas
-        registros: Lista de tuplas con los datos
+        registros: Lista (o iterable) de tuplas con los datos
     """
-    if not registros:
+    filas = iter(registros)
+    primera = next(filas, None)
+    if primera is None:
         return
 
-    buffer = StringIO()
-    for registro in registros:
-        # Convertir cada valor a string, usar \N para NULL
-        row = []
-        for val in registro:
-            if val is None:
-                row.append('\\N')
-            elif isinstance(val, Decimal):
-                row.append(str(val))
-            elif isinstance(val, (int, float)):
-                row.append(str(val))
-            else:
-                # Escapar caracteres especiales en strings
-                row.append(str(val).replace('\t', ' ').replace('\n', ' '))
-        buffer.write('\t'.join(row) + '\n')
-
-    buffer.seek(0)
+    # Cada valor se formatea según su propio tipo (una columna puede mezclar
+    # números y texto); cada línea se arma y codifica cuando COPY la pide
+    lineas = (
+        ('\t'.join(map(_copy_valor, registro)) + '\n').encode('utf-8')
+        for registro in itertools.chain((primera,), filas)
+    )
+    buffer = _LectorCopy(lineas)
 
     # Usar copy_expert para manejar nombres con mayúsculas correctamente
     # Separar schema y tabla para agregar comillas
@@ -93,8 +139,14 @@ def bulk_insert_copy(cursor, table, columns, registros):
     cursor.copy_expert(copy_sql, buffer)
 
 
-def obtener_ventas(limit=100, fecha_inicio=None, fecha_fin=None):
-    """Obtener ventas con filtros opcionales"""
+def obtener_ventas(limit=100, fecha_inicio=None, fecha_fin=None, cursor_fecha=None, cursor_id=None):
+    """
+    Obtener ventas con filtros opcionales
+
+    Para paginar se pasa la (fecha, id) de la última venta recibida: la
+    siguiente página empieza justo después usando el índice (fecha, id),
+    sin OFFSET.
+    """
     try:
         query = """
             SELECT id, fecha, producto, cantidad, precio_unitario, total, usuario_id, fecha_carga
@@ -112,14 +164,17 @@ def obtener_ventas(limit=100, fecha_inicio=None, fecha_fin=None):
             conditions.append("fecha <= %s")
             params.append(fecha_fin)
 
+        if cursor_fecha and cursor_id:
+            conditions.append("(fecha, id) < (%s, %s)")
+            params.extend([cursor_fecha, cursor_id])
+
         if conditions:
             query += " WHERE " + " AND ".join(conditions)
 
         query += " ORDER BY fecha DESC, id DESC LIMIT %s"
         params.append(limit)
 
-        results = execute_query(query, tuple(params))
-        return [dict(row) for row in results]
+        return execute_query(query, tuple(params))
 
     except Exception as e:
         logger.error(f"Error obteniendo ventas: {str(e)}")
@@ -127,31 +182,26 @@ def obtener_ventas(limit=100, fecha_inicio=None, fecha_fin=None):
 
 
 def insertar_ventas(ventas_data, usuario_id):
-    """Insertar múltiples ventas"""
+    """Insertar múltiples ventas (un solo COPY en lugar de un INSERT por fila)"""
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-
-        query = """
-            INSERT INTO ventas (fecha, producto, cantidad, precio_unitario, total, usuario_id)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """
+        columnas = ['fecha', 'producto', 'cantidad', 'precio_unitario', 'total', 'usuario_id']
 
+        # COPY recibe el texto de cada valor: no hace falta pasar por Decimal
         data = [
             (
                 venta['fecha'],
                 venta['producto'],
-                Decimal(str(venta['cantidad'])),
-                Decimal(str(venta['precio_unitario'])),
-                Decimal(str(venta['total'])),
+                venta['cantidad'],
+                venta['precio_unitario'],
+                venta['total'],
                 usuario_id
             )
             for venta in ventas_data
         ]
 
-        cursor.executemany(query, data)
-        connection.commit()
-        connection.close()
+        with get_db_connection() as connection:
+            cursor = connection.cursor()
+            bulk_insert_copy(cursor, 'ventas', columnas, data)
 
         logger.info(f"Se insertaron {len(data)} ventas")
         return True
@@ -161,6 +211,39 @@ def insertar_ventas(ventas_data, usuario_id):
         raise
 
 
+# Formatos aceptados cuando la fecha viene como texto
+_FORMATOS_FECHA = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y')
+
+
+def _convertir_fechas(fechas):
+    """
+    Convertir la columna de fechas a datetime probando cada formato por columna
+
+    Los valores que ya son fechas se conservan; los textos se prueban con
+    _FORMATOS_FECHA en orden y los no reconocidos quedan como NaT, igual que
+    cualquier otro valor (números como seriales de Excel o totales sueltos,
+    que pd.to_datetime tomaría como nanosegundos desde 1970).
+    """
+    if pd.api.types.is_datetime64_any_dtype(fechas):
+        return fechas
+
+    es_texto = fechas.map(lambda valor: isinstance(valor, str)).astype(bool)
+    es_fecha = fechas.map(lambda valor: isinstance(valor, date)).astype(bool)
+    convertidas = pd.to_datetime(fechas.where(es_fecha), errors='coerce')
+
+    for fmt in _FORMATOS_FECHA:
+        pendientes = es_texto & convertidas.isna()
+        if not pendientes.any():
+            break
+        convertidas[pendientes] = pd.to_datetime(fechas[pendientes], format=fmt, errors='coerce')
+
+    no_reconocidas = fechas[es_texto & convertidas.isna()]
+    if not no_reconocidas.empty:
+        logger.warning(f"Formato de fecha no reconocido: {', '.join(no_reconocidas.astype(str).unique()[:5])}")
+
+    return convertidas
+
+
 def procesar_excel_ventas(filepath):
     """Procesar archivo Excel de ventas"""
     try:
@@ -175,44 +258,34 @@ def procesar_excel_ventas(filepath):
 
         df.columns = column_names[:len(df.columns)]
         df = df.dropna(subset=['fecha', 'producto', 'cantidad', 'precio_unitario'])
+        fechas = _convertir_fechas(df['fecha'])
 
-        ventas = []
-
-        for _, row in df.iterrows():
-            try:
-                if isinstance(row['fecha'], str):
-                    for fmt in ['%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y']:
-                        try:
-                            fecha = datetime.strptime(row['fecha'], fmt)
-                            break
-                        except ValueError:
-                            continue
-                    else:
-                        logger.warning(f"Formato de fecha no reconocido: {row['fecha']}")
-                        continue
-                else:
-                    fecha = row['fecha']
+        df = df.assign(
+            fecha=fechas,
+            cantidad=pd.to_numeric(df['cantidad'], errors='coerce'),
+            precio_unitario=pd.to_numeric(df['precio_unitario'], errors='coerce')
+        )
 
-                fecha_str = fecha.strftime('%Y-%m-%d %H:%M:%S')
-                cantidad = float(row['cantidad'])
-                precio_unitario = float(row['precio_unitario'])
+        filas = len(df)
+        df = df.dropna(subset=['fecha', 'cantidad', 'precio_unitario'])
+        if len(df) < filas:
+            logger.warning(f"Se omitieron {filas - len(df)} filas con fecha o números no válidos")
 
-                if 'total' in row and pd.notna(row['total']):
-                    total = float(row['total'])
-                else:
-                    total = cantidad * precio_unitario
-
-                ventas.append({
-                    'fecha': fecha_str,
-                    'producto': str(row['producto']).strip(),
-                    'cantidad': cantidad,
-                    'precio_unitario': precio_unitario,
-                    'total': total
-                })
-
-            except Exception as e:
-                logger.warning(f"Error procesando fila: {str(e)}")
-                continue
+        calculado = df['cantidad'] * df['precio_unitario']
+        if 'total' in df.columns:
+            total = pd.to_numeric(df['total'], errors='coerce').fillna(calculado)
+        else:
+            total = calculado
+
+        df = pd.DataFrame({
+            'fecha': df['fecha'].dt.strftime('%Y-%m-%d %H:%M:%S'),
+            'producto': df['producto'].astype(str).str.strip(),
+            'cantidad': df['cantidad'].astype(float),
+            'precio_unitario': df['precio_unitario'].astype(float),
+            'total': total.astype(float)
+        })
+
+        ventas = df.to_dict('records')
 
         logger.info(f"Se procesaron {len(ventas)} ventas del Excel")
         return ventas
@@ -239,36 +312,26 @@ def verificar_existe_mes(sucursal, anio, mes):
     Returns:
         bool: True si ya existen datos para ese mes, False si no existen
     """
-    connection = None
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-
-        # Verificar en ventas_por_hora (tabla representativa)
+        # Verificar en ventas_por_hora (tabla representativa); EXISTS se detiene
+        # en la primera fila encontrada
         query = """
-            SELECT COUNT(*) as total
-            FROM "LealSilver".ventas_por_hora
-            WHERE sucursal = %s AND anio = %s AND mes = %s
+            SELECT EXISTS (
+                SELECT 1
+                FROM "LealSilver".ventas_por_hora
+                WHERE sucursal = %s AND anio = %s AND mes = %s
+            ) AS existe
         """
 
-        cursor.execute(query, (sucursal, anio, mes))
-        result = cursor.fetchone()
-        cursor.close()
-        connection.close()
-
-        # Acceder por nombre de columna (cursor es RealDictCursor)
-        total = result['total'] if result else 0
-        existe = total > 0
+        existe = execute_query(query, (sucursal, anio, mes))[0]['existe']
 
         if existe:
-            logger.info(f"Ya existen {total} registros para {sucursal} en {anio}-{mes}")
+            logger.info(f"Ya existen registros para {sucursal} en {anio}-{mes}")
 
         return existe
 
     except Exception as e:
         logger.error(f"Error verificando existencia de mes: {str(e)}")
-        if connection:
-            connection.close()
         raise
 
 
@@ -286,36 +349,59 @@ def verificar_existe_dia(sucursal, anio, mes, dia):
     Returns:
         bool: True si ya existen datos para ese día, False si no existen
     """
-    connection = None
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-
-        # Verificar en ventas_por_hora (tabla representativa)
         query = """
-            SELECT COUNT(*) as total
-            FROM "LealSilver".ventas_por_hora
-            WHERE sucursal = %s AND anio = %s AND mes = %s AND dia = %s
+            SELECT EXISTS (
+                SELECT 1
+                FROM "LealSilver".ventas_por_hora
+                WHERE sucursal = %s AND anio = %s AND mes = %s AND dia = %s
+            ) AS existe
         """
 
-        cursor.execute(query, (sucursal, anio, mes, dia))
-        result = cursor.fetchone()
-        cursor.close()
-        connection.close()
-
-        # Acceder por nombre de columna (cursor es RealDictCursor)
-        total = result['total'] if result else 0
-        existe = total > 0
+        existe = execute_query(query, (sucursal, anio, mes, dia))[0]['existe']
 
         if existe:
-            logger.info(f"Ya existen {total} registros para {sucursal} en {anio}-{mes}-{dia}")
+            logger.info(f"Ya existen registros para {sucursal} en {anio}-{mes}-{dia}")
 
         return existe
 
     except Exception as e:
         logger.error(f"Error verificando existencia de día: {str(e)}")
-        if connection:
-            connection.close()
+        raise
+
+
+def verificar_existe_dias(sucursal, anio, mes, dias):
+    """
+    Versión por lote de verificar_existe_dia: una sola consulta para varios días
+
+    Args:
+        sucursal: Nombre de la sucursal
+        anio: Año (2020-2100)
+        mes: Número del mes (1-12)
+        dias: Lista de días del mes (1-31)
+
+    Returns:
+        set: Días que ya tienen datos cargados
+    """
+    try:
+        if not dias:
+            return set()
+
+        query = """
+            SELECT DISTINCT dia
+            FROM "LealSilver".ventas_por_hora
+            WHERE sucursal = %s AND anio = %s AND mes = %s AND dia = ANY(%s)
+        """
+
+        existentes = {row['dia'] for row in execute_query(query, (sucursal, anio, mes, list(dias)))}
+
+        if existentes:
+            logger.info(f"Ya existen registros para {sucursal} en {anio}-{mes}, días {sorted(existentes)}")
+
+        return existentes
+
+    except Exception as e:
+        logger.error(f"Error verificando existencia de días: {str(e)}")
         raise
 
 
@@ -323,6 +409,67 @@ def verificar_existe_dia(sucursal, anio, mes, dia):
 # FUNCIONES PARA INSERTAR DATOS EN ESQUEMA LealSilver
 # ============================================================================
 
+# Cómo se reparte cada campo al dividir un mes entre sus días
+_VALOR = 'valor'        # se copia igual en todos los días
+_MONTO = 'monto'        # se divide entre el número de días
+_CANTIDAD = 'cantidad'  # entero repartido con distribuir_cantidad_entre_dias
+
+# Las 8 tablas de ventas: (tabla, campos propios en orden de columna). Todas
+# llevan además sucursal, anio, mes, dia al inicio y created_by al final.
+_SECCIONES_VENTAS = (
+    ('ventas_por_hora', (
+        ('hora', _VALOR), ('monto', _MONTO))),
+    ('ventas_por_platillo', (
+        ('clave_platillo', _VALOR), ('nombre_platillo', _VALOR), ('grupo', _VALOR),
+        ('cantidad', _CANTIDAD), ('subtotal', _MONTO), ('porcentaje', _VALOR))),
+    ('ventas_por_grupo', (
+        ('grupo', _VALOR), ('subtotal', _MONTO))),
+    ('ventas_por_tipo_grupo', (
+        ('grupo', _VALOR), ('cantidad', _CANTIDAD), ('subtotal', _MONTO), ('iva', _MONTO),
+        ('total', _MONTO), ('porcentaje', _VALOR))),
+    ('ventas_por_tipo_pago', (
+        ('tipo_pago', _VALOR), ('total', _MONTO), ('porcentaje', _VALOR))),
+    ('ventas_por_usuario', (
+        ('usuario', _VALOR), ('subtotal', _MONTO), ('iva', _MONTO), ('total', _MONTO),
+        ('num_cuentas', _CANTIDAD), ('ticket_promedio', _MONTO), ('num_personas', _CANTIDAD),
+        ('promedio_por_persona', _MONTO), ('porcentaje', _VALOR))),
+    ('ventas_por_cajero', (
+        ('cajero', _VALOR), ('subtotal', _MONTO), ('iva', _MONTO), ('total', _MONTO),
+        ('cantidad_transacciones', _CANTIDAD), ('porcentaje', _VALOR))),
+    ('ventas_por_modificador', (
+        ('grupo', _VALOR), ('clave_platillo', _VALOR), ('nombre_platillo', _VALOR),
+        ('tamano', _VALOR), ('cantidad', _CANTIDAD), ('subtotal', _MONTO))),
+)
+
+# Columnas completas e INSERT de cada tabla, armados una sola vez
+_COLUMNAS_VENTAS = {
+    seccion: ['sucursal', 'anio', 'mes', 'dia'] + [campo for campo, _ in campos] + ['created_by']
+    for seccion, campos in _SECCIONES_VENTAS
+}
+
+_INSERT_VENTAS = {
+    seccion: f'INSERT INTO "LealSilver".{seccion} ({", ".join(columnas)}) VALUES %s'
+    for seccion, columnas in _COLUMNAS_VENTAS.items()
+}
+
+
+def _insert_multifila(cursor, query, registros):
+    """
+    Armar un INSERT multi-fila con los valores ya escapados por psycopg2
+
+    Args:
+        cursor: Cursor de psycopg2 (para mogrify)
+        query (str): INSERT ... VALUES %s
+        registros (list): Tuplas con los datos
+
+    Returns:
+        bytes: Sentencia lista para ejecutarse junto con otras
+    """
+    plantilla = '(' + ', '.join(['%s'] * len(registros[0])) + ')'
+    valores = b', '.join(cursor.mogrify(plantilla, registro) for registro in registros)
+    return query.encode('utf-8').replace(b'VALUES %s', b'VALUES ' + valores)
+
+
 def insertar_ventas_leal_silver(data, sucursal, anio, mes, dia, created_by):
     """
     Inserta todas las ventas procesadas en las 8 tablas del esquema LealSilver
@@ -338,173 +485,152 @@ def insertar_ventas_leal_silver(data, sucursal, anio, mes, dia, created_by):
     Returns:
         dict: Resumen de registros insertados
     """
-    connection = None
     try:
-        # Crear conexión DIRECTA sin RealDictCursor para máxima velocidad en inserts
-        connection = psycopg2.connect(
-            host=Config.POSTGRES_HOST,
-            port=Config.POSTGRES_PORT,
-            user=Config.POSTGRES_USER,
-            password=Config.POSTGRES_PASSWORD,
-            database=Config.POSTGRES_DATABASE
-            # NO usar cursor_factory=RealDictCursor - es solo para SELECTs
-        )
-        cursor = connection.cursor()
-
         resumen = {}
 
-        # 1. Ventas por hora
-        if data.get('ventas_por_hora'):
-            query = """
-                INSERT INTO "LealSilver".ventas_por_hora
-                (sucursal, anio, mes, dia, hora, monto, created_by)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """
-            registros = [
-                (sucursal, anio, mes, dia, v['hora'], Decimal(str(v['monto'])), created_by)
-                for v in data['ventas_por_hora']
-            ]
-            cursor.executemany(query, registros)
-            resumen['ventas_por_hora'] = len(registros)
-            logger.info(f"Insertados {len(registros)} registros en ventas_por_hora")
-
-        # 2. Ventas por platillo
-        if data.get('ventas_por_platillo'):
-            query = """
-                INSERT INTO "LealSilver".ventas_por_platillo
-                (sucursal, anio, mes, dia, clave_platillo, nombre_platillo, grupo,
-                 cantidad, subtotal, porcentaje, created_by)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            registros = [
-                (sucursal, anio, mes, dia, v['clave_platillo'], v['nombre_platillo'],
-                 v['grupo'], v['cantidad'], Decimal(str(v['subtotal'])),
-                 Decimal(str(v['porcentaje'])), created_by)
-                for v in data['ventas_por_platillo']
-            ]
-            cursor.executemany(query, registros)
-            resumen['ventas_por_platillo'] = len(registros)
-            logger.info(f"Insertados {len(registros)} registros en ventas_por_platillo")
-
-        # 3. Ventas por grupo
-        if data.get('ventas_por_grupo'):
-            query = """
-                INSERT INTO "LealSilver".ventas_por_grupo
-                (sucursal, anio, mes, dia, grupo, subtotal, created_by)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """
-            registros = [
-                (sucursal, anio, mes, dia, v['grupo'], Decimal(str(v['subtotal'])), created_by)
-                for v in data['ventas_por_grupo']
-            ]
-            cursor.executemany(query, registros)
-            resumen['ventas_por_grupo'] = len(registros)
-            logger.info(f"Insertados {len(registros)} registros en ventas_por_grupo")
-
-        # 4. Ventas por tipo de grupo
-        if data.get('ventas_por_tipo_grupo'):
-            query = """
-                INSERT INTO "LealSilver".ventas_por_tipo_grupo
-                (sucursal, anio, mes, dia, grupo, cantidad, subtotal, iva, total,
-                 porcentaje, created_by)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            registros = [
-                (sucursal, anio, mes, dia, v['grupo'], v['cantidad'],
-                 Decimal(str(v['subtotal'])), Decimal(str(v['iva'])),
-                 Decimal(str(v['total'])), Decimal(str(v['porcentaje'])), created_by)
-                for v in data['ventas_por_tipo_grupo']
-            ]
-            cursor.executemany(query, registros)
-            resumen['ventas_por_tipo_grupo'] = len(registros)
-            logger.info(f"Insertados {len(registros)} registros en ventas_por_tipo_grupo")
-
-        # 5. Ventas por tipo de pago
-        if data.get('ventas_por_tipo_pago'):
-            query = """
-                INSERT INTO "LealSilver".ventas_por_tipo_pago
-                (sucursal, anio, mes, dia, tipo_pago, total, porcentaje, created_by)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            registros = [
-                (sucursal, anio, mes, dia, v['tipo_pago'], Decimal(str(v['total'])),
-                 Decimal(str(v['porcentaje'])), created_by)
-                for v in data['ventas_por_tipo_pago']
-            ]
-            cursor.executemany(query, registros)
-            resumen['ventas_por_tipo_pago'] = len(registros)
-            logger.info(f"Insertados {len(registros)} registros en ventas_por_tipo_pago")
-
-        # 6. Ventas por usuario
-        if data.get('ventas_por_usuario'):
-            query = """
-                INSERT INTO "LealSilver".ventas_por_usuario
-                (sucursal, anio, mes, dia, usuario, subtotal, iva, total, num_cuentas,
-                 ticket_promedio, num_personas, promedio_por_persona, porcentaje, created_by)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            registros = [
-                (sucursal, anio, mes, dia, v['usuario'], Decimal(str(v['subtotal'])),
-                 Decimal(str(v['iva'])), Decimal(str(v['total'])), v['num_cuentas'],
-                 Decimal(str(v['ticket_promedio'])), v['num_personas'],
-                 Decimal(str(v['promedio_por_persona'])), Decimal(str(v['porcentaje'])), created_by)
-                for v in data['ventas_por_usuario']
-            ]
-            cursor.executemany(query, registros)
-            resumen['ventas_por_usuario'] = len(registros)
-            logger.info(f"Insertados {len(registros)} registros en ventas_por_usuario")
-
-        # 7. Ventas por cajero
-        if data.get('ventas_por_cajero'):
-            query = """
-                INSERT INTO "LealSilver".ventas_por_cajero
-                (sucursal, anio, mes, dia, cajero, subtotal, iva, total,
-                 cantidad_transacciones, porcentaje, created_by)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            registros = [
-                (sucursal, anio, mes, dia, v['cajero'], Decimal(str(v['subtotal'])),
-                 Decimal(str(v['iva'])), Decimal(str(v['total'])),
-                 v['cantidad_transacciones'], Decimal(str(v['porcentaje'])), created_by)
-                for v in data['ventas_por_cajero']
-            ]
-            cursor.executemany(query, registros)
-            resumen['ventas_por_cajero'] = len(registros)
-            logger.info(f"Insertados {len(registros)} registros en ventas_por_cajero")
-
-        # 8. Ventas por modificador
-        if data.get('ventas_por_modificador'):
-            query = """
-                INSERT INTO "LealSilver".ventas_por_modificador
-                (sucursal, anio, mes, dia, grupo, clave_platillo, nombre_platillo,
-                 tamano, cantidad, subtotal, created_by)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            registros = [
-                (sucursal, anio, mes, dia, v['grupo'], v['clave_platillo'],
-                 v['nombre_platillo'], v.get('tamano'), v['cantidad'],
-                 Decimal(str(v['subtotal'])), created_by)
-                for v in data['ventas_por_modificador']
-            ]
-            cursor.executemany(query, registros)
-            resumen['ventas_por_modificador'] = len(registros)
-            logger.info(f"Insertados {len(registros)} registros en ventas_por_modificador")
-
-        # Commit de todas las inserciones
-        connection.commit()
-        cursor.close()
+        # Conexión del pool; commit al salir del bloque, rollback si falla.
+        # Cursor simple: RealDictCursor es solo para SELECTs
+        with get_db_connection() as connection:
+            cursor = connection.cursor(cursor_factory=psycopg2.extensions.cursor)
+
+            # Cada tabla se inserta con un solo INSERT multi-fila y los ocho
+            # INSERT viajan juntos al servidor en una sola llamada.
+            # Los montos van tal cual: psycopg2 escribe un float con su repr
+            # corta, el mismo texto que daría Decimal(str(valor))
+            sentencias = []
+            # Columnas comunes a todos los registros, armadas una sola vez
+            prefijo = (sucursal, anio, mes, dia)
+
+            for seccion, campos in _SECCIONES_VENTAS:
+                filas = data.get(seccion)
+                if not filas:
+                    continue
+
+                nombres = [campo for campo, _ in campos]
+                registros = [
+                    (*prefijo, *map(v.get, nombres), created_by)
+                    for v in filas
+                ]
+                sentencias.append(_insert_multifila(cursor, _INSERT_VENTAS[seccion], registros))
+                resumen[seccion] = len(registros)
+
+            if sentencias:
+                cursor.execute(b';\n'.join(sentencias))
 
         logger.info(f"Transacción completada exitosamente. Resumen: {resumen}")
         return resumen
 
     except Exception as e:
-        if connection:
-            connection.rollback()
         logger.error(f"Error insertando datos en LealSilver: {str(e)}")
         raise
-    finally:
-        if connection:
-            connection.close()
+
+
+# Solo afecta a la transacción actual (se revierte en commit/rollback)
+_SIN_SYNCHRONOUS_COMMIT = "SET LOCAL synchronous_commit = OFF"
+
+
+def _copiar_tabla(cursor, seccion, generar_registros):
+    """
+    Cargar una tabla de ventas dentro de la transacción del cursor
+
+    Usa COPY; si el servidor no lo permite (p. ej. un PostgreSQL administrado
+    sin el privilegio), vuelve al savepoint y genera de nuevo los registros
+    para insertarlos con INSERT multi-fila por páginas.
+
+    Args:
+        cursor: Cursor simple de la conexión de la carga
+        seccion: Nombre de la tabla de ventas (ver _SECCIONES_VENTAS)
+        generar_registros: Función sin argumentos que devuelve los registros
+
+    Returns:
+        bool: False si COPY no está permitido (no tiene caso intentarlo en
+        las demás tablas)
+    """
+    cursor.execute("SAVEPOINT carga_tabla")
+    try:
+        bulk_insert_copy(cursor, f'LealSilver.{seccion}', _COLUMNAS_VENTAS[seccion],
+                         generar_registros())
+        copy_permitido = True
+    except (psycopg2.errors.InsufficientPrivilege, psycopg2.errors.FeatureNotSupported) as e:
+        logger.warning(f"COPY no disponible en {seccion} ({str(e).strip()}); usando INSERT por páginas")
+        cursor.execute("ROLLBACK TO SAVEPOINT carga_tabla")
+        execute_values(cursor, _INSERT_VENTAS[seccion], generar_registros(), page_size=1000)
+        copy_permitido = False
+    cursor.execute("RELEASE SAVEPOINT carga_tabla")
+    logger.info(f"✓ Carga terminada en {seccion}")
+    return copy_permitido
+
+
+def _copiar_tablas(cargas):
+    """
+    Cargar varias tablas de ventas en una sola conexión y una sola transacción
+
+    Las tablas se cargan una tras otra: así cada carga usa una sola conexión
+    del pool y, si alguna tabla falla, el rollback deshace todas.
+
+    La transacción no espera el fsync del WAL al hacer commit: es una carga
+    histórica que se puede repetir desde el Excel si el servidor se cae justo
+    en ese momento.
+
+    Args:
+        cargas: Lista de tuplas (seccion, generar_registros)
+    """
+    if not cargas:
+        return
+
+    # Conexión del pool; commit al salir del bloque, rollback si falla.
+    # Cursor simple: RealDictCursor es solo para SELECTs
+    with get_db_connection() as connection:
+        with connection.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+            cursor.execute(_SIN_SYNCHRONOUS_COMMIT)
+
+            usar_copy = True
+            for seccion, generar_registros in cargas:
+                if usar_copy:
+                    usar_copy = _copiar_tabla(cursor, seccion, generar_registros)
+                else:
+                    execute_values(cursor, _INSERT_VENTAS[seccion], generar_registros(), page_size=1000)
+                    logger.info(f"✓ Carga terminada en {seccion}")
+
+
+# Los montos del Excel traen a lo más 4 decimales
+_CUATRO_DECIMALES = Decimal('0.0001')
+
+
+def _dividir_texto(valor, divisor):
+    """
+    Texto de valor / divisor para COPY, calculado con Decimal (exacto)
+
+    Se calcula una vez por registro fuente y el mismo texto se reutiliza en
+    todos los días; PostgreSQL lo redondea al guardarlo en DECIMAL(12, 2).
+    Los float se convierten directo (sin pasar por str) y se redondean a 4
+    decimales para quitar el ruido binario; enteros y texto van tal cual.
+    """
+    if isinstance(valor, float):
+        valor = Decimal.from_float(valor).quantize(_CUATRO_DECIMALES)
+    else:
+        valor = Decimal(valor)
+    return str(valor / divisor)
+
+
+def _filas_por_dia(fuente, cantidades, sucursal, anio, mes, dias_en_mes, created_by):
+    """
+    Generar los registros de cada día a partir de los valores ya divididos
+
+    Args:
+        fuente: Lista de tuplas con los campos de cada registro del mes
+        cantidades: Posiciones de los campos que se reparten por día
+        (el resto de argumentos son las columnas comunes)
+    """
+    for dia in range(1, dias_en_mes + 1):
+        # Columnas comunes a todos los registros del día
+        prefijo = (sucursal, anio, mes, dia)
+        for valores in fuente:
+            if cantidades:
+                valores = list(valores)
+                for i in cantidades:
+                    valores[i] = distribuir_cantidad_entre_dias(valores[i], dia, dias_en_mes)
+            yield (*prefijo, *valores, created_by)
 
 
 def insertar_ventas_mensual_dividido(data, sucursal, anio, mes, dias_en_mes, created_by):
@@ -523,185 +649,48 @@ def insertar_ventas_mensual_dividido(data, sucursal, anio, mes, dias_en_mes, cre
     Returns:
         dict: Resumen de registros insertados (total en todas las tablas para todos los días)
     """
-    connection = None
     try:
-        # Crear conexión DIRECTA sin RealDictCursor para máxima velocidad en inserts
-        connection = psycopg2.connect(
-            host=Config.POSTGRES_HOST,
-            port=Config.POSTGRES_PORT,
-            user=Config.POSTGRES_USER,
-            password=Config.POSTGRES_PASSWORD,
-            database=Config.POSTGRES_DATABASE
-            # NO usar cursor_factory=RealDictCursor - es solo para SELECTs
-        )
-        cursor = connection.cursor()
-
         resumen = {}
+        cargas = []
 
         logger.info(f"Iniciando inserción OPTIMIZADA mensual dividida: {dias_en_mes} días")
-        logger.info(f"Construyendo registros para TODOS los días en memoria...")
 
-        # OPTIMIZACIÓN: Construir TODOS los registros de TODOS los días para CADA tabla
+        # OPTIMIZACIÓN: un solo COPY por tabla con TODOS los días
         # Esto reduce de 248 operaciones (31 días × 8 tablas) a solo 8 operaciones (1 por tabla)
+        # Los registros se generan conforme COPY los lee, sin armar listas en memoria
+        # y todas las tablas se cargan en una sola transacción (ver _copiar_tablas)
 
-        # 1. Ventas por hora - TODOS los días a la vez (usando COPY - ultra rápido)
-        if data.get('ventas_por_hora'):
-            logger.info("Insertando ventas_por_hora para todos los días...")
-            registros = [
-                (sucursal, anio, mes, dia, v['hora'],
-                 Decimal(str(v['monto'])) / Decimal(str(dias_en_mes)), created_by)
-                for dia in range(1, dias_en_mes + 1)
-                for v in data['ventas_por_hora']
-            ]
-            bulk_insert_copy(cursor, 'LealSilver.ventas_por_hora',
-                           ['sucursal', 'anio', 'mes', 'dia', 'hora', 'monto', 'created_by'],
-                           registros)
-            resumen['ventas_por_hora'] = len(registros)
-            logger.info(f"✓ Insertados {len(registros)} registros en ventas_por_hora")
-
-        # 2. Ventas por platillo - TODOS los días a la vez (usando COPY - ultra rápido)
-        if data.get('ventas_por_platillo'):
-            logger.info("Insertando ventas_por_platillo para todos los días...")
-            registros = [
-                (sucursal, anio, mes, dia, v['clave_platillo'], v['nombre_platillo'],
-                 v['grupo'], distribuir_cantidad_entre_dias(v['cantidad'], dia, dias_en_mes),
-                 Decimal(str(v['subtotal'])) / Decimal(str(dias_en_mes)),
-                 Decimal(str(v['porcentaje'])), created_by)
-                for dia in range(1, dias_en_mes + 1)
-                for v in data['ventas_por_platillo']
-            ]
-            bulk_insert_copy(cursor, 'LealSilver.ventas_por_platillo',
-                           ['sucursal', 'anio', 'mes', 'dia', 'clave_platillo', 'nombre_platillo',
-                            'grupo', 'cantidad', 'subtotal', 'porcentaje', 'created_by'],
-                           registros)
-            resumen['ventas_por_platillo'] = len(registros)
-            logger.info(f"✓ Insertados {len(registros)} registros en ventas_por_platillo")
-
-        # 3. Ventas por grupo - TODOS los días a la vez (usando COPY - ultra rápido)
-        if data.get('ventas_por_grupo'):
-            logger.info("Insertando ventas_por_grupo para todos los días...")
-            registros = [
-                (sucursal, anio, mes, dia, v['grupo'],
-                 Decimal(str(v['subtotal'])) / Decimal(str(dias_en_mes)), created_by)
-                for dia in range(1, dias_en_mes + 1)
-                for v in data['ventas_por_grupo']
-            ]
-            bulk_insert_copy(cursor, 'LealSilver.ventas_por_grupo',
-                           ['sucursal', 'anio', 'mes', 'dia', 'grupo', 'subtotal', 'created_by'],
-                           registros)
-            resumen['ventas_por_grupo'] = len(registros)
-            logger.info(f"✓ Insertados {len(registros)} registros en ventas_por_grupo")
-
-        # 4. Ventas por tipo de grupo - TODOS los días a la vez (usando COPY - ultra rápido)
-        if data.get('ventas_por_tipo_grupo'):
-            logger.info("Insertando ventas_por_tipo_grupo para todos los días...")
-            registros = [
-                (sucursal, anio, mes, dia, v['grupo'],
-                 distribuir_cantidad_entre_dias(v['cantidad'], dia, dias_en_mes),
-                 Decimal(str(v['subtotal'])) / Decimal(str(dias_en_mes)),
-                 Decimal(str(v['iva'])) / Decimal(str(dias_en_mes)),
-                 Decimal(str(v['total'])) / Decimal(str(dias_en_mes)),
-                 Decimal(str(v['porcentaje'])), created_by)
-                for dia in range(1, dias_en_mes + 1)
-                for v in data['ventas_por_tipo_grupo']
-            ]
-            bulk_insert_copy(cursor, 'LealSilver.ventas_por_tipo_grupo',
-                           ['sucursal', 'anio', 'mes', 'dia', 'grupo', 'cantidad', 'subtotal',
-                            'iva', 'total', 'porcentaje', 'created_by'],
-                           registros)
-            resumen['ventas_por_tipo_grupo'] = len(registros)
-            logger.info(f"✓ Insertados {len(registros)} registros en ventas_por_tipo_grupo")
-
-        # 5. Ventas por tipo de pago - TODOS los días a la vez (usando COPY - ultra rápido)
-        if data.get('ventas_por_tipo_pago'):
-            logger.info("Insertando ventas_por_tipo_pago para todos los días...")
-            registros = [
-                (sucursal, anio, mes, dia, v['tipo_pago'],
-                 Decimal(str(v['total'])) / Decimal(str(dias_en_mes)),
-                 Decimal(str(v['porcentaje'])), created_by)
-                for dia in range(1, dias_en_mes + 1)
-                for v in data['ventas_por_tipo_pago']
-            ]
-            bulk_insert_copy(cursor, 'LealSilver.ventas_por_tipo_pago',
-                           ['sucursal', 'anio', 'mes', 'dia', 'tipo_pago', 'total', 'porcentaje', 'created_by'],
-                           registros)
-            resumen['ventas_por_tipo_pago'] = len(registros)
-            logger.info(f"✓ Insertados {len(registros)} registros en ventas_por_tipo_pago")
-
-        # 6. Ventas por usuario - TODOS los días a la vez (usando COPY - ultra rápido)
-        if data.get('ventas_por_usuario'):
-            logger.info("Insertando ventas_por_usuario para todos los días...")
-            registros = [
-                (sucursal, anio, mes, dia, v['usuario'],
-                 Decimal(str(v['subtotal'])) / Decimal(str(dias_en_mes)),
-                 Decimal(str(v['iva'])) / Decimal(str(dias_en_mes)),
-                 Decimal(str(v['total'])) / Decimal(str(dias_en_mes)),
-                 distribuir_cantidad_entre_dias(v['num_cuentas'], dia, dias_en_mes),
-                 Decimal(str(v['ticket_promedio'])) / Decimal(str(dias_en_mes)),
-                 distribuir_cantidad_entre_dias(v['num_personas'], dia, dias_en_mes),
-                 Decimal(str(v['promedio_por_persona'])) / Decimal(str(dias_en_mes)),
-                 Decimal(str(v['porcentaje'])), created_by)
-                for dia in range(1, dias_en_mes + 1)
-                for v in data['ventas_por_usuario']
-            ]
-            bulk_insert_copy(cursor, 'LealSilver.ventas_por_usuario',
-                           ['sucursal', 'anio', 'mes', 'dia', 'usuario', 'subtotal', 'iva', 'total',
-                            'num_cuentas', 'ticket_promedio', 'num_personas', 'promedio_por_persona',
-                            'porcentaje', 'created_by'],
-                           registros)
-            resumen['ventas_por_usuario'] = len(registros)
-            logger.info(f"✓ Insertados {len(registros)} registros en ventas_por_usuario")
-
-        # 7. Ventas por cajero - TODOS los días a la vez (usando COPY - ultra rápido)
-        if data.get('ventas_por_cajero'):
-            logger.info("Insertando ventas_por_cajero para todos los días...")
-            registros = [
-                (sucursal, anio, mes, dia, v['cajero'],
-                 Decimal(str(v['subtotal'])) / Decimal(str(dias_en_mes)),
-                 Decimal(str(v['iva'])) / Decimal(str(dias_en_mes)),
-                 Decimal(str(v['total'])) / Decimal(str(dias_en_mes)),
-                 distribuir_cantidad_entre_dias(v['cantidad_transacciones'], dia, dias_en_mes),
-                 Decimal(str(v['porcentaje'])), created_by)
-                for dia in range(1, dias_en_mes + 1)
-                for v in data['ventas_por_cajero']
-            ]
-            bulk_insert_copy(cursor, 'LealSilver.ventas_por_cajero',
-                           ['sucursal', 'anio', 'mes', 'dia', 'cajero', 'subtotal', 'iva', 'total',
-                            'cantidad_transacciones', 'porcentaje', 'created_by'],
-                           registros)
-            resumen['ventas_por_cajero'] = len(registros)
-            logger.info(f"✓ Insertados {len(registros)} registros en ventas_por_cajero")
-
-        # 8. Ventas por modificador - TODOS los días a la vez (usando COPY - ultra rápido)
-        if data.get('ventas_por_modificador'):
-            logger.info("Insertando ventas_por_modificador para todos los días...")
-            registros = [
-                (sucursal, anio, mes, dia, v['grupo'], v['clave_platillo'],
-                 v['nombre_platillo'], v.get('tamano'),
-                 distribuir_cantidad_entre_dias(v['cantidad'], dia, dias_en_mes),
-                 Decimal(str(v['subtotal'])) / Decimal(str(dias_en_mes)), created_by)
-                for dia in range(1, dias_en_mes + 1)
-                for v in data['ventas_por_modificador']
+        # La división entre días y el texto para COPY se calculan una sola vez
+        # por registro fuente; dentro del ciclo de días solo cambia el día
+        divisor = Decimal(dias_en_mes)
+
+        for seccion, campos in _SECCIONES_VENTAS:
+            filas = data.get(seccion)
+            if not filas:
+                continue
+
+            fuente = [
+                tuple(
+                    _dividir_texto(v[campo], divisor) if tipo == _MONTO else v.get(campo)
+                    for campo, tipo in campos
+                )
+                for v in filas
             ]
-            bulk_insert_copy(cursor, 'LealSilver.ventas_por_modificador',
-                           ['sucursal', 'anio', 'mes', 'dia', 'grupo', 'clave_platillo', 'nombre_platillo',
-                            'tamano', 'cantidad', 'subtotal', 'created_by'],
-                           registros)
-            resumen['ventas_por_modificador'] = len(registros)
-            logger.info(f"✓ Insertados {len(registros)} registros en ventas_por_modificador")
+            cantidades = [i for i, (_, tipo) in enumerate(campos) if tipo == _CANTIDAD]
+
+            # Se guarda cómo generar los registros (no el generador) para poder
+            # repetirlos si hay que cambiar de COPY a INSERT
+            generar_registros = functools.partial(
+                _filas_por_dia, fuente, cantidades, sucursal, anio, mes, dias_en_mes, created_by
+            )
+            cargas.append((seccion, generar_registros))
+            resumen[seccion] = dias_en_mes * len(fuente)
 
-        # Commit único al final
-        connection.commit()
-        cursor.close()
+        _copiar_tablas(cargas)
 
         logger.info(f"Transacción mensual completada exitosamente. Resumen: {resumen}")
         return resumen
 
     except Exception as e:
-        if connection:
-            connection.rollback()
         logger.error(f"Error insertando datos mensuales divididos en LealSilver: {str(e)}")
         raise
-    finally:
-        if connection:
-            connection.close()
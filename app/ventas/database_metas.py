@@ -2,8 +2,9 @@
 Funciones de base de datos para gestión de metas - PostgreSQL
 """
 import logging
-from decimal import Decimal
-from database import execute_query, get_db_connection, decimal_to_float
+from datetime import date
+from psycopg2.extras import execute_values
+from database import execute_query, get_db_connection, month_range
 
 logger = logging.getLogger(__name__)
 
@@ -27,135 +28,170 @@ def obtener_metas_mes(mes, anio, sucursal=None):
                     sucursal,
                     COALESCE(SUM(total), 0) as ventas_reales
                 FROM "LealSilver".ventas
-                WHERE EXTRACT(MONTH FROM fecha) = %s
-                AND EXTRACT(YEAR FROM fecha) = %s
+                WHERE fecha >= %s AND fecha < %s
                 GROUP BY sucursal
-            )
-            SELECT
-                m.id,
-                m.sucursal,
-                m.mes,
-                m.anio,
-                m.meta_monto,
-                m.tipo_meta,
-                m.activa,
-                m.comentarios,
-                m.usuario_id,
-                m.fecha_creacion,
-                m.fecha_modificacion,
-                COALESCE(v.ventas_reales, 0) as ventas_reales,
-                CASE
-                    WHEN m.meta_monto > 0 THEN
-                        ROUND((COALESCE(v.ventas_reales, 0) / m.meta_monto * 100)::numeric, 2)
-                    ELSE 0
-                END as porcentaje_cumplimiento,
-                (COALESCE(v.ventas_reales, 0) - m.meta_monto) as diferencia
-            FROM "LealSilver".metas_mensuales m
-            LEFT JOIN ventas_periodo v ON m.sucursal = v.sucursal
-            WHERE m.mes = %s
-            AND m.anio = %s
-            AND m.activa = TRUE
+            ),
+            metas_periodo AS (
+                SELECT
+                    m.id,
+                    m.sucursal,
+                    m.mes,
+                    m.anio,
+                    m.meta_monto::float8 AS meta_monto,
+                    m.tipo_meta,
+                    m.activa,
+                    m.comentarios,
+                    m.usuario_id,
+                    m.fecha_creacion,
+                    m.fecha_modificacion,
+                    COALESCE(v.ventas_reales, 0)::float8 as ventas_reales,
+                    (CASE
+                        WHEN m.meta_monto > 0 THEN
+                            ROUND((COALESCE(v.ventas_reales, 0) / m.meta_monto * 100)::numeric, 2)
+                        ELSE 0
+                    END)::float8 as porcentaje_cumplimiento,
+                    (COALESCE(v.ventas_reales, 0) - m.meta_monto)::float8 as diferencia
+                FROM "LealSilver".metas_mensuales m
+                LEFT JOIN ventas_periodo v ON m.sucursal = v.sucursal
+                WHERE m.mes = %s
+                AND m.anio = %s
+                AND m.activa = TRUE
         """
 
-        params = [mes, anio, mes, anio]
+        # Rango de fechas en lugar de EXTRACT para poder usar el índice de fecha
+        inicio, fin = month_range(mes, anio)
+        params = [inicio, fin, mes, anio]
 
         if sucursal:
             query += " AND m.sucursal = %s"
             params.append(sucursal)
 
-        query += " ORDER BY m.sucursal"
-
-        results = execute_query(query, tuple(params))
+        # Determinar estado según cumplimiento
+        query += """
+            )
+            SELECT
+                *,
+                CASE
+                    WHEN porcentaje_cumplimiento >= 100 THEN 'cumplido'
+                    WHEN porcentaje_cumplimiento >= 50 THEN 'en_progreso'
+                    ELSE 'requiere_accion'
+                END as estado,
+                CASE
+                    WHEN porcentaje_cumplimiento >= 100 THEN 'Cumplido'
+                    WHEN porcentaje_cumplimiento >= 50 THEN 'En Progreso'
+                    ELSE 'Requiere Acción'
+                END as estado_texto,
+                CASE
+                    WHEN porcentaje_cumplimiento >= 100 THEN '#28a745'  -- Verde
+                    WHEN porcentaje_cumplimiento >= 50 THEN '#ffc107'   -- Amarillo
+                    ELSE '#dc3545'                                      -- Rojo
+                END as color_estado
+            FROM metas_periodo
+            ORDER BY sucursal
+        """
 
-        metas = []
-        for row in results:
-            meta = dict(row)
-            meta['meta_monto'] = decimal_to_float(meta['meta_monto'])
-            meta['ventas_reales'] = decimal_to_float(meta['ventas_reales'])
-            meta['porcentaje_cumplimiento'] = decimal_to_float(meta['porcentaje_cumplimiento'])
-            meta['diferencia'] = decimal_to_float(meta['diferencia'])
-
-            # Determinar estado según cumplimiento
-            cumplimiento = meta['porcentaje_cumplimiento']
-            if cumplimiento >= 100:
-                meta['estado'] = 'cumplido'
-                meta['estado_texto'] = 'Cumplido'
-                meta['color_estado'] = '#28a745'  # Verde
-            elif cumplimiento >= 50:
-                meta['estado'] = 'en_progreso'
-                meta['estado_texto'] = 'En Progreso'
-                meta['color_estado'] = '#ffc107'  # Amarillo
-            else:
-                meta['estado'] = 'requiere_accion'
-                meta['estado_texto'] = 'Requiere Acción'
-                meta['color_estado'] = '#dc3545'  # Rojo
-
-            metas.append(meta)
-
-        return metas
+        # Los montos ya llegan como float (::float8) y el estado calculado
+        return execute_query(query, tuple(params))
 
     except Exception as e:
         logger.error(f"Error obteniendo metas del mes {mes}/{anio}: {str(e)}")
         raise
 
 
-def insertar_meta(sucursal, mes, anio, meta_monto, tipo_meta, comentarios, usuario_id):
+def upsert_metas(metas, usuario_id):
     """
-    Insertar nueva meta
+    Insertar o actualizar varias metas en una sola sentencia
+
+    Si ya existe una meta para la misma sucursal / mes / año / tipo
+    (uk_meta_sucursal_periodo), se actualizan su monto y comentarios y se
+    vuelve a activar. Si la lista repite una meta, gana la última.
 
     Args:
-        sucursal (str): Sucursal
-        mes (int): Mes (1-12)
-        anio (int): Año
-        meta_monto (float): Monto objetivo
-        tipo_meta (str): Tipo de meta
-        comentarios (str): Comentarios
+        metas (list): Lista de dicts con sucursal, mes, anio, meta_monto,
+            tipo_meta y comentarios
         usuario_id (int): ID del usuario
 
     Returns:
-        int: ID de la meta insertada
+        list: IDs de las metas insertadas o actualizadas, una por meta distinta
     """
-    connection = None
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-
         query = """
             INSERT INTO "LealSilver".metas_mensuales
             (sucursal, mes, anio, meta_monto, tipo_meta, comentarios, usuario_id)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            VALUES %s
+            ON CONFLICT ON CONSTRAINT uk_meta_sucursal_periodo DO UPDATE
+            SET meta_monto = EXCLUDED.meta_monto,
+                comentarios = EXCLUDED.comentarios,
+                activa = TRUE
             RETURNING id
         """
 
-        cursor.execute(query, (
-            sucursal,
-            mes,
-            anio,
-            Decimal(str(meta_monto)),
-            tipo_meta,
-            comentarios or '',
-            usuario_id
-        ))
-
-        result = cursor.fetchone()
-        meta_id = result['id'] if isinstance(result, dict) else result[0]
-
-        connection.commit()
-        connection.close()
+        # Una sola fila por meta: ON CONFLICT no puede actualizar la misma
+        # fila dos veces en una sentencia
+        por_meta = {}
+        for meta in metas:
+            clave = (meta['sucursal'], meta['mes'], meta['anio'], meta['tipo_meta'])
+            por_meta[clave] = (
+                meta['sucursal'],
+                meta['mes'],
+                meta['anio'],
+                meta['meta_monto'],
+                meta['tipo_meta'],
+                meta.get('comentarios') or '',
+                usuario_id
+            )
+        registros = list(por_meta.values())
+
+        if not registros:
+            return []
+
+        with get_db_connection() as connection:
+            cursor = connection.cursor()
+            # El servidor convierte el monto a numeric (sin pasar por Decimal)
+            results = execute_values(
+                cursor, query, registros,
+                template='(%s, %s, %s, %s::numeric, %s, %s, %s)',
+                page_size=len(registros), fetch=True
+            )
 
-        logger.info(f"Meta insertada con ID {meta_id}: {sucursal} - {mes}/{anio} - ${meta_monto}")
-        return meta_id
+        ids = [row['id'] for row in results]
+        logger.info(f"{len(ids)} metas guardadas por el usuario {usuario_id}")
+        return ids
 
     except Exception as e:
-        logger.error(f"Error insertando meta: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        if connection:
-            connection.rollback()
-            connection.close()
+        logger.error(f"Error guardando metas: {str(e)}")
         raise
 
 
+def insertar_meta(sucursal, mes, anio, meta_monto, tipo_meta, comentarios, usuario_id):
+    """
+    Insertar nueva meta (o actualizar la meta activa del mismo mes)
+
+    Args:
+        sucursal (str): Sucursal
+        mes (int): Mes (1-12)
+        anio (int): Año
+        meta_monto (float): Monto objetivo
+        tipo_meta (str): Tipo de meta
+        comentarios (str): Comentarios
+        usuario_id (int): ID del usuario
+
+    Returns:
+        int: ID de la meta insertada
+    """
+    meta_id, = upsert_metas([{
+        'sucursal': sucursal,
+        'mes': mes,
+        'anio': anio,
+        'meta_monto': meta_monto,
+        'tipo_meta': tipo_meta,
+        'comentarios': comentarios
+    }], usuario_id)
+
+    logger.info(f"Meta insertada con ID {meta_id}: {sucursal} - {mes}/{anio} - ${meta_monto}")
+    return meta_id
+
+
 def actualizar_meta(meta_id, sucursal, mes, anio, meta_monto, tipo_meta, comentarios):
     """
     Actualizar una meta existente
@@ -172,35 +208,32 @@ def actualizar_meta(meta_id, sucursal, mes, anio, meta_monto, tipo_meta, comenta
     Returns:
         bool: True si se actualizó correctamente
     """
-    connection = None
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-
         query = """
             UPDATE "LealSilver".metas_mensuales
             SET sucursal = %s,
                 mes = %s,
                 anio = %s,
-                meta_monto = %s,
+                meta_monto = %s::numeric,
                 tipo_meta = %s,
                 comentarios = %s
             WHERE id = %s
         """
 
-        cursor.execute(query, (
-            sucursal,
-            mes,
-            anio,
-            Decimal(str(meta_monto)),
-            tipo_meta,
-            comentarios or '',
-            meta_id
-        ))
+        with get_db_connection() as connection:
+            cursor = connection.cursor()
 
-        connection.commit()
-        rows_affected = cursor.rowcount
-        connection.close()
+            cursor.execute(query, (
+                sucursal,
+                mes,
+                anio,
+                meta_monto,
+                tipo_meta,
+                comentarios or '',
+                meta_id
+            ))
+
+            rows_affected = cursor.rowcount
 
         logger.info(f"Meta {meta_id} actualizada exitosamente")
         return rows_affected > 0
@@ -209,9 +242,6 @@ def actualizar_meta(meta_id, sucursal, mes, anio, meta_monto, tipo_meta, comenta
         logger.error(f"Error actualizando meta {meta_id}: {str(e)}")
         import traceback
         traceback.print_exc()
-        if connection:
-            connection.rollback()
-            connection.close()
         raise
 
 
@@ -225,17 +255,13 @@ def eliminar_meta(meta_id):
     Returns:
         bool: True si se desactivó correctamente
     """
-    connection = None
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-
         query = 'UPDATE "LealSilver".metas_mensuales SET activa = FALSE WHERE id = %s'
-        cursor.execute(query, (meta_id,))
 
-        connection.commit()
-        rows_affected = cursor.rowcount
-        connection.close()
+        with get_db_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(query, (meta_id,))
+            rows_affected = cursor.rowcount
 
         logger.info(f"Meta {meta_id} desactivada exitosamente")
         return rows_affected > 0
@@ -244,9 +270,6 @@ def eliminar_meta(meta_id):
         logger.error(f"Error desactivando meta {meta_id}: {str(e)}")
         import traceback
         traceback.print_exc()
-        if connection:
-            connection.rollback()
-            connection.close()
         raise
 
 
@@ -263,7 +286,7 @@ def obtener_meta_por_id(meta_id):
     try:
         query = """
             SELECT
-                id, sucursal, mes, anio, meta_monto, tipo_meta,
+                id, sucursal, mes, anio, meta_monto::float8 AS meta_monto, tipo_meta,
                 activa, comentarios, usuario_id, fecha_creacion, fecha_modificacion
             FROM "LealSilver".metas_mensuales
             WHERE id = %s
@@ -272,9 +295,7 @@ def obtener_meta_por_id(meta_id):
         results = execute_query(query, (meta_id,))
 
         if results:
-            meta = dict(results[0])
-            meta['meta_monto'] = decimal_to_float(meta['meta_monto'])
-            return meta
+            return results[0]
 
         return None
 
@@ -302,7 +323,7 @@ def obtener_resumen_metas_anual(anio, sucursal=None):
                     EXTRACT(MONTH FROM fecha) as mes,
                     COALESCE(SUM(total), 0) as ventas_mes
                 FROM "LealSilver".ventas
-                WHERE EXTRACT(YEAR FROM fecha) = %s
+                WHERE fecha >= %s AND fecha < %s
                 GROUP BY sucursal, EXTRACT(MONTH FROM fecha)
             ),
             metas_con_ventas AS (
@@ -322,7 +343,7 @@ def obtener_resumen_metas_anual(anio, sucursal=None):
                 AND m.activa = TRUE
         """
 
-        params = [anio, anio]
+        params = [date(anio, 1, 1), date(anio + 1, 1, 1), anio]
 
         if sucursal:
             query += " AND m.sucursal = %s"
@@ -333,9 +354,9 @@ def obtener_resumen_metas_anual(anio, sucursal=None):
             SELECT
                 sucursal,
                 COUNT(*) as meses_con_meta,
-                SUM(meta_monto) as meta_total,
-                SUM(ventas_reales) as ventas_totales,
-                ROUND(AVG(cumplimiento), 2) as cumplimiento_promedio,
+                SUM(meta_monto)::float8 as meta_total,
+                SUM(ventas_reales)::float8 as ventas_totales,
+                ROUND(AVG(cumplimiento), 2)::float8 as cumplimiento_promedio,
                 SUM(CASE WHEN cumplimiento >= 100 THEN 1 ELSE 0 END) as meses_cumplidos
             FROM metas_con_ventas
             GROUP BY sucursal
@@ -346,13 +367,12 @@ def obtener_resumen_metas_anual(anio, sucursal=None):
 
         resumen = {}
         for row in results:
-            data = dict(row)
-            resumen[data['sucursal']] = {
-                'meses_con_meta': data['meses_con_meta'],
-                'meta_total': decimal_to_float(data['meta_total']),
-                'ventas_totales': decimal_to_float(data['ventas_totales']),
-                'cumplimiento_promedio': decimal_to_float(data['cumplimiento_promedio']),
-                'meses_cumplidos': data['meses_cumplidos']
+            resumen[row['sucursal']] = {
+                'meses_con_meta': row['meses_con_meta'],
+                'meta_total': row['meta_total'],
+                'ventas_totales': row['ventas_totales'],
+                'cumplimiento_promedio': row['cumplimiento_promedio'],
+                'meses_cumplidos': row['meses_cumplidos']
             }
 
         return resumen
@@ -3,10 +3,114 @@ Procesador de archivos Excel de Resumen de Ventas
 Extrae las 8 secciones importantes del archivo
 """
 
+import importlib.util
+import os
+import numpy as np
 import pandas as pd
 from datetime import datetime
 from typing import Dict, List, Optional
 
+# python-calamine (Rust) lee el Excel mucho más rápido que openpyxl;
+# si no está instalado, pandas usa su motor por defecto
+_MOTOR_EXCEL = 'calamine' if importlib.util.find_spec('python_calamine') else None
+
+# Cómo se convierte cada columna de una sección
+_TEXTO = 'texto'                    # str(valor).strip()
+_TEXTO_OPCIONAL = 'texto_opcional'  # igual, pero None si la celda está vacía
+_ENTERO = 'entero'                  # int(valor); la fila se descarta si no es número
+_DECIMAL = 'decimal'                # float(valor)
+_DECIMAL_O_CERO = 'decimal_o_cero'  # float(valor), 0.0 si la celda está vacía
+
+# Las 8 secciones importantes: nombre -> (descripción, columnas, requeridas).
+# Columnas: (índice de columna, campo, tipo) en el orden del dict.
+# Requeridas: cuántas de las primeras columnas deben tener valor.
+SECCIONES = {
+    # 1. Columnas 2-3
+    'ventas_por_hora': ('ventas por hora', (
+        (2, 'hora', _TEXTO),
+        (3, 'monto', _DECIMAL),
+    ), 2),
+    # 2. Columnas 6-11
+    'ventas_por_platillo': ('ventas por platillo', (
+        (6, 'clave_platillo', _TEXTO),
+        (7, 'nombre_platillo', _TEXTO),
+        (8, 'grupo', _TEXTO),
+        (9, 'cantidad', _ENTERO),
+        (10, 'subtotal', _DECIMAL),
+        (11, 'porcentaje', _DECIMAL),
+    ), 1),
+    # 3. Columnas 24-25
+    'ventas_por_grupo': ('ventas por grupo', (
+        (24, 'grupo', _TEXTO),
+        (25, 'subtotal', _DECIMAL),
+    ), 1),
+    # 4. Columnas 38-43
+    'ventas_por_tipo_grupo': ('ventas por tipo de grupo', (
+        (38, 'grupo', _TEXTO),
+        (39, 'cantidad', _ENTERO),
+        (40, 'subtotal', _DECIMAL),
+        (41, 'iva', _DECIMAL),
+        (42, 'total', _DECIMAL),
+        (43, 'porcentaje', _DECIMAL),
+    ), 1),
+    # 5. Columnas 47-49
+    'ventas_por_tipo_pago': ('ventas por tipo de pago', (
+        (47, 'tipo_pago', _TEXTO),
+        (48, 'total', _DECIMAL),
+        (49, 'porcentaje', _DECIMAL_O_CERO),
+    ), 1),
+    # 6. Columnas 53-61
+    'ventas_por_usuario': ('ventas por usuario', (
+        (53, 'usuario', _TEXTO),
+        (54, 'subtotal', _DECIMAL),
+        (55, 'iva', _DECIMAL),
+        (56, 'total', _DECIMAL),
+        (57, 'num_cuentas', _ENTERO),
+        (58, 'ticket_promedio', _DECIMAL),
+        (59, 'num_personas', _ENTERO),
+        (60, 'promedio_por_persona', _DECIMAL),
+        (61, 'porcentaje', _DECIMAL),
+    ), 1),
+    # 7. Columnas 65-70
+    'ventas_por_cajero': ('ventas por cajero', (
+        (65, 'cajero', _TEXTO),
+        (66, 'subtotal', _DECIMAL),
+        (67, 'iva', _DECIMAL),
+        (68, 'total', _DECIMAL),
+        (69, 'cantidad_transacciones', _ENTERO),
+        (70, 'porcentaje', _DECIMAL),
+    ), 1),
+    # 8. Columnas 74-79
+    'ventas_por_modificador': ('ventas por modificador', (
+        (74, 'grupo', _TEXTO),
+        (75, 'clave_platillo', _TEXTO),
+        (76, 'nombre_platillo', _TEXTO),
+        (77, 'tamano', _TEXTO_OPCIONAL),
+        (78, 'cantidad', _ENTERO),
+        (79, 'subtotal', _DECIMAL),
+    ), 1),
+}
+
+# Columnas de la hoja que usa alguna sección (unas 40 de ~95)
+_COLUMNAS_USADAS = sorted({indice for _, columnas, _ in SECCIONES.values() for indice, _, _ in columnas})
+_POSICION_COLUMNA = {indice: posicion for posicion, indice in enumerate(_COLUMNAS_USADAS)}
+
+# Posición de las columnas de cada sección dentro de self.datos (que solo
+# trae _COLUMNAS_USADAS) y dtypes finales, armados una sola vez
+_INDICES_SECCION = {
+    nombre: [_POSICION_COLUMNA[indice] for indice, _, _ in columnas]
+    for nombre, (_, columnas, _) in SECCIONES.items()
+}
+
+_TIPOS_SECCION = {
+    nombre: {
+        campo: 'int64' if tipo == _ENTERO else 'float64'
+        for _, campo, tipo in columnas
+        if tipo in (_ENTERO, _DECIMAL, _DECIMAL_O_CERO)
+    }
+    for nombre, (_, columnas, _) in SECCIONES.items()
+}
+
 
 class ResumenVentasProcessor:
     """
@@ -14,10 +118,15 @@ class ResumenVentasProcessor:
     Extrae solo las 8 secciones importantes.
     """
 
-    def __init__(self, filepath: str):
-        """Inicializa el procesador con la ruta del archivo"""
+    def __init__(self, filepath, nombre_archivo: Optional[str] = None):
+        """
+        Inicializa el procesador con la ruta del archivo o un buffer en memoria
+        (en ese caso se indica el nombre original en nombre_archivo)
+        """
         self.filepath = filepath
+        self.nombre_archivo = nombre_archivo or os.path.basename(filepath)
         self.df = None
+        self.datos = None
         self.total_ventas = None
         self.fecha_carga = datetime.now()
         self.errors = []
@@ -28,7 +137,8 @@ class ResumenVentasProcessor:
             self.df = pd.read_excel(
                 self.filepath,
                 sheet_name='Resumen de Ventas',
-                header=None
+                header=None,
+                engine=_MOTOR_EXCEL
             )
             return True
         except Exception as e:
@@ -67,6 +177,9 @@ class ResumenVentasProcessor:
             self.errors.append(f"Error validando encabezados: {str(e)}")
             return False
 
+        # Filas de datos (desde fila 9, índice 8) como un solo arreglo de
+        # NumPy que comparten todas las secciones; solo las columnas usadas
+        self.datos = self.df.iloc[8:, _COLUMNAS_USADAS].to_numpy(dtype=object)
         return True
 
     def get_total_ventas(self) -> Optional[float]:
@@ -75,18 +188,21 @@ class ResumenVentasProcessor:
         Busca el texto 'Ventas' y el valor numérico asociado.
         """
         try:
-            # Buscar en las primeras 5 filas
-            for i in range(0, 5):
-                for j in range(0, 10):
-                    cell = self.df.iloc[i, j]
-                    if pd.notna(cell) and str(cell).strip().lower() == 'ventas':
-                        # Buscar valor numérico en área cercana
-                        for k in range(i, min(i+3, len(self.df))):
-                            for m in range(max(0, j-2), min(j+5, self.df.shape[1])):
-                                val = self.df.iloc[k, m]
-                                if pd.notna(val) and isinstance(val, (int, float)) and val > 1000:
-                                    self.total_ventas = float(val)
-                                    return self.total_ventas
+            # Buscar la etiqueta en las primeras 5 filas y 10 columnas de una vez
+            encabezado = self.df.iloc[:5, :10]
+            etiquetas = pd.Series(encabezado.to_numpy(dtype=object).ravel()).astype(str).str.strip().str.lower()
+
+            for posicion in np.flatnonzero(etiquetas.to_numpy() == 'ventas'):
+                i, j = divmod(int(posicion), encabezado.shape[1])
+
+                # Buscar valor numérico en área cercana (primer valor > 1000, por filas)
+                ventana = self.df.iloc[i:i+3, max(0, j-2):j+5].to_numpy(dtype=object).ravel()
+                numeros = pd.to_numeric(pd.Series(ventana), errors='coerce')
+                candidatos = numeros[numeros > 1000]
+
+                if not candidatos.empty:
+                    self.total_ventas = float(candidatos.iloc[0])
+                    return self.total_ventas
 
             self.errors.append("No se encontró el total de ventas en el archivo")
             return None
@@ -98,190 +214,79 @@ class ResumenVentasProcessor:
     # SECCIONES IMPORTANTES - EXTRAER
     # ========================================================================
 
-    def extract_ventas_por_hora(self) -> List[Dict]:
-        """1. Ventas por hora - Columnas 2-3"""
-        ventas = []
+    def _extraer(self, nombre: str) -> List[Dict]:
+        """
+        Extrae una sección completa columna por columna (sin recorrer celdas).
+
+        Args:
+            nombre: Nombre de la sección (ver SECCIONES)
+
+        Las filas con un número inválido se descartan, igual que al convertir
+        celda por celda con int()/float().
+        """
+        descripcion, columnas, requeridas = SECCIONES[nombre]
         try:
-            for idx in range(8, len(self.df)):  # Datos desde fila 9 (índice 8)
-                hora = self.df.iloc[idx, 2]
-                monto = self.df.iloc[idx, 3]
-
-                if pd.notna(hora) and pd.notna(monto):
-                    try:
-                        ventas.append({
-                            'hora': str(hora).strip(),
-                            'monto': float(monto)
-                        })
-                    except (ValueError, TypeError):
-                        continue  # Saltar filas con datos inválidos
+            sub = self.datos[:, _INDICES_SECCION[nombre]]
+            sub = sub[pd.notna(sub[:, :requeridas]).all(axis=1)]
+
+            valores = {}
+            invalidas = pd.Series(False, index=pd.RangeIndex(len(sub)))
+            for posicion, (_, campo, tipo) in enumerate(columnas):
+                serie = pd.Series(sub[:, posicion], dtype=object)
+
+                if tipo == _TEXTO:
+                    valores[campo] = serie.astype(str).str.strip()
+                elif tipo == _TEXTO_OPCIONAL:
+                    valores[campo] = serie.astype(str).str.strip().where(serie.notna(), None)
+                else:
+                    numeros = pd.to_numeric(serie, errors='coerce')
+                    if tipo == _ENTERO:
+                        invalidas |= numeros.isna()
+                    else:
+                        # float(NaN) es válido: solo se descartan los textos no numéricos
+                        invalidas |= numeros.isna() & serie.notna()
+                        if tipo == _DECIMAL_O_CERO:
+                            numeros = numeros.fillna(0.0)
+                    valores[campo] = numeros
+
+            resultado = pd.DataFrame(valores)[~invalidas].astype(_TIPOS_SECCION[nombre])
+
+            return resultado.to_dict('records')
         except Exception as e:
-            self.errors.append(f"Error en ventas por hora: {str(e)}")
+            self.errors.append(f"Error en {descripcion}: {str(e)}")
+            return []
 
-        return ventas
+    def extract_ventas_por_hora(self) -> List[Dict]:
+        """1. Ventas por hora - Columnas 2-3"""
+        return self._extraer('ventas_por_hora')
 
     def extract_ventas_por_platillo(self) -> List[Dict]:
         """2. Ventas por platillo/artículo - Columnas 6-11"""
-        ventas = []
-        try:
-            for idx in range(8, len(self.df)):
-                clave = self.df.iloc[idx, 6]
-
-                if pd.notna(clave):
-                    try:
-                        ventas.append({
-                            'clave_platillo': str(clave).strip(),
-                            'nombre_platillo': str(self.df.iloc[idx, 7]).strip(),
-                            'grupo': str(self.df.iloc[idx, 8]).strip(),
-                            'cantidad': int(self.df.iloc[idx, 9]),
-                            'subtotal': float(self.df.iloc[idx, 10]),
-                            'porcentaje': float(self.df.iloc[idx, 11])
-                        })
-                    except (ValueError, TypeError):
-                        continue
-        except Exception as e:
-            self.errors.append(f"Error en ventas por platillo: {str(e)}")
-
-        return ventas
+        return self._extraer('ventas_por_platillo')
 
     def extract_ventas_por_grupo(self) -> List[Dict]:
         """3. Ventas por grupo - Columnas 24-25"""
-        ventas = []
-        try:
-            for idx in range(8, len(self.df)):
-                grupo = self.df.iloc[idx, 24]
-
-                if pd.notna(grupo):
-                    try:
-                        ventas.append({
-                            'grupo': str(grupo).strip(),
-                            'subtotal': float(self.df.iloc[idx, 25])
-                        })
-                    except (ValueError, TypeError):
-                        continue
-        except Exception as e:
-            self.errors.append(f"Error en ventas por grupo: {str(e)}")
-
-        return ventas
+        return self._extraer('ventas_por_grupo')
 
     def extract_ventas_por_tipo_grupo(self) -> List[Dict]:
         """4. Ventas por tipo de grupo - Columnas 38-43"""
-        ventas = []
-        try:
-            for idx in range(8, len(self.df)):
-                grupo = self.df.iloc[idx, 38]
-
-                if pd.notna(grupo):
-                    try:
-                        ventas.append({
-                            'grupo': str(grupo).strip(),
-                            'cantidad': int(self.df.iloc[idx, 39]),
-                            'subtotal': float(self.df.iloc[idx, 40]),
-                            'iva': float(self.df.iloc[idx, 41]),
-                            'total': float(self.df.iloc[idx, 42]),
-                            'porcentaje': float(self.df.iloc[idx, 43])
-                        })
-                    except (ValueError, TypeError):
-                        continue
-        except Exception as e:
-            self.errors.append(f"Error en ventas por tipo de grupo: {str(e)}")
-
-        return ventas
+        return self._extraer('ventas_por_tipo_grupo')
 
     def extract_ventas_por_tipo_pago(self) -> List[Dict]:
         """5. Ventas por tipo de pago - Columnas 47-49"""
-        ventas = []
-        try:
-            for idx in range(8, len(self.df)):
-                pago = self.df.iloc[idx, 47]
-
-                if pd.notna(pago):
-                    try:
-                        ventas.append({
-                            'tipo_pago': str(pago).strip(),
-                            'total': float(self.df.iloc[idx, 48]),
-                            'porcentaje': float(self.df.iloc[idx, 49]) if pd.notna(self.df.iloc[idx, 49]) else 0.0
-                        })
-                    except (ValueError, TypeError):
-                        continue
-        except Exception as e:
-            self.errors.append(f"Error en ventas por tipo de pago: {str(e)}")
-
-        return ventas
+        return self._extraer('ventas_por_tipo_pago')
 
     def extract_ventas_por_usuario(self) -> List[Dict]:
         """6. Ventas por usuario - Columnas 53-61"""
-        ventas = []
-        try:
-            for idx in range(8, len(self.df)):
-                usuario = self.df.iloc[idx, 53]
-
-                if pd.notna(usuario):
-                    try:
-                        ventas.append({
-                            'usuario': str(usuario).strip(),
-                            'subtotal': float(self.df.iloc[idx, 54]),
-                            'iva': float(self.df.iloc[idx, 55]),
-                            'total': float(self.df.iloc[idx, 56]),
-                            'num_cuentas': int(self.df.iloc[idx, 57]),
-                            'ticket_promedio': float(self.df.iloc[idx, 58]),
-                            'num_personas': int(self.df.iloc[idx, 59]),
-                            'promedio_por_persona': float(self.df.iloc[idx, 60]),
-                            'porcentaje': float(self.df.iloc[idx, 61])
-                        })
-                    except (ValueError, TypeError):
-                        continue
-        except Exception as e:
-            self.errors.append(f"Error en ventas por usuario: {str(e)}")
-
-        return ventas
+        return self._extraer('ventas_por_usuario')
 
     def extract_ventas_por_cajero(self) -> List[Dict]:
         """7. Ventas por cajero - Columnas 65-70"""
-        ventas = []
-        try:
-            for idx in range(8, len(self.df)):
-                cajero = self.df.iloc[idx, 65]
-
-                if pd.notna(cajero):
-                    try:
-                        ventas.append({
-                            'cajero': str(cajero).strip(),
-                            'subtotal': float(self.df.iloc[idx, 66]),
-                            'iva': float(self.df.iloc[idx, 67]),
-                            'total': float(self.df.iloc[idx, 68]),
-                            'cantidad_transacciones': int(self.df.iloc[idx, 69]),
-                            'porcentaje': float(self.df.iloc[idx, 70])
-                        })
-                    except (ValueError, TypeError):
-                        continue
-        except Exception as e:
-            self.errors.append(f"Error en ventas por cajero: {str(e)}")
-
-        return ventas
+        return self._extraer('ventas_por_cajero')
 
     def extract_ventas_por_modificador(self) -> List[Dict]:
         """8. Ventas por modificador - Columnas 74-79"""
-        ventas = []
-        try:
-            for idx in range(8, len(self.df)):
-                grupo = self.df.iloc[idx, 74]
-
-                if pd.notna(grupo):
-                    try:
-                        ventas.append({
-                            'grupo': str(grupo).strip(),
-                            'clave_platillo': str(self.df.iloc[idx, 75]).strip(),
-                            'nombre_platillo': str(self.df.iloc[idx, 76]).strip(),
-                            'tamano': str(self.df.iloc[idx, 77]).strip() if pd.notna(self.df.iloc[idx, 77]) else None,
-                            'cantidad': int(self.df.iloc[idx, 78]),
-                            'subtotal': float(self.df.iloc[idx, 79])
-                        })
-                    except (ValueError, TypeError):
-                        continue
-        except Exception as e:
-            self.errors.append(f"Error en ventas por modificador: {str(e)}")
-
-        return ventas
+        return self._extraer('ventas_por_modificador')
 
     # ========================================================================
     # PROCESO COMPLETO
@@ -306,24 +311,23 @@ class ResumenVentasProcessor:
             return {'success': False, 'errors': self.errors}
 
         # Extraer todas las secciones importantes
+        secciones = {nombre: self._extraer(nombre) for nombre in SECCIONES}
+
         data = {
             'success': True,
             'metadata': {
-                'archivo': self.filepath.split('\\')[-1],  # Solo nombre del archivo
-                'fecha_carga': self.fecha_carga.strftime('%Y-%m-%d %H:%M:%S'),
+                'archivo': self.nombre_archivo,  # Solo nombre del archivo
+                'fecha_carga': self.fecha_carga.isoformat(sep=' ', timespec='seconds'),
                 'total_ventas': self.total_ventas,
                 'filas': self.df.shape[0],
                 'columnas': self.df.shape[1]
             },
-            'ventas_por_hora': self.extract_ventas_por_hora(),
-            'ventas_por_platillo': self.extract_ventas_por_platillo(),
-            'ventas_por_grupo': self.extract_ventas_por_grupo(),
-            'ventas_por_tipo_grupo': self.extract_ventas_por_tipo_grupo(),
-            'ventas_por_tipo_pago': self.extract_ventas_por_tipo_pago(),
-            'ventas_por_usuario': self.extract_ventas_por_usuario(),
-            'ventas_por_cajero': self.extract_ventas_por_cajero(),
-            'ventas_por_modificador': self.extract_ventas_por_modificador(),
+            **secciones,
             'errors': self.errors
         }
 
+        # La hoja ya no se necesita: liberarla antes de serializar la respuesta
+        self.df = None
+        self.datos = None
+
         return data
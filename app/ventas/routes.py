@@ -1,29 +1,56 @@
-from flask import render_template, request, redirect, url_for, flash, session, jsonify
+from flask import render_template, request, redirect, url_for, flash, session, jsonify, current_app
 from werkzeug.utils import secure_filename
-import os
+import hashlib
+import io
+import re
 import logging
 from datetime import datetime
 
 from . import ventas_bp
 from auth import login_required
+from cache import cache
 from .database import obtener_ventas, insertar_ventas, procesar_excel_ventas, insertar_ventas_leal_silver
-from .excel_processor import ResumenVentasProcessor
-from config import Config
+from .excel_processor import ResumenVentasProcessor, SECCIONES
+from reportes.database import refrescar_ventas_mensuales
+from contabilidad.database import obtener_estado_resultados
 
 logger = logging.getLogger(__name__)
 
-# Configuración de uploads
-UPLOAD_FOLDER = 'uploads'
+# Configuración de uploads (el archivo se procesa en memoria, no se guarda en disco)
 ALLOWED_EXTENSIONS = {'xlsx', 'xls'}
 MAX_FILE_SIZE = 16 * 1024 * 1024  # 16 MB
 
-# Crear carpeta de uploads si no existe
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Regex de las extensiones permitidas, compilado una sola vez
+_ALLOWED_RE = re.compile(r'\.(?:' + '|'.join(ALLOWED_EXTENSIONS) + r')$', re.IGNORECASE)
 
 
 def allowed_file(filename):
     """Valida que el archivo tenga una extensión permitida"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return _ALLOWED_RE.search(filename) is not None
+
+
+# Las 8 secciones que extrae ResumenVentasProcessor y que se guardan
+SECCIONES_VENTAS = tuple(SECCIONES)
+
+# Registros de cada sección que se muestran en el preview (None = todos, son pocos)
+PREVIEW_LIMITES = {
+    'ventas_por_hora': 5,
+    'ventas_por_platillo': 10,
+    'ventas_por_grupo': 5,
+    'ventas_por_tipo_grupo': None,
+    'ventas_por_tipo_pago': None,
+    'ventas_por_usuario': None,
+    'ventas_por_cajero': None,
+    'ventas_por_modificador': 10
+}
+
+# Tiempo que se conservan los datos de un preview para confirmar el guardado (segundos)
+PREVIEW_TTL = 30 * 60
+
+
+def _clave_preview(token):
+    """Clave de caché del preview de un archivo (por usuario y hash del contenido)"""
+    return f"preview:{session['user_id']}:{token}"
 
 
 @ventas_bp.route('/')
@@ -49,6 +76,15 @@ def cargar():
     return render_template('ventas/cargar.html')
 
 
+@ventas_bp.errorhandler(413)
+def archivo_demasiado_grande(error):
+    """Petición mayor a MAX_CONTENT_LENGTH (ver Config)"""
+    return jsonify({
+        'success': False,
+        'error': f'El archivo excede el tamaño máximo de {MAX_FILE_SIZE // (1024 * 1024)} MB'
+    }), 413
+
+
 @ventas_bp.route('/upload-preview', methods=['POST'])
 @login_required
 def upload_preview():
@@ -91,14 +127,13 @@ def upload_preview():
     if not allowed_file(file.filename):
         return jsonify({'success': False, 'error': 'Formato de archivo no permitido. Solo .xlsx o .xls'}), 400
 
-    filepath = None
     try:
-        # Guardar archivo temporalmente
+        # Leer el archivo en memoria: pandas lo procesa directo del buffer,
+        # sin escribirlo y volverlo a leer de disco
         filename = secure_filename(file.filename)
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(filepath)
+        contenido = file.read()
 
-        logger.info(f"Archivo guardado temporalmente en: {filepath}")
+        logger.info(f"Archivo recibido: {filename} ({len(contenido)} bytes)")
 
         # Log de metadatos según modo
         if modo_carga == 'diario':
@@ -107,16 +142,11 @@ def upload_preview():
             logger.info(f"Metadatos: Sucursal={sucursal}, Año={anio}, Mes={mes}, Modo={modo_carga}")
 
         # Procesar archivo con el procesador
-        processor = ResumenVentasProcessor(filepath)
+        processor = ResumenVentasProcessor(io.BytesIO(contenido), filename)
         data = processor.process_all()
 
         logger.info(f"Archivo procesado. Success: {data.get('success')}")
 
-        # Eliminar archivo temporal
-        if os.path.exists(filepath):
-            os.remove(filepath)
-            logger.info("Archivo temporal eliminado")
-
         if not data['success']:
             logger.error(f"Errores en procesamiento: {data.get('errors', [])}")
             return jsonify({
@@ -125,17 +155,18 @@ def upload_preview():
                 'details': data.get('errors', [])
             }), 400
 
+        # Guardar las secciones completas en caché con el hash del archivo como
+        # token: confirmar_guardado las toma de ahí en lugar de volver a recibirlas
+        token = hashlib.sha256(contenido).hexdigest()
+        guardado = cache.set(_clave_preview(token), {seccion: data[seccion] for seccion in SECCIONES_VENTAS},
+                             timeout=PREVIEW_TTL)
+
+        # Sin Redis cada worker tiene su propia caché y el guardado podría
+        # llegar a otro worker: solo entonces se envían los datos completos
+        cache_compartida = bool(guardado and current_app.config.get('CACHE_REDIS_URL'))
+
         # Calcular resumen de registros
-        resumen = {
-            'ventas_por_hora': len(data['ventas_por_hora']),
-            'ventas_por_platillo': len(data['ventas_por_platillo']),
-            'ventas_por_grupo': len(data['ventas_por_grupo']),
-            'ventas_por_tipo_grupo': len(data['ventas_por_tipo_grupo']),
-            'ventas_por_tipo_pago': len(data['ventas_por_tipo_pago']),
-            'ventas_por_usuario': len(data['ventas_por_usuario']),
-            'ventas_por_cajero': len(data['ventas_por_cajero']),
-            'ventas_por_modificador': len(data['ventas_por_modificador'])
-        }
+        resumen = {seccion: len(data[seccion]) for seccion in SECCIONES_VENTAS}
 
         # Agregar metadatos de identificación al metadata
         metadata_completo = data['metadata'].copy()
@@ -156,30 +187,19 @@ def upload_preview():
         response_data = {
             'success': True,
             'message': 'Archivo procesado correctamente',
+            'token': token,
             'metadata': metadata_completo,
             'resumen': resumen,
             'preview_data': {
-                'ventas_por_hora': data['ventas_por_hora'][:5],  # Primeros 5
-                'ventas_por_platillo': data['ventas_por_platillo'][:10],  # Primeros 10
-                'ventas_por_grupo': data['ventas_por_grupo'][:5],
-                'ventas_por_tipo_grupo': data['ventas_por_tipo_grupo'],  # Todos (son pocos)
-                'ventas_por_tipo_pago': data['ventas_por_tipo_pago'],  # Todos (son pocos)
-                'ventas_por_usuario': data['ventas_por_usuario'],  # Todos
-                'ventas_por_cajero': data['ventas_por_cajero'],  # Todos
-                'ventas_por_modificador': data['ventas_por_modificador'][:10]  # Primeros 10
+                seccion: data[seccion][:limite] for seccion, limite in PREVIEW_LIMITES.items()
             },
-            'warnings': data.get('errors', []),
-            # Incluir datos completos para el guardado posterior
-            'ventas_por_hora': data['ventas_por_hora'],
-            'ventas_por_platillo': data['ventas_por_platillo'],
-            'ventas_por_grupo': data['ventas_por_grupo'],
-            'ventas_por_tipo_grupo': data['ventas_por_tipo_grupo'],
-            'ventas_por_tipo_pago': data['ventas_por_tipo_pago'],
-            'ventas_por_usuario': data['ventas_por_usuario'],
-            'ventas_por_cajero': data['ventas_por_cajero'],
-            'ventas_por_modificador': data['ventas_por_modificador']
+            'warnings': data.get('errors', [])
         }
 
+        if not cache_compartida:
+            # Incluir datos completos para el guardado posterior
+            response_data.update({seccion: data[seccion] for seccion in SECCIONES_VENTAS})
+
         return jsonify(response_data), 200
 
     except Exception as e:
@@ -188,14 +208,6 @@ def upload_preview():
         logger.error(f"Error procesando archivo: {str(e)}")
         logger.error(f"Traceback completo:\n{error_details}")
 
-        # Limpiar archivo si existe
-        if filepath and os.path.exists(filepath):
-            try:
-                os.remove(filepath)
-                logger.info("Archivo temporal eliminado después de error")
-            except Exception as cleanup_error:
-                logger.error(f"Error limpiando archivo temporal: {str(cleanup_error)}")
-
         return jsonify({
             'success': False,
             'error': f'Error al procesar el archivo: {str(e)}',
@@ -220,10 +232,20 @@ def confirmar_guardado():
                 'error': 'No se recibieron datos'
             }), 400
 
+        # Datos del archivo ya procesados en upload_preview (por token); si ya
+        # no están en caché, se usan los que envió el cliente
+        token = request_data.get('token')
+        secciones = cache.get(_clave_preview(token)) if token else None
+        if secciones is not None:
+            request_data.update(secciones)
+        elif token and SECCIONES_VENTAS[0] not in request_data:
+            return jsonify({
+                'success': False,
+                'error': 'Los datos del archivo ya expiraron. Vuelve a analizar el archivo.'
+            }), 400
+
         # Validar estructura de datos
-        required_keys = ['metadata', 'ventas_por_hora', 'ventas_por_platillo',
-                        'ventas_por_grupo', 'ventas_por_tipo_grupo', 'ventas_por_tipo_pago',
-                        'ventas_por_usuario', 'ventas_por_cajero', 'ventas_por_modificador']
+        required_keys = ['metadata', *SECCIONES_VENTAS]
 
         for key in required_keys:
             if key not in request_data:
@@ -321,6 +343,19 @@ def confirmar_guardado():
 
         logger.info(f"Guardado exitoso. Resumen: {resumen}")
 
+        if token:
+            cache.delete(_clave_preview(token))
+
+        # El estado de resultados lee los ingresos de las ventas
+        obtener_estado_resultados.invalidar()
+
+        # Actualizar el pre-agregado del dashboard; si falla, los datos ya
+        # están guardados y se reflejarán en el siguiente refresco
+        try:
+            refrescar_ventas_mensuales()
+        except Exception as e:
+            logger.warning(f"No se pudo refrescar el dashboard de reportes: {str(e)}")
+
         return jsonify({
             'success': True,
             'message': 'Datos guardados exitosamente',
@@ -353,12 +388,21 @@ def api_ventas():
         ventas = obtener_ventas(
             limit=limit,
             fecha_inicio=fecha_inicio,
-            fecha_fin=fecha_fin
+            fecha_fin=fecha_fin,
+            cursor_fecha=request.args.get('cursor_fecha'),
+            cursor_id=request.args.get('cursor_id', type=int)
         )
 
+        # Cursor para pedir la siguiente página (None si ya no hay más)
+        siguiente = None
+        if len(ventas) == limit:
+            ultima = ventas[-1]
+            siguiente = {'cursor_fecha': ultima['fecha'], 'cursor_id': ultima['id']}
+
         return jsonify({
             'success': True,
-            'data': ventas
+            'data': ventas,
+            'siguiente': siguiente
         })
 
     except Exception as e:
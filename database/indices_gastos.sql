@@ -0,0 +1,31 @@
+-- ============================================================================
+-- ÍNDICES PARA GASTOS (CONTABILIDAD)
+-- Esquema: "LealSilver"
+-- Descripción: las consultas mensuales filtran con fecha >= inicio AND fecha < fin,
+-- por lo que pueden usar un rango sobre estos índices
+-- ============================================================================
+
+-- 1. Rango de fechas (gastos del mes, métricas)
+CREATE INDEX IF NOT EXISTS idx_gastos_fecha
+ON "LealSilver".gastos (fecha);
+
+-- 2. Estado de resultados: rango de fechas + tipo y categoría, con el monto incluido
+CREATE INDEX IF NOT EXISTS idx_gastos_fecha_tipo_categoria
+ON "LealSilver".gastos (fecha, tipo_gasto, categoria) INCLUDE (monto);
+
+-- 3. Búsquedas de INSUMOS / categorías sin importar mayúsculas
+CREATE INDEX IF NOT EXISTS idx_gastos_fecha_tipo_categoria_upper
+ON "LealSilver".gastos (fecha, tipo_gasto, UPPER(categoria));
+
+-- 4. Índices parciales por tipo de gasto (estado de resultados)
+CREATE INDEX IF NOT EXISTS idx_gastos_fijo_fecha
+ON "LealSilver".gastos (fecha, categoria) INCLUDE (monto)
+WHERE tipo_gasto = 'Fijo';
+
+CREATE INDEX IF NOT EXISTS idx_gastos_variable_fecha
+ON "LealSilver".gastos (fecha, categoria) INCLUDE (monto)
+WHERE tipo_gasto = 'Variable';
+
+-- 5. Gastos del mes filtrados por sucursal (igualdad primero, luego el rango)
+CREATE INDEX IF NOT EXISTS idx_gastos_sucursal_fecha
+ON "LealSilver".gastos (sucursal, fecha DESC);
@@ -0,0 +1,14 @@
+-- ============================================================================
+-- ÍNDICES PARA VENTAS
+-- Esquema: "LealSilver"
+-- Descripción: la validación de duplicados pregunta si ya hay datos de una
+-- sucursal en un mes o día (igualdad en las cuatro columnas)
+-- ============================================================================
+
+-- 1. Validación de duplicados por sucursal / año / mes / día
+CREATE INDEX IF NOT EXISTS idx_ventas_hora_sucursal_anio_mes_dia
+ON "LealSilver".ventas_por_hora (sucursal, anio, mes, dia);
+
+-- 2. Ventas reales por sucursal en un rango de fechas (metas mensuales y anuales)
+CREATE INDEX IF NOT EXISTS idx_ventas_sucursal_fecha
+ON "LealSilver".ventas (sucursal, fecha);
@@ -0,0 +1,35 @@
+-- ============================================================================
+-- VISTA MATERIALIZADA DE COSTO DE RECETAS (CATÁLOGO DE RECETAS)
+-- Esquema: "LealSilver"
+-- Descripción: une cada ingrediente de recetas con su costo en costo_producto
+-- y guarda el costo por ingrediente; el catálogo y el detalle de la receta
+-- leen de aquí en lugar de repetir el JOIN por nombre en cada consulta.
+-- La aplicación la refresca al consultar el catálogo cuando detecta
+-- escrituras nuevas en recetas o costo_producto (reportes.database.
+-- refrescar_recetas_costo); el rol de la aplicación debe ser dueño de la vista.
+-- ============================================================================
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS "LealSilver".mv_recetas_costo AS
+SELECT
+    r.codigo_platillo,
+    r.platillo,
+    r.producto,
+    r.cantidad,
+    r.unidad_medida,
+    cp.costo_presupuestado IS NULL AS sin_costo,
+    COALESCE(cp.costo_presupuestado, 0) AS costo_unitario,
+    COALESCE(cp.departamento, 'Sin clasificar') AS departamento,
+    ROUND(r.cantidad * COALESCE(cp.costo_presupuestado, 0), 4) AS costo_ingrediente
+FROM "LealSilver".recetas r
+LEFT JOIN "LealSilver".costo_producto cp ON r.producto = cp.nombre;
+
+-- Detalle de una receta
+CREATE INDEX IF NOT EXISTS idx_mv_recetas_costo_codigo
+ON "LealSilver".mv_recetas_costo (codigo_platillo);
+
+-- Quitar el refresco por triggers de versiones anteriores de este script:
+-- refrescaba la vista completa dentro de cada escritura (bloqueando el
+-- catálogo) y fallaba para roles que no son dueños de la vista
+DROP TRIGGER IF EXISTS trg_recetas_mv_costo ON "LealSilver".recetas;
+DROP TRIGGER IF EXISTS trg_costo_producto_mv_costo ON "LealSilver".costo_producto;
+DROP FUNCTION IF EXISTS "LealSilver".refrescar_mv_recetas_costo();
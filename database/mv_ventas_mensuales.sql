@@ -0,0 +1,29 @@
+-- ============================================================================
+-- VISTA MATERIALIZADA DE VENTAS MENSUALES (DASHBOARD DE REPORTES)
+-- Esquema: "LealSilver"
+-- Descripción: pre-agrega vw_ventas_diarias_por_platillo por mes, sucursal y
+-- platillo; el dashboard solo suma estas filas en lugar de recorrer la vista
+-- diaria. La aplicación la refresca después de cada carga de ventas.
+-- ============================================================================
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS "LealSilver".mv_ventas_mensuales AS
+SELECT
+    anio,
+    mes,
+    sucursal,
+    clave_platillo,
+    nombre_platillo,
+    grupo,
+    SUM(cantidad) AS cantidad,
+    SUM(venta) AS venta,
+    SUM(costo_venta) AS costo_venta,
+    SUM(ingreso_real) AS ingreso_real
+FROM "LealSilver".vw_ventas_diarias_por_platillo
+GROUP BY anio, mes, sucursal, clave_platillo, nombre_platillo, grupo;
+
+-- Índice único: requerido por REFRESH MATERIALIZED VIEW CONCURRENTLY
+CREATE UNIQUE INDEX IF NOT EXISTS uk_mv_ventas_mensuales
+ON "LealSilver".mv_ventas_mensuales (anio, mes, sucursal, clave_platillo, nombre_platillo, grupo);
+
+-- Refresco manual (sin bloquear lecturas del dashboard):
+-- REFRESH MATERIALIZED VIEW CONCURRENTLY "LealSilver".mv_ventas_mensuales;
@@ -0,0 +1,27 @@
+"""
+Configuración de Gunicorn (se carga automáticamente con `gunicorn wsgi:app`)
+
+Por defecto usa workers gevent: cada petición espera a PostgreSQL en un
+greenlet en lugar de bloquear un hilo. Se puede volver a hilos con
+GUNICORN_WORKER_CLASS=gthread.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 3))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+timeout = 120
+
+# Cada greenlet usa como máximo una conexión del pool, así que se limita la
+# concurrencia por worker al tamaño del pool para no agotarlo
+worker_connections = int(os.environ.get('DB_POOL_MAX', 20))
+
+# Solo aplica a workers gthread
+threads = int(os.environ.get('GUNICORN_THREADS', 2))
+
+
+def post_fork(server, worker):
+    """Hacer que psycopg2 ceda el control al hub de gevent mientras espera a la BD"""
+    if worker_class == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()